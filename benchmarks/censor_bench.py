@@ -0,0 +1,53 @@
+"""
+GeminiChad
+Copyright (c) 2024 @notV3NOM
+
+See the README.md file for licensing and disclaimer information.
+
+Compares the censor matcher with better_profanity on short and long prompts.
+
+Run from the repository root: python benchmarks/censor_bench.py
+"""
+
+import os
+import sys
+import random
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from better_profanity import profanity
+
+from components.censor import CENSOR
+
+WORDS = (
+    "the quick brown fox jumps over a lazy dog while we talk about python code "
+    "could you please explain how this function works and why it returns none"
+).split()
+
+
+def make_text(length, seed=0):
+    rng = random.Random(seed)
+    words = []
+    while sum(map(len, words)) + len(words) < length:
+        words.append(rng.choice(WORDS))
+    return " ".join(words)[:length]
+
+
+def bench(name, fn, text, number):
+    seconds = min(timeit.repeat(lambda: fn(text), number=number, repeat=3)) / number
+    print(f"{name:<18} {len(text):>6} chars  {seconds * 1e6:>12.1f} us/call")
+
+
+def main():
+    with open("static/censor_words.txt", "r") as file:
+        profanity.add_censor_words([line.strip() for line in file if line.strip()])
+
+    for length, number in ((80, 2000), (10_000, 20)):
+        text = make_text(length)
+        bench("better_profanity", profanity.contains_profanity, text, number)
+        bench("censor", CENSOR.contains, text, number)
+
+
+if __name__ == "__main__":
+    main()
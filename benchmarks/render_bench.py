@@ -0,0 +1,119 @@
+"""
+GeminiChad
+Copyright (c) 2024 @notV3NOM
+
+See the README.md file for licensing and disclaimer information.
+
+Compares the single-pass renderer with the previous temp-file pipeline on large
+responses with many code artifacts and images.
+
+Run from the repository root: python benchmarks/render_bench.py
+"""
+
+import io
+import os
+import re
+import sys
+import uuid
+import timeit
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("SERVER_ID", "0")
+
+import discord
+
+from components.images import IMAGE_REGISTRY
+from components.config import EXTENSION_MAPPING
+from components.render import MESSAGE_LIMIT, render_response
+
+ARTIFACT_PATTERN = r"```(\S+)\n(.*?)\n```"
+IMAGE_PATTERN = r"<IMAGE>(.*?)<\/IMAGE>"
+LANGUAGES = ("python", "javascript", "go", "cpp", "json")
+
+
+def legacy_render(llm_response, temp_dir):
+    """The previous pipeline: image pass, artifact pass through temp files, re-split"""
+    files = []
+    for index, image_match in enumerate(re.findall(IMAGE_PATTERN, llm_response)):
+        handle, _, image_prompt = image_match.partition("||")
+        files.append(
+            discord.File(io.BytesIO(IMAGE_REGISTRY.get(handle)), filename=handle)
+        )
+        embed = discord.Embed(title=image_prompt[:256])
+        embed.set_image(url="attachment://" + handle)
+        llm_response = llm_response.replace(
+            f"<IMAGE>{image_match}</IMAGE>", f"<<image_{index}>>"
+        )
+
+    paths = []
+    matches = re.findall(ARTIFACT_PATTERN, llm_response, re.DOTALL)
+    for index, (language, content) in enumerate(matches):
+        extension = EXTENSION_MAPPING.get(language.lower(), "txt")
+        path = os.path.join(temp_dir, f"temp-{uuid.uuid4()}.{extension}")
+        with open(path, "wb") as f:
+            f.write(content.strip().encode())
+        files.append(discord.File(path, filename=f"temp-{uuid.uuid4()}.{extension}"))
+        paths.append(path)
+        llm_response = llm_response.replace(
+            f"```{language}\n{content}\n```", f"<<artifact_{index}>>"
+        )
+    llm_response = re.sub(r"\n\s*\n", "\n\n", llm_response.strip())
+    llm_response = re.sub(r" +", " ", llm_response)
+
+    chunks = []
+    for chunk in re.split(r"(<<artifact_\d+>>|<<image_\d+>>)", llm_response):
+        while len(chunk) > MESSAGE_LIMIT:
+            index = chunk.rfind("\n", 0, MESSAGE_LIMIT)
+            index = MESSAGE_LIMIT if index == -1 else index
+            chunks.append(chunk[:index])
+            chunk = chunk[index:]
+        chunks.append(chunk)
+
+    for file in files:
+        file.close()
+    for path in paths:
+        os.remove(path)
+    return chunks
+
+
+def render(llm_response):
+    segments = render_response(llm_response)
+    for segment in segments:
+        if segment.file is not None:
+            segment.file.close()
+    return segments
+
+
+def make_response(artifacts, images):
+    handles = [
+        IMAGE_REGISTRY.register(b"\x89PNG" + bytes(50_000)) for _ in range(images)
+    ]
+    parts = []
+    for index in range(artifacts):
+        language = LANGUAGES[index % len(LANGUAGES)]
+        code = "\n".join(f"    value_{i} = compute({i}, {index})" for i in range(80))
+        parts.append(f"Step {index} explains the approach. " * 20)
+        parts.append("- first point\n  with details\n- second point\n")
+        parts.append(f"```{language}\n{code}\n```")
+        if index < images:
+            parts.append(f"<IMAGE>{handles[index]}||diagram {index}</IMAGE>")
+    return "\n\n".join(parts)
+
+
+def bench(name, fn, number):
+    seconds = min(timeit.repeat(fn, number=number, repeat=3)) / number
+    print(f"{name:<10} {seconds * 1e3:>10.2f} ms/response")
+
+
+def main():
+    with tempfile.TemporaryDirectory() as temp_dir:
+        for artifacts, images in ((5, 1), (40, 4)):
+            llm_response = make_response(artifacts, images)
+            print(f"{len(llm_response)} chars, {artifacts} artifacts, {images} images")
+            bench("legacy", lambda: legacy_render(llm_response, temp_dir), 20)
+            bench("render", lambda: render(llm_response), 20)
+
+
+if __name__ == "__main__":
+    main()
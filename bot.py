@@ -7,12 +7,23 @@ This work is licensed under the Creative Commons Attribution-NonCommercial-Share
 See the README.md file for licensing and disclaimer information.
 """
 
+from components.startup import STARTUP, prewarm
+
 import asyncio
 import discord
 
 from discord import app_commands
 
-from components.config import GUILD, DISCORD_BOT_TOKEN
+from components.config import (
+    GUILD,
+    DISCORD_BOT_TOKEN,
+    SESSION_SWEEP_INTERVAL,
+    PREWARM_IMPORTS,
+    logger,
+)
+from components.session import SESSIONS
+from components.http_client import bind_loop, close_http_session
+from components.lazy_client import warm_clients
 from components.reminder import ReminderManager
 from components.commands import setup_commands
 from components.events import setup_event_handlers
@@ -29,13 +40,37 @@ class GeminiChadBot(discord.Client):
         # self.tree.copy_global_to(guild=GUILD)
         # await self.tree.sync(guild=GUILD)
         await self.tree.sync()
+        bind_loop(self.loop)
+        self.loop.create_task(warm_clients())
+        self.loop.create_task(self.finish_startup())
         self.loop.create_task(self.check_reminders())
+        self.loop.create_task(self.sweep_sessions())
+
+    async def finish_startup(self):
+        await self.wait_until_ready()
+        STARTUP.mark_ready()
+        if PREWARM_IMPORTS:
+            await prewarm()
 
     async def check_reminders(self):
         await client.wait_until_ready()
-        while not client.is_closed():
-            await reminder_manager.check_reminders(client)
-            await asyncio.sleep(60)
+        await reminder_manager.run(client)
+
+    async def sweep_sessions(self):
+        while not self.is_closed():
+            await asyncio.sleep(SESSION_SWEEP_INTERVAL)
+            try:
+                await SESSIONS.sweep()
+            except Exception as e:
+                logger.exception(f"Session sweep failed {e}")
+
+    async def close(self):
+        try:
+            SESSIONS.flush()
+        except Exception as e:
+            logger.exception(f"Saving sessions failed {e}")
+        await close_http_session()
+        await super().close()
 
 
 intents = discord.Intents.default()
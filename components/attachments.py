@@ -0,0 +1,186 @@
+"""
+GeminiChad
+Copyright (c) 2024 @notV3NOM
+
+See the README.md file for licensing and disclaimer information.
+"""
+
+import os
+import asyncio
+import hashlib
+import tempfile
+import threading
+import datetime as dt
+import google.generativeai as genai
+
+from collections import OrderedDict
+
+from .tracing import TRACER
+from .config import (
+    ATTACHMENT_MAX_BYTES,
+    ATTACHMENT_CONCURRENCY,
+    UPLOAD_CACHE_SIZE,
+    logger,
+)
+
+TEXT_EXTENSIONS = (".txt", ".py", ".js", ".tsx")
+UPLOAD_EXTENSIONS = (".pdf",)
+
+# Stop reusing an uploaded file this long before Gemini expires it
+EXPIRY_MARGIN = dt.timedelta(minutes=30)
+
+
+class UploadCache:
+    """
+    Gemini file handles keyed by the SHA-256 of their content.
+
+    Re-posted images and files are served from the cache until shortly before
+    the uploaded file expires on the Gemini side.
+
+    Attributes:
+        files (OrderedDict): Cached file handles, least recently used first.
+        expirations (dict): Expiration time of every unexpired upload by URI.
+        hits (int): Number of uploads avoided.
+        misses (int): Number of uploads made.
+    """
+
+    def __init__(self, max_size=UPLOAD_CACHE_SIZE):
+        self.max_size = max_size
+        self.files = OrderedDict()
+        self.expirations = {}
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    def get(self, digest):
+        with self.lock:
+            file = self.files.get(digest)
+            if file is None:
+                self.misses += 1
+                return None
+            if file.expiration_time - EXPIRY_MARGIN <= dt.datetime.now(dt.timezone.utc):
+                del self.files[digest]
+                self.misses += 1
+                return None
+            self.files.move_to_end(digest)
+            self.hits += 1
+            return file
+
+    def is_live(self, uri) -> bool:
+        """
+        Whether an uploaded file can still be sent, False for unknown files.
+        """
+        with self.lock:
+            expiration_time = self.expirations.get(uri)
+        return (
+            expiration_time is not None
+            and expiration_time - EXPIRY_MARGIN > dt.datetime.now(dt.timezone.utc)
+        )
+
+    def put(self, digest, file):
+        now = dt.datetime.now(dt.timezone.utc)
+        with self.lock:
+            self.expirations = {
+                uri: expiration_time
+                for uri, expiration_time in self.expirations.items()
+                if expiration_time > now
+            }
+            self.expirations[file.uri] = file.expiration_time
+            self.files[digest] = file
+            self.files.move_to_end(digest)
+            while len(self.files) > self.max_size:
+                self.files.popitem(last=False)
+
+
+UPLOAD_CACHE = UploadCache()
+
+download_semaphore = asyncio.Semaphore(ATTACHMENT_CONCURRENCY)
+
+
+def is_supported(attachment) -> bool:
+    content_type = attachment.content_type or ""
+    return content_type.startswith("image/") or attachment.filename.endswith(
+        TEXT_EXTENSIONS + UPLOAD_EXTENSIONS
+    )
+
+
+def upload(data: bytes, filename: str, mime_type: str | None):
+    """
+    Upload file content to Gemini, reusing a cached handle for identical content.
+
+    Args:
+        data: file content
+        filename: original file name
+        mime_type: MIME type of the content, inferred from the name if None
+
+    Returns:
+        file: Gemini file handle
+    """
+    digest = hashlib.sha256(data).hexdigest()
+    file = UPLOAD_CACHE.get(digest)
+    if file is not None:
+        return file
+
+    # The SDK only uploads from a path
+    extension = os.path.splitext(filename)[1]
+    with tempfile.NamedTemporaryFile(suffix=extension, delete=False) as temp_file:
+        temp_file.write(data)
+    try:
+        with TRACER.span("attachment.upload"):
+            file = genai.upload_file(
+                path=temp_file.name, mime_type=mime_type, display_name=filename
+            )
+    finally:
+        os.remove(temp_file.name)
+
+    UPLOAD_CACHE.put(digest, file)
+    return file
+
+
+async def prepare_attachment(attachment):
+    """
+    Download an attachment and turn it into a prompt part.
+
+    Text files are inlined as text, images and PDFs are uploaded to Gemini.
+
+    Returns:
+        part: prompt part for the attachment, or None if it was skipped
+    """
+    if attachment.size > ATTACHMENT_MAX_BYTES:
+        logger.info(f"Skipping attachment {attachment.filename} ({attachment.size} B)")
+        return None
+
+    try:
+        async with download_semaphore:
+            with TRACER.span("attachment.download"):
+                data = await attachment.read()
+
+        if attachment.filename.endswith(TEXT_EXTENSIONS):
+            text = data.decode("utf-8", errors="replace")
+            return f"{attachment.filename}:\n{text}"
+
+        mime_type = (attachment.content_type or "").split(";")[0] or None
+        return await asyncio.to_thread(upload, data, attachment.filename, mime_type)
+    except Exception as e:
+        logger.exception(f"Attachment {attachment.filename} failed {e}")
+        return None
+
+
+async def prepare_attachments(attachments) -> list:
+    """
+    Download and upload supported attachments concurrently.
+
+    Args:
+        attachments: attachments of a discord message
+
+    Returns:
+        parts: prompt parts in the order of the attachments
+    """
+    parts = await asyncio.gather(
+        *[
+            prepare_attachment(attachment)
+            for attachment in attachments
+            if is_supported(attachment)
+        ]
+    )
+    return [part for part in parts if part is not None]
@@ -0,0 +1,119 @@
+"""
+GeminiChad
+Copyright (c) 2024 @notV3NOM
+
+See the README.md file for licensing and disclaimer information.
+"""
+
+import time
+import threading
+
+from collections import OrderedDict
+
+
+class Flight:
+    """A computation in progress, shared by every caller asking for the same key"""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.value = None
+        self.error = None
+
+
+class TTLCache:
+    """
+    A thread-safe LRU cache whose entries expire after a TTL, with single-flight
+    deduplication: concurrent calls for a missing key share one computation.
+
+    Failed computations are not cached, every caller waiting on them gets the error.
+
+    Attributes:
+        entries (OrderedDict): key -> (value, expiry time), least recently used first.
+        inflight (dict): key -> Flight of computations in progress.
+        hits (int): Calls served from the cache.
+        misses (int): Calls that ran the computation.
+        shared (int): Calls that waited on another call's computation.
+        stale_hits (int): Expired values served by `stale`.
+    """
+
+    def __init__(self, ttl: float, max_size: int, normalize=None):
+        """
+        Initialize the TTLCache.
+
+        Args:
+            ttl (float): Seconds an entry stays valid.
+            max_size (int): Maximum number of entries.
+            normalize (callable, optional): Maps a key to its cache key.
+        """
+        self.ttl = ttl
+        self.max_size = max_size
+        self.normalize = normalize or (lambda key: key)
+        self.entries = OrderedDict()
+        self.inflight = {}
+        self.hits = 0
+        self.misses = 0
+        self.shared = 0
+        self.stale_hits = 0
+        self.lock = threading.Lock()
+
+    def get_or_compute(self, key, compute):
+        """
+        The cached value for a key, computing it with `compute()` on a miss.
+        """
+        key = self.normalize(key)
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and entry[1] > time.monotonic():
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return entry[0]
+            flight = self.inflight.get(key)
+            leader = flight is None
+            if leader:
+                flight = self.inflight[key] = Flight()
+                self.misses += 1
+            else:
+                self.shared += 1
+
+        if not leader:
+            flight.done.wait()
+            if flight.error is not None:
+                raise flight.error
+            return flight.value
+
+        try:
+            flight.value = compute()
+        except BaseException as e:
+            flight.error = e
+            raise
+        else:
+            with self.lock:
+                self.entries[key] = (flight.value, time.monotonic() + self.ttl)
+                self.entries.move_to_end(key)
+                while len(self.entries) > self.max_size:
+                    self.entries.popitem(last=False)
+        finally:
+            with self.lock:
+                del self.inflight[key]
+            flight.done.set()
+        return flight.value
+
+    def stale(self, key):
+        """
+        The last value computed for a key even if it has expired, or None.
+
+        Used as a degraded answer while the source of the values is down.
+        """
+        key = self.normalize(key)
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            self.stale_hits += 1
+            return entry[0]
+
+    def summary(self) -> str:
+        return (
+            f"{self.hits} hits, {self.shared} shared, {self.misses} misses, "
+            f"{self.stale_hits} stale"
+        )
@@ -0,0 +1,163 @@
+"""
+GeminiChad
+Copyright (c) 2024 @notV3NOM
+
+See the README.md file for licensing and disclaimer information.
+"""
+
+import re
+
+from better_profanity.utils import get_complete_path_of_file, read_wordlist
+
+# Characters a letter of a censored word may be written as, as in better_profanity
+LEET_MAP = {
+    "a": ("@", "*", "4"),
+    "i": ("*", "l", "1"),
+    "o": ("*", "0", "@"),
+    "u": ("*", "v"),
+    "v": ("*", "u"),
+    "l": ("1",),
+    "e": ("*", "3"),
+    "s": ("$", "5"),
+    "t": ("7",),
+}
+
+SEPARATOR = " "
+
+# Runs of characters that separate words, anything but alphanumerics and @$*"'
+SEPARATOR_PATTERN = re.compile(r"(?:[^\w@$*\"']|_)+")
+
+
+class CensorMatcher:
+    """
+    An Aho-Corasick automaton matching censored words and phrases in a single pass.
+
+    Words match whole words only: patterns are padded with a separator and the text
+    is normalized to lowercase words separated by single separators. Leetspeak is
+    handled while scanning, each text character advancing the automaton on every
+    letter it may stand for, so the wordlist is not expanded into its variants.
+
+    Attributes:
+        goto (list): Transitions of each state, char -> state.
+        fail (list): Failure link of each state.
+        delta (list): Memoized transitions of each state, including failure links.
+        alphabet (set): Characters of the censored words.
+        output (list): Whether a word ends at each state, directly or via failure links.
+        candidates (dict): Letters each leetspeak character may stand for.
+    """
+
+    def __init__(self, words, leet_map=LEET_MAP):
+        """
+        Build the automaton.
+
+        Args:
+            words (iterable): Censored words and phrases.
+            leet_map (dict): Characters each letter may be written as.
+        """
+        self.candidates = {}
+        for letter, variants in leet_map.items():
+            for variant in variants:
+                self.candidates.setdefault(variant, {variant}).add(letter)
+        self.candidates = {
+            char: tuple(letters) for char, letters in self.candidates.items()
+        }
+
+        self.goto = [{}]
+        self.fail = [0]
+        self.output = [False]
+        for word in words:
+            pattern = (
+                SEPARATOR + SEPARATOR.join(self.normalize(word).split()) + SEPARATOR
+            )
+            if pattern.strip():
+                self.add(pattern)
+        self.link()
+        self.delta = [{} for _ in self.goto]
+        self.alphabet = {char for transitions in self.goto for char in transitions}
+
+    @staticmethod
+    def normalize(text: str) -> str:
+        return SEPARATOR_PATTERN.sub(SEPARATOR, text.lower())
+
+    def add(self, pattern):
+        state = 0
+        for char in pattern:
+            if char not in self.goto[state]:
+                self.goto.append({})
+                self.fail.append(0)
+                self.output.append(False)
+                self.goto[state][char] = len(self.goto) - 1
+            state = self.goto[state][char]
+        self.output[state] = True
+
+    def link(self):
+        """Compute failure links breadth first"""
+        queue = list(self.goto[0].values())
+        for state in queue:
+            for char, next_state in self.goto[state].items():
+                queue.append(next_state)
+                fallback = self.fail[state]
+                while fallback and char not in self.goto[fallback]:
+                    fallback = self.fail[fallback]
+                target = self.goto[fallback].get(char, 0)
+                self.fail[next_state] = target if target != next_state else 0
+                self.output[next_state] |= self.output[self.fail[next_state]]
+
+    def step(self, state, char):
+        if char not in self.alphabet:
+            return 0
+        next_state = self.delta[state].get(char)
+        if next_state is None:
+            fallback = state
+            while fallback and char not in self.goto[fallback]:
+                fallback = self.fail[fallback]
+            next_state = self.delta[state][char] = self.goto[fallback].get(char, 0)
+        return next_state
+
+    def contains(self, text: str) -> bool:
+        """
+        Whether the text contains a censored word.
+        """
+        delta, output, candidates = self.delta, self.output, self.candidates
+        state = 0
+        states = None
+        for char in SEPARATOR + self.normalize(text) + SEPARATOR:
+            letters = candidates.get(char)
+            if states is None and letters is None:
+                next_state = delta[state].get(char)
+                if next_state is None:
+                    next_state = self.step(state, char)
+                if output[next_state]:
+                    return True
+                state = next_state
+                continue
+            if states is None:
+                states = {state}
+            letters = letters or (char,)
+            next_states = set()
+            for state in states:
+                for letter in letters:
+                    next_state = self.step(state, letter)
+                    if self.output[next_state]:
+                        return True
+                    next_states.add(next_state)
+            # State 0 is implied while any other state is active
+            next_states.discard(0)
+            if len(next_states) > 1:
+                states = next_states
+            else:
+                state = next_states.pop() if next_states else 0
+                states = None
+        return False
+
+
+def load_censor_words(custom_path="static/censor_words.txt"):
+    """
+    The better_profanity wordlist and the custom censor words.
+    """
+    words = list(read_wordlist(get_complete_path_of_file("profanity_wordlist.txt")))
+    words.extend(read_wordlist(custom_path))
+    return words
+
+
+CENSOR = CensorMatcher(load_censor_words())
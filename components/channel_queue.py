@@ -0,0 +1,204 @@
+"""
+GeminiChad
+Copyright (c) 2024 @notV3NOM
+
+See the README.md file for licensing and disclaimer information.
+"""
+
+import time
+import asyncio
+
+from collections import deque
+
+from .config import QUEUE_MAX_DEPTH, QUEUE_COALESCE_WINDOW, logger
+
+
+class ChatJob:
+    """
+    A single LLM turn waiting for its channel's chat session.
+
+    Attributes:
+        message (discord.Message): The message that triggered the turn.
+        prompt (str): The prompt to send to the LLM.
+        attachments (list): Uploaded files or text parts for the prompt.
+        enqueued_at (float): Monotonic time the job was queued at.
+    """
+
+    def __init__(self, message, prompt, attachments):
+        self.message = message
+        self.prompt = prompt
+        self.attachments = attachments
+        self.enqueued_at = time.monotonic()
+
+    @classmethod
+    def merge(cls, jobs):
+        """
+        Coalesce several jobs into one turn that replies to the latest message.
+
+        Args:
+            jobs (list): Jobs to merge, oldest first.
+
+        Returns:
+            ChatJob: The merged job.
+        """
+        if len(jobs) == 1:
+            return jobs[0]
+        merged = cls(
+            jobs[-1].message,
+            "\n".join(job.prompt for job in jobs),
+            [part for job in jobs for part in job.attachments],
+        )
+        merged.enqueued_at = jobs[0].enqueued_at
+        return merged
+
+
+class ChannelQueue:
+    """
+    A bounded queue of chat jobs for one channel, drained by a single consumer.
+
+    Only one job per channel is handed to the handler at a time, so the channel's
+    chat session is never used from two threads at once.
+
+    Attributes:
+        pending (deque): Jobs waiting to be handled.
+        worker (asyncio.Task): The consumer task, None while the queue is idle.
+        wait_times (deque): Recent queue wait times in seconds.
+    """
+
+    def __init__(self, handler, max_depth, coalesce_window):
+        """
+        Initialize the ChannelQueue.
+
+        Args:
+            handler (coroutine function): Called with each job to handle.
+            max_depth (int): Maximum number of waiting jobs.
+            coalesce_window (float): Follow-up messages from the same author
+                                     within this many seconds are merged into
+                                     one turn. 0 disables coalescing.
+        """
+        self.handler = handler
+        self.max_depth = max_depth
+        self.coalesce_window = coalesce_window
+        self.pending = deque()
+        self.worker = None
+        self.active = False
+        self.wait_times = deque(maxlen=50)
+
+    def submit(self, job):
+        """
+        Queue a job, starting the consumer if it is not running.
+
+        Returns:
+            bool: False if the queue is full and the job was rejected.
+        """
+        if len(self.pending) >= self.max_depth:
+            return False
+        self.pending.append(job)
+        if self.worker is None or self.worker.done():
+            self.worker = asyncio.create_task(self.consume())
+        return True
+
+    def take(self):
+        """
+        Pop the next job, merged with quick follow-ups from the same author.
+        """
+        jobs = [self.pending.popleft()]
+        while (
+            self.pending
+            and self.pending[0].message.author == jobs[-1].message.author
+            and self.pending[0].enqueued_at - jobs[-1].enqueued_at
+            <= self.coalesce_window
+        ):
+            jobs.append(self.pending.popleft())
+        return ChatJob.merge(jobs)
+
+    async def consume(self):
+        while self.pending:
+            if self.coalesce_window > 0:
+                # Give the author a moment to send follow-up messages
+                elapsed = time.monotonic() - self.pending[0].enqueued_at
+                await asyncio.sleep(max(0, self.coalesce_window - elapsed))
+            job = self.take()
+            self.wait_times.append(time.monotonic() - job.enqueued_at)
+            self.active = True
+            try:
+                await self.handler(job)
+            except Exception as e:
+                logger.exception(f"Chat job failed {e}")
+            finally:
+                self.active = False
+
+    @property
+    def depth(self):
+        """Number of jobs waiting, including the one being handled"""
+        return len(self.pending) + (1 if self.active else 0)
+
+    @property
+    def average_wait(self):
+        """Average wait time of recent jobs in seconds"""
+        if not self.wait_times:
+            return 0.0
+        return sum(self.wait_times) / len(self.wait_times)
+
+
+class ChannelQueueManager:
+    """
+    Per-channel chat queues. Channels are handled fully in parallel.
+    """
+
+    def __init__(
+        self, max_depth=QUEUE_MAX_DEPTH, coalesce_window=QUEUE_COALESCE_WINDOW
+    ):
+        self.max_depth = max_depth
+        self.coalesce_window = coalesce_window
+        self.handler = None
+        self.queues = {}
+
+    def set_handler(self, handler):
+        """
+        Set the coroutine function that handles each chat job.
+        """
+        self.handler = handler
+
+    def submit(self, channel_id, job):
+        """
+        Queue a chat job for a channel.
+
+        Returns:
+            bool: False if the channel's queue is full and the job was rejected.
+        """
+        queue = self.queues.get(channel_id)
+        if queue is None:
+            self.prune()
+            queue = ChannelQueue(self.handler, self.max_depth, self.coalesce_window)
+            self.queues[channel_id] = queue
+        accepted = queue.submit(job)
+        if not accepted:
+            logger.warning(f"Chat queue full for channel {channel_id}")
+        return accepted
+
+    def prune(self):
+        """
+        Drop idle queues once many channels have been seen.
+        """
+        if len(self.queues) < 1024:
+            return
+        for channel_id in [
+            channel_id for channel_id, queue in self.queues.items() if queue.depth == 0
+        ]:
+            del self.queues[channel_id]
+
+    def stats(self, channel_id):
+        """
+        Backpressure statistics for a channel.
+
+        Returns:
+            tuple: (queue depth, average wait time in seconds)
+        """
+        queue = self.queues.get(channel_id)
+        if queue is None:
+            return 0, 0.0
+        return queue.depth, queue.average_wait
+
+
+CHANNEL_QUEUES = ChannelQueueManager()
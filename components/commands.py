@@ -5,27 +5,47 @@ Copyright (c) 2024 @notV3NOM
 See the README.md file for licensing and disclaimer information.
 """
 
-import os
+import io
 import json
+import time
 import asyncio
 import discord
-import dateparser
 import datetime as dt
 
 from typing import Literal
 from slugify import slugify
 from discord import app_commands
 
-from .tools import web_search
-from .prompts import PROMPT_EXPAND_TEMPLATE, FIND_TIME_TEMPLATE, PROMPT_TEMPLATE
+from .web import answer_question
+from .tools import WEB_CACHE
+from .tracing import TRACER
+from .router import ROUTER, EXPAND_TASK
+from .message_planner import SEND_STATS
+from .prompts import PROMPT_EXPAND_TEMPLATE, FIND_TIME_TEMPLATE
+from .images import image_extension
+from .resilience import health_snapshot, CircuitOpenError
+from .lazy_client import clients_status
+from .image_scheduler import IMAGE_SCHEDULER, INTERACTIVE
+from .context import estimate_tokens
+from .time_parser import parse_reminder, parse_time, TIME_PARSER_STATS, LLM_PATH
+from .channel_queue import CHANNEL_QUEUES
 from .session import SESSIONS, SYSTEM_MESSAGE, CHAT_SESSION, TOOLS, TOOL_OPTIONS
-from .config import BOT_TIMING, DEFAULT_SYSTEM_MESSAGE, BOT_NAME, REMINDER_ICON_URL, LLM
+from .config import (
+    BOT_TIMING,
+    DEFAULT_SYSTEM_MESSAGE,
+    BOT_NAME,
+    REMINDER_ICON_URL,
+    LLM,
+    CONTEXT_TOKEN_BUDGET,
+    logger,
+)
 from .llm import (
     chat,
     new_session,
     temp_session,
-    json_model,
-    IMAGE_GENERATORS,
+    generate_json,
+    settled_history,
+    MODEL_CACHE,
     IMAGE_MODELS,
     personas,
 )
@@ -171,11 +191,12 @@ def setup_commands(client: discord.Client, reminder_manager):
         minutes, seconds = divmod(remainder, 60)
         days, hours = divmod(hours, 24)
         uptime = f"{days} days {hours} hours {minutes} minutes {seconds} seconds"
-        hist_length = (
-            len(SESSIONS[interaction.channel.id][CHAT_SESSION].history)
+        history = (
+            settled_history(SESSIONS[interaction.channel.id][CHAT_SESSION])
             if interaction.channel.id in SESSIONS
-            else 0
+            else []
         )
+        hist_length = len(history)
         if len(SESSIONS[interaction.channel.id][TOOLS]):
             tools = ", ".join(
                 [
@@ -191,12 +212,66 @@ def setup_commands(client: discord.Client, reminder_manager):
         embed.add_field(
             name="History ", value=str(hist_length) + " message(s)", inline=True
         )
+        embed.add_field(
+            name="Context",
+            value=f"~{estimate_tokens(history)} / {CONTEXT_TOKEN_BUDGET} tokens",
+            inline=True,
+        )
         embed.add_field(name="Latency", value=str(latency) + " ms", inline=True)
+        queue_depth, queue_wait = CHANNEL_QUEUES.stats(interaction.channel.id)
+        embed.add_field(
+            name="Queue",
+            value=f"{queue_depth} waiting, {queue_wait:.1f} s avg wait",
+            inline=True,
+        )
         embed.add_field(name="Tools", value=tools, inline=False)
+        embed.add_field(name="Health", value=health_snapshot(), inline=False)
+        embed.add_field(name="Clients", value=clients_status(), inline=False)
+        embed.add_field(
+            name="Reminder Parsing", value=TIME_PARSER_STATS.summary(), inline=False
+        )
+        embed.add_field(name="Search Cache", value=WEB_CACHE.summary(), inline=False)
+        embed.add_field(name="Replies", value=SEND_STATS.summary(), inline=False)
+        embed.add_field(name="Model Routing", value=ROUTER.summary(), inline=False)
+        embed.add_field(name="Model Cache", value=MODEL_CACHE.summary(), inline=False)
         embed.add_field(name="Uptime ", value=uptime, inline=False)
         embed.add_field(name="System Message", value=system, inline=False)
         await interaction.response.send_message(embed=embed)
 
+    @client.tree.command(name="stats", description="Show latency per stage")
+    @app_commands.default_permissions(administrator=True)
+    @app_commands.describe(export="Download the stats instead of showing them")
+    async def stats_command(
+        interaction: discord.Interaction,
+        export: Literal["none", "prometheus", "jsonl"] = "none",
+    ):
+        if not interaction.permissions.administrator:
+            await interaction.response.send_message(
+                "Only administrators can view stats.", ephemeral=True
+            )
+            return
+        if export == "prometheus":
+            file = discord.File(
+                io.BytesIO((TRACER.prometheus() + ROUTER.prometheus()).encode()),
+                filename="stats.prom",
+            )
+            await interaction.response.send_message(file=file, ephemeral=True)
+        elif export == "jsonl":
+            file = discord.File(
+                io.BytesIO(TRACER.jsonl().encode()), filename="traces.jsonl"
+            )
+            await interaction.response.send_message(file=file, ephemeral=True)
+        else:
+            embed = discord.Embed(
+                title="Latency (ms)", description=f"```\n{TRACER.summary()[:4000]}\n```"
+            )
+            embed.add_field(
+                name="Model Routing",
+                value=f"```\n{ROUTER.decision_summary()[:1000]}\n```",
+                inline=False,
+            )
+            await interaction.response.send_message(embed=embed, ephemeral=True)
+
     @client.tree.command(name="system", description="Change the system message")
     @app_commands.describe(message="Enter `default` for default system message.")
     @app_commands.describe(forget="Clear chat history")
@@ -211,7 +286,9 @@ def setup_commands(client: discord.Client, reminder_manager):
                 system, tools=tools
             )
         else:
-            previous_history = SESSIONS[interaction.channel.id][CHAT_SESSION].history
+            previous_history = settled_history(
+                SESSIONS[interaction.channel.id][CHAT_SESSION]
+            )
             SESSIONS[interaction.channel.id][CHAT_SESSION] = new_session(
                 system, previous_history, tools
             )
@@ -234,13 +311,23 @@ def setup_commands(client: discord.Client, reminder_manager):
     async def reminder_command(interaction: discord.Interaction, message: str):
         try:
             await interaction.response.defer()
-            response = await asyncio.to_thread(
-                json_model.generate_content, FIND_TIME_TEMPLATE + message
-            )
-            time_json = json.loads(response.text.strip())
-            reminder_time = dateparser.parse(time_json["time"])
-            if reminder_time is None:
-                raise ValueError("Failed to parse time")
+            start_time = time.perf_counter()
+            parsed = await asyncio.to_thread(parse_reminder, message)
+            if parsed is not None:
+                reminder_time, title, path = parsed
+            else:
+                path = LLM_PATH
+                response = await asyncio.to_thread(
+                    generate_json, FIND_TIME_TEMPLATE + message
+                )
+                time_json = json.loads(response.text.strip())
+                reminder_time = await asyncio.to_thread(parse_time, time_json["time"])
+                if reminder_time is None:
+                    raise ValueError("Failed to parse time")
+                title = time_json["title"]
+            elapsed = time.perf_counter() - start_time
+            TIME_PARSER_STATS.record(path, elapsed)
+            logger.info(f"/reminder time found by {path} in {elapsed * 1000:.0f} ms")
 
             reminder_manager.add_reminder(
                 interaction.user.id,
@@ -249,12 +336,12 @@ def setup_commands(client: discord.Client, reminder_manager):
                 interaction.channel.id,
             )
             embed = discord.Embed(
-                title=time_json["title"],
+                title=title,
                 description=f"<t:{int(reminder_time.timestamp())}:R>",
             )
             embed.set_thumbnail(url=REMINDER_ICON_URL)
             await interaction.followup.send(embed=embed)
-        except ValueError as e:
+        except (ValueError, CircuitOpenError) as e:
             await interaction.followup.send(f"Error: {e}", ephemeral=True)
 
     @client.tree.command(name="web", description="Search the web to answer a question")
@@ -262,14 +349,7 @@ def setup_commands(client: discord.Client, reminder_manager):
     async def web_command(interaction: discord.Interaction, question: str):
         try:
             await interaction.response.defer()
-            search_results = web_search(question)
-            answer = await asyncio.to_thread(
-                chat,
-                PROMPT_TEMPLATE.format(
-                    context=search_results, question=question
-                ),
-                temp_session(),
-            )
+            answer = await answer_question(question)
             embed = discord.Embed(title=question, description=answer)
             await interaction.followup.send(embed=embed)
         except Exception as e:
@@ -288,22 +368,40 @@ def setup_commands(client: discord.Client, reminder_manager):
             await interaction.response.defer()
             if expand_prompt == "true":
                 response = await asyncio.to_thread(
-                    chat, PROMPT_EXPAND_TEMPLATE.format(prompt=prompt), temp_session()
+                    chat,
+                    PROMPT_EXPAND_TEMPLATE.format(prompt=prompt),
+                    temp_session(),
+                    task=EXPAND_TASK,
                 )
                 prompt = response.strip()
             filename = slugify(prompt, max_length=100)
-            generated_image_path = await asyncio.to_thread(
-                IMAGE_GENERATORS[model], prompt
+            queued = False
+
+            async def show_position(position):
+                nonlocal queued
+                queued = True
+                await interaction.edit_original_response(
+                    content=f"Queued at position {position}"
+                )
+
+            image_data = await IMAGE_SCHEDULER.generate(
+                model,
+                prompt,
+                user_id=interaction.user.id,
+                priority=INTERACTIVE,
+                on_position=show_position,
             )
-            extension = os.path.splitext(generated_image_path)[1]
-            image = discord.File(generated_image_path, filename=filename + extension)
+            extension = image_extension(image_data)
+            image = discord.File(io.BytesIO(image_data), filename=filename + extension)
             ix = max(prompt.find("", 225), 225)
             embed_title = prompt if len(prompt) < 250 else prompt[:ix] + " ..."
             embed = discord.Embed(title=embed_title)
             embed.set_image(url="attachment://" + filename + extension)
-            await interaction.followup.send(file=image, embed=embed)
-
-            if os.path.exists(generated_image_path):
-                os.remove(generated_image_path)
+            if queued:
+                await interaction.edit_original_response(
+                    content=None, attachments=[image], embed=embed
+                )
+            else:
+                await interaction.followup.send(file=image, embed=embed)
         except Exception as e:
             await interaction.followup.send(f"Error: {e}", ephemeral=True)
@@ -56,12 +56,155 @@ You were created by Venom (discord <@418441304184193036>).
 
 BOT_TIMING = {"start_time": None}
 
+# Streaming replies: edit the reply in place as the LLM generates it
+STREAM_RESPONSES = os.getenv("STREAM_RESPONSES", "true").lower() == "true"
+STREAM_EDIT_TOKENS = int(os.getenv("STREAM_EDIT_TOKENS", 40))
+STREAM_EDIT_INTERVAL = float(os.getenv("STREAM_EDIT_INTERVAL", 0.6))
+
+# Per-channel chat queues: bounded depth, optional coalescing of follow-ups (seconds)
+QUEUE_MAX_DEPTH = int(os.getenv("QUEUE_MAX_DEPTH", 5))
+QUEUE_COALESCE_WINDOW = float(os.getenv("QUEUE_COALESCE_WINDOW", 0))
+
+# Session store: in-memory limits and persistence of evicted/idle sessions
+SESSION_DB = os.getenv("SESSION_DB", "data/sessions.db")
+SESSION_MAX = int(os.getenv("SESSION_MAX", 500))
+SESSION_TTL = float(os.getenv("SESSION_TTL", 3600))
+SESSION_MEMORY_BUDGET = int(os.getenv("SESSION_MEMORY_BUDGET", 64 * 1024 * 1024))
+SESSION_SWEEP_INTERVAL = float(os.getenv("SESSION_SWEEP_INTERVAL", 60))
+
+# Reminder store, and how far ahead due reminders are loaded into memory (seconds)
+REMINDER_DB = os.getenv("REMINDER_DB", "data/reminders.db")
+REMINDER_WINDOW = float(os.getenv("REMINDER_WINDOW", 3600))
+REMINDER_WINDOW_LIMIT = int(os.getenv("REMINDER_WINDOW_LIMIT", 1000))
+
+# Notification text is generated this many seconds before a reminder is due;
+# at most this many generations and deliveries run at once
+REMINDER_LEAD_TIME = float(os.getenv("REMINDER_LEAD_TIME", 120))
+REMINDER_CONCURRENCY = int(os.getenv("REMINDER_CONCURRENCY", 8))
+
+# History compaction: per-channel token budget, share of it kept verbatim when
+# compacting, and optional summary of the dropped turns (with a cheaper model)
+CONTEXT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", 24000))
+CONTEXT_KEEP_RATIO = float(os.getenv("CONTEXT_KEEP_RATIO", 0.5))
+CONTEXT_SUMMARIZE = os.getenv("CONTEXT_SUMMARIZE", "true").lower() == "true"
+CONTEXT_SUMMARY_MODEL = os.getenv("CONTEXT_SUMMARY_MODEL") or LLM
+
+# Attachments: size cap, concurrent downloads and cached Gemini file handles
+ATTACHMENT_MAX_BYTES = int(os.getenv("ATTACHMENT_MAX_BYTES", 20 * 1024 * 1024))
+ATTACHMENT_CONCURRENCY = int(os.getenv("ATTACHMENT_CONCURRENCY", 8))
+UPLOAD_CACHE_SIZE = int(os.getenv("UPLOAD_CACHE_SIZE", 256))
+
 CLOUDFLARE_ACCOUNT_ID = os.environ.get("CLOUDFLARE_ACCOUNT_ID")
 CLOUDFLARE_API_TOKEN = os.environ.get("CLOUDFLARE_API_TOKEN")
 
 SD_XL_BASE_URL = f"https://api.cloudflare.com/client/v4/accounts/{CLOUDFLARE_ACCOUNT_ID}/ai/run/@cf/stabilityai/stable-diffusion-xl-base-1.0"
 SCHNELL_BASE_URL = f"https://api.cloudflare.com/client/v4/accounts/{CLOUDFLARE_ACCOUNT_ID}/ai/run/@cf/black-forest-labs/flux-1-schnell"
 
+# Shared HTTP client pool and per-backend image generation deadlines (seconds)
+HTTP_POOL_SIZE = int(os.getenv("HTTP_POOL_SIZE", 32))
+HTTP_CONNECT_TIMEOUT = float(os.getenv("HTTP_CONNECT_TIMEOUT", 5))
+SDXL_TIMEOUT = float(os.getenv("SDXL_TIMEOUT", 60))
+SCHNELL_TIMEOUT = float(os.getenv("SCHNELL_TIMEOUT", 30))
+SD3_TIMEOUT = float(os.getenv("SD3_TIMEOUT", 120))
+
+
+def parse_limits(value: str) -> dict:
+    """Parse per-backend limits like 'sdxl:2,schnell:4' into a dict"""
+    limits = {}
+    for item in value.split(","):
+        if ":" in item:
+            name, limit = item.split(":", 1)
+            limits[name.strip()] = int(limit)
+    return limits
+
+
+def parse_routes(value: str) -> dict:
+    """Parse per-task model tiers like 'reminder:fast,chat:auto' into a dict"""
+    routes = {}
+    for item in value.split(","):
+        if ":" in item:
+            task, tier = item.split(":", 1)
+            routes[task.strip()] = tier.strip().lower()
+    return routes
+
+
+# Image job scheduler: concurrent jobs and jobs started per minute, per backend
+IMAGE_CONCURRENCY = parse_limits(
+    os.getenv("IMAGE_CONCURRENCY", "sdxl:2,schnell:4,sd3:1")
+)
+IMAGE_RATE_LIMIT = parse_limits(
+    os.getenv("IMAGE_RATE_LIMIT", "sdxl:30,schnell:60,sd3:10")
+)
+
+# "auto" image model: backend preference before latency data exists, latency
+# percentile after which a hedge request goes to the next backend, and the
+# hedge delay used until a backend has enough samples (seconds)
+IMAGE_AUTO_ORDER = os.getenv("IMAGE_AUTO_ORDER", "schnell,sdxl,sd3").split(",")
+IMAGE_HEDGE_PERCENTILE = float(os.getenv("IMAGE_HEDGE_PERCENTILE", 0.9))
+IMAGE_HEDGE_DELAY = float(os.getenv("IMAGE_HEDGE_DELAY", 15))
+
+# Generated images referenced by <IMAGE> tags are kept in memory for a while
+IMAGE_HANDLE_TTL = float(os.getenv("IMAGE_HANDLE_TTL", 900))
+IMAGE_HANDLE_LIMIT = int(os.getenv("IMAGE_HANDLE_LIMIT", 64))
+
+# Circuit breakers: consecutive failures before a dependency is cut off, seconds
+# before it is probed again, and retries allowed per call made
+CIRCUIT_FAILURE_THRESHOLD = int(os.getenv("CIRCUIT_FAILURE_THRESHOLD", 5))
+CIRCUIT_RESET_TIMEOUT = float(os.getenv("CIRCUIT_RESET_TIMEOUT", 30))
+RETRY_BUDGET_RATIO = float(os.getenv("RETRY_BUDGET_RATIO", 0.2))
+
+# Web search results are cached per normalized query (seconds, entries)
+WEB_CACHE_TTL = float(os.getenv("WEB_CACHE_TTL", 300))
+WEB_CACHE_SIZE = int(os.getenv("WEB_CACHE_SIZE", 256))
+
+# /web: result pages fetched and summarized, deadline per page download, and
+# deadline for all pages to be summarized (seconds), page size limits
+WEB_FETCH_PAGES = int(os.getenv("WEB_FETCH_PAGES", 3))
+WEB_PAGE_TIMEOUT = float(os.getenv("WEB_PAGE_TIMEOUT", 8))
+WEB_PIPELINE_TIMEOUT = float(os.getenv("WEB_PIPELINE_TIMEOUT", 25))
+WEB_PAGE_MAX_BYTES = int(os.getenv("WEB_PAGE_MAX_BYTES", 2 * 1024 * 1024))
+WEB_PAGE_MAX_CHARS = int(os.getenv("WEB_PAGE_MAX_CHARS", 20000))
+
+# Function calls of a model turn run in parallel: calls run at once, default
+# deadline per call and per-tool deadlines like 'web_search:45' (seconds)
+TOOL_CONCURRENCY = int(os.getenv("TOOL_CONCURRENCY", 8))
+TOOL_TIMEOUT = float(os.getenv("TOOL_TIMEOUT", 60))
+TOOL_TIMEOUTS = parse_limits(
+    os.getenv(
+        "TOOL_TIMEOUTS", "clock:5,calculator:15,web_search:45,image_generation:180"
+    )
+)
+
+# Model routing: the fast tier model (the strong tier is LLM), the tier of each task
+# ('fast', 'strong' or 'auto'), and the prompts 'auto' sends to the fast tier: at
+# most ROUTE_FAST_MAX_CHARS characters, no attachments or code, a history of at most
+# ROUTE_FAST_MAX_CONTEXT estimated tokens, and tool-enabled sessions only if
+# ROUTE_FAST_TOOLS
+FAST_LLM = os.getenv("FAST_LLM", "gemini-1.5-flash-8b")
+ROUTE_TASKS = parse_routes(
+    os.getenv("ROUTE_TASKS", "chat:auto,reminder:fast,expand:fast,time:fast,web:strong")
+)
+ROUTE_FAST_MAX_CHARS = int(os.getenv("ROUTE_FAST_MAX_CHARS", 280))
+ROUTE_FAST_MAX_CONTEXT = int(os.getenv("ROUTE_FAST_MAX_CONTEXT", 4000))
+ROUTE_FAST_TOOLS = os.getenv("ROUTE_FAST_TOOLS", "false").lower() == "true"
+
+# Model instances shared by sessions with the same system message and tools, and
+# optional Gemini context caching of system messages of at least
+# CONTEXT_CACHE_MIN_TOKENS, kept CONTEXT_CACHE_TTL seconds. Context caching needs
+# a versioned model such as gemini-1.5-flash-002
+MODEL_CACHE_SIZE = int(os.getenv("MODEL_CACHE_SIZE", 128))
+CONTEXT_CACHE = os.getenv("CONTEXT_CACHE", "false").lower() == "true"
+CONTEXT_CACHE_MIN_TOKENS = int(os.getenv("CONTEXT_CACHE_MIN_TOKENS", 32768))
+CONTEXT_CACHE_TTL = float(os.getenv("CONTEXT_CACHE_TTL", 3600))
+
+# Tracing: latency samples kept per stage for the /stats percentiles, and recent
+# spans kept for the JSONL export
+TRACE_WINDOW = int(os.getenv("TRACE_WINDOW", 1024))
+TRACE_BUFFER = int(os.getenv("TRACE_BUFFER", 2000))
+
+# Import deferred dependencies in the background once the bot is online
+PREWARM_IMPORTS = os.getenv("PREWARM_IMPORTS", "true").lower() == "true"
+
 REMINDER_ICON_URL = "https://cdn-icons-png.flaticon.com/512/10509/10509199.png"
 
 EXTENSION_MAPPING = {
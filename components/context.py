@@ -0,0 +1,178 @@
+"""
+GeminiChad
+Copyright (c) 2024 @notV3NOM
+
+See the README.md file for licensing and disclaimer information.
+"""
+
+import google.generativeai as genai
+
+from google.generativeai import protos
+
+from .llm import summary_model, settled_history, revise, GEMINI
+from .attachments import UPLOAD_CACHE
+from .prompts import HISTORY_SUMMARY_TEMPLATE, HISTORY_RECAP_TEMPLATE
+from .config import (
+    CONTEXT_TOKEN_BUDGET,
+    CONTEXT_KEEP_RATIO,
+    CONTEXT_SUMMARIZE,
+    logger,
+)
+
+# Gemini bills an image at a flat 258 tokens; used for any file part
+FILE_TOKENS = 258
+RECAP_ACK = "Noted, I will keep the earlier conversation in mind."
+
+
+def is_file_part(part) -> bool:
+    return "file_data" in part or "inline_data" in part
+
+
+def is_expired_file(part) -> bool:
+    """An uploaded file Gemini has expired, or is about to"""
+    return "file_data" in part and not UPLOAD_CACHE.is_live(part.file_data.file_uri)
+
+
+def content_tokens(content) -> int:
+    """
+    Estimate the number of tokens in a history entry without calling the API.
+
+    Text is estimated at ~4 bytes per token.
+    """
+    tokens = 0
+    for part in content.parts:
+        if is_file_part(part):
+            tokens += FILE_TOKENS
+        else:
+            tokens += type(part).pb(part).ByteSize() // 4 + 1
+    return tokens
+
+
+def estimate_tokens(history) -> int:
+    """Estimate the token footprint of a chat history"""
+    return sum(map(content_tokens, history))
+
+
+def strip_files(content, is_stripped=is_file_part):
+    """
+    Return a copy of a history entry without uploaded or inline file parts.
+
+    Args:
+        content: history entry
+        is_stripped: which file parts to strip, all of them by default
+    """
+    parts = [part for part in content.parts if not is_stripped(part)]
+    if len(parts) == len(content.parts):
+        return content
+    return protos.Content(
+        role=content.role, parts=parts or [protos.Part(text="(attachment)")]
+    )
+
+
+def is_turn_start(content) -> bool:
+    """A user message that is not a function response starts a new turn"""
+    return content.role == "user" and not any(
+        "function_response" in part for part in content.parts
+    )
+
+
+def transcript(history) -> str:
+    lines = []
+    for content in history:
+        speaker = "User" if content.role == "user" else "Assistant"
+        for part in content.parts:
+            if part.text:
+                lines.append(f"{speaker}: {part.text}")
+            elif "function_call" in part:
+                lines.append(f"{speaker} used the {part.function_call.name} tool")
+            elif "function_response" in part:
+                response = str(
+                    type(part.function_response).to_dict(part.function_response)
+                )
+                lines.append(f"Tool result: {response[:500]}")
+    return "\n".join(lines)
+
+
+def summarize(history) -> str:
+    response = GEMINI.call(
+        summary_model.generate_content,
+        HISTORY_SUMMARY_TEMPLATE.format(conversation=transcript(history)),
+    )
+    return response.text.strip()
+
+
+def compact_history(
+    chat_session: genai.ChatSession,
+    budget: int = CONTEXT_TOKEN_BUDGET,
+    summarize_dropped: bool = CONTEXT_SUMMARIZE,
+) -> bool:
+    """
+    Keep a chat session's history within a token budget.
+
+    Uploaded files that expired are always stripped, as Gemini rejects requests
+    referencing them. Over budget, files are stripped from all but the latest turn.
+    If the history is still over budget, the oldest turns are dropped until the
+    rest fits in a fraction of the budget, and replaced with a recap turn
+    summarizing them.
+
+    Args:
+        chat_session: Chat session to compact
+        budget: maximum estimated tokens in the history
+        summarize_dropped: summarize dropped turns instead of discarding them
+
+    Returns:
+        compacted: True if the history was changed
+    """
+    settled = settled_history(chat_session)
+    history = [strip_files(content, is_expired_file) for content in settled]
+    expired = any(new is not old for new, old in zip(history, settled))
+    if estimate_tokens(history) <= budget:
+        if expired:
+            logger.info("Stripped expired files from history")
+            chat_session.history = history
+            revise(chat_session)
+        return expired
+
+    turn_starts = [i for i, content in enumerate(history) if is_turn_start(content)]
+    last_turn = turn_starts[-1] if turn_starts else len(history)
+    history = [strip_files(content) for content in history[:last_turn]] + list(
+        history[last_turn:]
+    )
+
+    if estimate_tokens(history) > budget:
+        keep_budget = budget * CONTEXT_KEEP_RATIO
+        cut = last_turn
+        kept_tokens = estimate_tokens(history[last_turn:])
+        for start, end in zip(reversed(turn_starts[:-1]), reversed(turn_starts[1:])):
+            kept_tokens += estimate_tokens(history[start:end])
+            if kept_tokens > keep_budget:
+                break
+            cut = start
+
+        dropped, history = history[:cut], history[cut:]
+        if dropped:
+            recap = []
+            if summarize_dropped:
+                try:
+                    summary = summarize(dropped)
+                    recap = [
+                        protos.Content(
+                            role="user",
+                            parts=[
+                                protos.Part(
+                                    text=HISTORY_RECAP_TEMPLATE.format(summary=summary)
+                                )
+                            ],
+                        ),
+                        protos.Content(
+                            role="model", parts=[protos.Part(text=RECAP_ACK)]
+                        ),
+                    ]
+                except Exception as e:
+                    logger.exception(f"History summary failed {e}")
+            history = recap + history
+            logger.info(f"Compacted {len(dropped)} history message(s)")
+
+    chat_session.history = history
+    revise(chat_session)
+    return True
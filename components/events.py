@@ -5,124 +5,227 @@ Copyright (c) 2024 @notV3NOM
 See the README.md file for licensing and disclaimer information.
 """
 
-import os
-import re
-import uuid
+import time
 import discord
 import asyncio
-import requests
+import threading
 import datetime as dt
 
+from .context import compact_history
+from .censor import CENSOR
+from .tracing import TRACER, current_trace
+from .render import chunk_text, render_response, has_attachments
+from .message_planner import DEFAULT_UPLOAD_LIMIT, SEND_STATS, plan_messages
+from .image_scheduler import current_user
+from .attachments import prepare_attachments
 from .session import SESSIONS, CHAT_SESSION
-from .llm import chat, profanity, fallback_picker
-from .config import BOT_TIMING, BOT_NAME, EXTENSION_MAPPING, logger
-
-
-def extract_artifacts(llm_reponse: str):
-    pattern = r"```(\S+)\n(.*?)\n```"
-    matches = re.findall(pattern, llm_reponse, re.DOTALL)
-    artifacts = []
-    artifact_path_list = []
-    artifacts_count = 0
-
-    if matches:
-        logger.info(f"Extracting {len(matches)} Artifacts")
-        for language, content in matches:
-            extension = (
-                EXTENSION_MAPPING[language.lower()]
-                if language.lower() in EXTENSION_MAPPING
-                else "txt"
-            )
-            temp_file_path = temp_file_path = (
-                f"data/temp-{str(uuid.uuid4())}.{extension}"
-            )
-            with open(temp_file_path, "wb") as f:
-                f.write(content.strip().encode())
-            artifacts.append(
-                discord.File(
-                    temp_file_path, filename=f"temp-{str(uuid.uuid4())}.{extension}"
-                )
-            )
-            artifact_path_list.append(temp_file_path)
-            llm_reponse = llm_reponse.replace(
-                f"```{language}\n{content}\n```", f"<<artifact_{artifacts_count}>>"
-            )
-            artifacts_count += 1
-
-    cleaned_text = re.sub(r"\n\s*\n", "\n\n", llm_reponse.strip())
-    cleaned_text = re.sub(r" +", " ", cleaned_text)
-
-    return artifacts, artifact_path_list, cleaned_text
-
-
-def extract_images(llm_response: str):
-    image_pattern = r"<IMAGE>(.*?)<\/IMAGE>"
-    image_matches = re.findall(image_pattern, llm_response)
-    embeds = []
-    files = []
-    images_count = 0
-
-    if image_matches:
-        logger.info(f"Extracting {len(image_matches)} Images")
-        for image_match in image_matches:
-            generated_image_path = image_match.split("||")[0]
-            image_prompt = image_match.split("||")[1]
-            filename = os.path.basename(generated_image_path)
-            image = discord.File(generated_image_path, filename=filename)
-            embed = discord.Embed(title=image_prompt[:256])
-            embed.set_image(url="attachment://" + filename)
-            embeds.append(embed)
-            files.append(image)
-            llm_response = llm_response.replace(
-                f"<IMAGE>{image_match}</IMAGE>", f"<<image_{images_count}>>"
-            )
-            images_count += 1
-
-    return files, embeds, llm_response
+from .channel_queue import CHANNEL_QUEUES, ChatJob
+from .llm import (
+    ERROR_RESPONSE,
+    GEMINI,
+    StreamError,
+    chat,
+    chat_stream,
+    fallback_picker,
+    unavailable_picker,
+)
+from .config import (
+    BOT_TIMING,
+    BOT_NAME,
+    STREAM_RESPONSES,
+    STREAM_EDIT_TOKENS,
+    STREAM_EDIT_INTERVAL,
+    logger,
+)
+
+# Shown under the partial text of a streamed response that failed
+INTERRUPTED_NOTE = "*The response was interrupted, please try again.*"
+
+# Queued by the stream producer when the response failed
+STREAM_FAILED = object()
+
+QUEUE_FULL_MESSAGE = (
+    "I'm still working through earlier messages here, try again in a moment."
+)
 
 
 async def send_message(message, llm_response: str):
-    image_files, image_embeds, llm_response = extract_images(llm_response)
-    artifacts, artifact_path_list, llm_response = extract_artifacts(llm_response)
-    final_chunks = []
+    with TRACER.span("render"):
+        segments = render_response(llm_response)
+        upload_limit = (
+            message.guild.filesize_limit if message.guild else DEFAULT_UPLOAD_LIMIT
+        )
+        plan = plan_messages(segments, upload_limit)
+    for planned in plan:
+        with TRACER.span("discord.send"):
+            await message.channel.send(**planned.kwargs())
+
+    SEND_STATS.record(len(segments), len(plan))
+    if len(segments) > len(plan):
+        logger.info(
+            f"Sent {len(segments)} segments in {len(plan)} messages, "
+            f"saved {len(segments) - len(plan)} calls"
+        )
 
-    chunks = re.split(r"(<<artifact_\d+>>|<<image_\d+>>)", llm_response)
 
-    for chunk in chunks:
-        if chunk.startswith("<<artifact") or chunk.startswith("<<image"):
-            final_chunks.append(chunk)
+async def stream_message(message, prompt: str, chat_session, attachments):
+    """
+    Stream the LLM response into the channel, editing the reply as text arrives
+
+    The reply is split into messages with chunk_text, so code blocks and list
+    items are never cut, and only the messages whose text changed are edited. Once
+    the response is complete, replies containing images or code artifacts are
+    re-rendered through send_message. A failed response keeps its partial text
+    with a note, and the turn is rolled back.
+
+    The producer thread is always stopped and awaited before returning, so the
+    session is never used by two turns at once.
+    """
+    loop = asyncio.get_running_loop()
+    deltas = asyncio.Queue()
+    stopped = threading.Event()
+
+    def produce():
+        stream = chat_stream(prompt, chat_session, attachments)
+        try:
+            for delta in stream:
+                if stopped.is_set():
+                    break
+                loop.call_soon_threadsafe(deltas.put_nowait, delta)
+        except StreamError:
+            loop.call_soon_threadsafe(deltas.put_nowait, STREAM_FAILED)
+        finally:
+            try:
+                # Rolls back the turn if the stream was abandoned
+                stream.close()
+            finally:
+                loop.call_soon_threadsafe(deltas.put_nowait, None)
+
+    producer = asyncio.ensure_future(asyncio.to_thread(produce))
+    start_time = time.perf_counter()
+    llm_response = ""
+    sent_messages = []
+    shown_texts = []
+    pending_tokens = 0
+    last_edit = start_time
+
+    async def flush():
+        chunks = chunk_text(llm_response)
+        for index, chunk in enumerate(chunks):
+            if index < len(sent_messages):
+                if shown_texts[index] != chunk:
+                    with TRACER.span("discord.edit"):
+                        await sent_messages[index].edit(content=chunk)
+                    shown_texts[index] = chunk
+                continue
+            with TRACER.span("discord.send"):
+                sent_messages.append(await message.channel.send(chunk))
+            shown_texts.append(chunk)
+            if index == 0:
+                logger.info(
+                    f"First token visible after {time.perf_counter() - start_time:.2f}s"
+                )
+        # Chunk boundaries can move as the text grows
+        while len(sent_messages) > len(chunks):
+            shown_texts.pop()
+            await sent_messages.pop().delete()
+
+    failed = False
+    try:
+        while (delta := await deltas.get()) is not None:
+            if delta is STREAM_FAILED:
+                failed = True
+                continue
+            llm_response += delta
+            pending_tokens += len(delta) // 4 + 1
+            now = time.perf_counter()
+            if (
+                pending_tokens >= STREAM_EDIT_TOKENS
+                or now - last_edit >= STREAM_EDIT_INTERVAL
+            ):
+                await flush()
+                pending_tokens = 0
+                last_edit = now
+    finally:
+        stopped.set()
+        await producer
+
+    if failed:
+        if llm_response.strip():
+            llm_response = llm_response.rstrip() + "\n\n" + INTERRUPTED_NOTE
         else:
-            while chunk:
-                if len(chunk) > 2000:
-                    split_index = chunk.rfind("\n", 0, 2000)
-                    if split_index == -1:
-                        split_index = 2000
-                    final_chunks.append(chunk[:split_index])
-                    chunk = chunk[split_index:]
-                else:
-                    final_chunks.append(chunk)
-                    chunk = ""
-
-    for chunk in final_chunks:
-        if chunk.startswith("<<artifact_"):
-            index = int(chunk.split("_")[1].replace(">>", ""))
-            file = artifacts[index]
-            await message.channel.send(" ", file=file)
-        elif chunk.startswith("<<image_"):
-            index = int(chunk.split("_")[1].replace(">>", ""))
-            file = image_files[index]
-            embed = image_embeds[index]
-            await message.channel.send(" ", file=file, embed=embed)
+            llm_response = ERROR_RESPONSE
+        await flush()
+    elif has_attachments(llm_response):
+        for sent_message in sent_messages:
+            await sent_message.delete()
+        await send_message(message, llm_response.strip())
+    else:
+        await flush()
+
+
+async def respond(job: ChatJob):
+    """
+    Run one queued chat turn and send the response to the channel
+    """
+    message = job.message
+    current_user.set(message.author.id)
+    current_trace.set(message.id)
+    if not GEMINI.available:
+        # Fail fast while Gemini's circuit is open, the session is left untouched
+        await message.channel.send(unavailable_picker.pick())
+        return
+    async with message.channel.typing():
+        chat_session = SESSIONS[message.channel.id][CHAT_SESSION]
+        if STREAM_RESPONSES:
+            await stream_message(message, job.prompt, chat_session, job.attachments)
         else:
-            if chunk.strip():
-                await message.channel.send(chunk)
+            response = await asyncio.to_thread(
+                chat, job.prompt, chat_session, job.attachments
+            )
+            llm_response = response.strip()
+            await send_message(message, llm_response)
+
+    try:
+        await asyncio.to_thread(compact_history, chat_session)
+    except Exception as e:
+        logger.exception(f"History compaction failed {e}")
+
+
+def trigger_prompt(client: discord.Client, message: discord.Message) -> str | None:
+    """
+    The prompt of a message addressed to the bot, None if the bot should not reply
+    """
+    if message.author == client.user or message.author.bot:
+        return None
+
+    is_reply = message.reference
+    is_reply_to_bot = (
+        message.reference and message.reference.resolved.author == client.user
+    )
+    mentions_bot_name = (
+        BOT_NAME.lower() in message.content.lower()
+        or client.user.mention in message.content
+    )
 
-    for temp_file_path in artifact_path_list:
-        if os.path.exists(temp_file_path):
-            os.remove(temp_file_path)
+    if not is_reply_to_bot and not mentions_bot_name:
+        return None
+
+    prompt = message.content
+
+    if is_reply and not is_reply_to_bot:
+        prompt = message.reference.resolved.content + prompt
+
+    if mentions_bot_name:
+        prompt = prompt.replace(BOT_NAME, "")
+        prompt = prompt.replace(BOT_NAME.lower(), "")
+        prompt = prompt.replace(client.user.mention, "").strip()
+    return prompt
 
 
 def setup_event_handlers(client: discord.Client):
+    CHANNEL_QUEUES.set_handler(respond)
+
     @client.event
     async def on_ready():
         BOT_TIMING["start_time"] = dt.datetime.now(dt.timezone.utc)
@@ -130,65 +233,25 @@ def setup_event_handlers(client: discord.Client):
 
     @client.event
     async def on_message(message: discord.Message):
-        if message.author == client.user or message.author.bot:
-            return
-
-        is_reply = message.reference
-        is_reply_to_bot = (
-            message.reference and message.reference.resolved.author == client.user
-        )
-        mentions_bot_name = (
-            BOT_NAME.lower() in message.content.lower()
-            or client.user.mention in message.content
-        )
-
-        if not is_reply_to_bot and not mentions_bot_name:
+        start_time = time.perf_counter()
+        prompt = trigger_prompt(client, message)
+        if prompt is None:
             return
+        current_trace.set(message.id)
+        TRACER.observe("trigger", time.perf_counter() - start_time)
 
-        prompt = message.content
-
-        if is_reply and not is_reply_to_bot:
-            prompt = message.reference.resolved.content + prompt
-
-        if mentions_bot_name:
-            prompt = prompt.replace(BOT_NAME, "")
-            prompt = prompt.replace(BOT_NAME.lower(), "")
-            prompt = prompt.replace(client.user.mention, "").strip()
-
-        if profanity.contains_profanity(prompt):
+        if CENSOR.contains(prompt):
             async with message.channel.typing():
                 llm_response = fallback_picker.pick()
                 await message.channel.send(llm_response)
             return
 
-        file_path_list = []
-
+        attachments = []
         if message.attachments:
-            for attachment in message.attachments:
-                if attachment.content_type.startswith(
-                    "image/"
-                ) or attachment.filename.endswith(
-                    (".txt", ".py", ".js", ".tsx", ".pdf")
-                ):
-                    resp = requests.get(attachment.url)
-                    if resp.status_code == 200:
-                        file_data = resp.content
-                        temp_file_path = (
-                            f"data/temp-{str(uuid.uuid4())}-{attachment.filename}"
-                        )
-
-                        with open(temp_file_path, "wb") as f:
-                            f.write(file_data)
-
-                        file_path_list.append(temp_file_path)
-
-        async with message.channel.typing():
-            response = await asyncio.to_thread(
-                chat, prompt, SESSIONS[message.channel.id][CHAT_SESSION], file_path_list
-            )
-            llm_response = response.strip()
-            await send_message(message, llm_response)
+            async with message.channel.typing():
+                attachments = await prepare_attachments(message.attachments)
 
-        for temp_file_path in file_path_list:
-            if os.path.exists(temp_file_path):
-                os.remove(temp_file_path)
+        if not CHANNEL_QUEUES.submit(
+            message.channel.id, ChatJob(message, prompt, attachments)
+        ):
+            await message.reply(QUEUE_FULL_MESSAGE)
@@ -0,0 +1,70 @@
+"""
+GeminiChad
+Copyright (c) 2024 @notV3NOM
+
+See the README.md file for licensing and disclaimer information.
+"""
+
+import asyncio
+import aiohttp
+import concurrent.futures
+
+from .config import HTTP_POOL_SIZE, HTTP_CONNECT_TIMEOUT
+
+http_session = None
+main_loop = None
+
+
+def bind_loop(loop: asyncio.AbstractEventLoop):
+    """
+    Register the bot's event loop so worker threads can run coroutines on it.
+    """
+    global main_loop
+    main_loop = loop
+
+
+def get_http_session() -> aiohttp.ClientSession:
+    """
+    Shared HTTP client with a keep-alive connection pool.
+
+    Must be called from the bot's event loop.
+    """
+    global http_session
+    if http_session is None or http_session.closed:
+        http_session = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(limit=HTTP_POOL_SIZE, keepalive_timeout=60),
+            timeout=aiohttp.ClientTimeout(total=60, connect=HTTP_CONNECT_TIMEOUT),
+        )
+    return http_session
+
+
+def backend_timeout(total: float) -> aiohttp.ClientTimeout:
+    """
+    Request deadline for a backend: connect within HTTP_CONNECT_TIMEOUT, finish within total.
+    """
+    return aiohttp.ClientTimeout(
+        total=total, connect=HTTP_CONNECT_TIMEOUT, sock_read=total
+    )
+
+
+async def close_http_session():
+    if http_session is not None and not http_session.closed:
+        await http_session.close()
+
+
+def run_sync(coro, timeout: float | None = None):
+    """
+    Run a coroutine on the bot's event loop from a worker thread and wait for it.
+
+    Used by tools, which the LLM calls from worker threads. The coroutine is
+    cancelled if it does not finish within the timeout.
+    """
+    if main_loop is None:
+        coro.close()
+        raise RuntimeError("Event loop is not bound")
+    future = asyncio.run_coroutine_threadsafe(coro, main_loop)
+    try:
+        return future.result(timeout)
+    except concurrent.futures.TimeoutError:
+        future.cancel()
+        raise
@@ -0,0 +1,337 @@
+"""
+GeminiChad
+Copyright (c) 2024 @notV3NOM
+
+See the README.md file for licensing and disclaimer information.
+"""
+
+import time
+import heapq
+import asyncio
+import itertools
+import contextvars
+
+from collections import deque
+
+from .tracing import percentile
+from .llm import IMAGE_MODELS, IMAGE_BACKENDS, backend_ready, generate_image
+from .config import (
+    IMAGE_CONCURRENCY,
+    IMAGE_RATE_LIMIT,
+    IMAGE_AUTO_ORDER,
+    IMAGE_HEDGE_PERCENTILE,
+    IMAGE_HEDGE_DELAY,
+    logger,
+)
+
+# Job priorities, lower runs first
+INTERACTIVE = 0
+TOOL = 1
+
+# Samples needed before a backend's own latency percentile is used for hedging
+MIN_LATENCY_SAMPLES = 5
+
+# User on whose behalf the current LLM turn runs, visible to tools in worker threads
+current_user = contextvars.ContextVar("current_user", default=None)
+
+
+class ImageJob:
+    """
+    An image generation request waiting for its backend.
+
+    Attributes:
+        key (tuple): (priority, fair share round, arrival) ordering of the job.
+        future (asyncio.Future): Resolves to the image bytes.
+        dispatched (bool): Whether the job has left the waiting heap.
+        task (asyncio.Task): Generation of the image once dispatched.
+    """
+
+    def __init__(self, model, prompt, user_id, priority, share_round, sequence):
+        self.model = model
+        self.prompt = prompt
+        self.user_id = user_id
+        self.share_round = share_round
+        self.key = (priority, share_round, sequence)
+        self.future = asyncio.get_running_loop().create_future()
+        self.dispatched = False
+        self.task = None
+
+    def cancel(self):
+        """Cancel the job, stopping its generation if it is running"""
+        self.future.cancel()
+        if self.task is not None:
+            self.task.cancel()
+
+    def __lt__(self, other):
+        return self.key < other.key
+
+
+class BackendQueue:
+    """
+    Waiting jobs of one image backend, dispatched within its concurrency and rate
+    limits.
+
+    Within a priority, jobs are ordered in fair share rounds: a user's next job is
+    placed one round after their previous one, so a user queueing many images
+    cannot starve others.
+
+    Attributes:
+        waiting (list): Heap of waiting jobs.
+        running (int): Number of jobs being generated.
+        starts (deque): Start times of jobs in the last minute.
+        last_round (dict): Round of each user's latest queued job.
+        current_round (int): Round of the latest dispatched job.
+        latencies (deque): Recent generation times in seconds.
+        outcomes (deque): Recent generation results, True for success.
+        changes (int): Jobs pushed to or popped from the heap, so waiters only
+            recompute their position after the queue changed.
+    """
+
+    def __init__(self, model, concurrency, rate_per_minute):
+        self.model = model
+        self.concurrency = concurrency
+        self.rate_per_minute = rate_per_minute
+        self.waiting = []
+        self.running = 0
+        self.starts = deque()
+        self.last_round = {}
+        self.current_round = 0
+        self.sequence = itertools.count()
+        self.wakeup = None
+        self.latencies = deque(maxlen=50)
+        self.outcomes = deque(maxlen=50)
+        self.changes = 0
+
+    @property
+    def error_rate(self):
+        if not self.outcomes:
+            return 0.0
+        return self.outcomes.count(False) / len(self.outcomes)
+
+    def hedge_delay(self):
+        """Seconds to wait for this backend before hedging to another one"""
+        if len(self.latencies) < MIN_LATENCY_SAMPLES:
+            return IMAGE_HEDGE_DELAY
+        return percentile(self.latencies, IMAGE_HEDGE_PERCENTILE)
+
+    def submit(self, prompt, user_id, priority):
+        if len(self.last_round) > 1024:
+            self.last_round = {
+                user: share_round
+                for user, share_round in self.last_round.items()
+                if share_round >= self.current_round
+            }
+        share_round = max(self.current_round, self.last_round.get(user_id, -1) + 1)
+        self.last_round[user_id] = share_round
+        job = ImageJob(
+            self.model, prompt, user_id, priority, share_round, next(self.sequence)
+        )
+        heapq.heappush(self.waiting, job)
+        self.changes += 1
+        self.dispatch()
+        return job
+
+    def position(self, job):
+        """
+        1-based queue position of a waiting job, or 0 once it is running.
+        """
+        if job.dispatched:
+            return 0
+        return 1 + sum(1 for other in self.waiting if other < job)
+
+    def rate_wait(self):
+        """Seconds until the rate limit allows another job to start"""
+        now = time.monotonic()
+        while self.starts and now - self.starts[0] >= 60:
+            self.starts.popleft()
+        if len(self.starts) < self.rate_per_minute:
+            return 0
+        return 60 - (now - self.starts[0])
+
+    def dispatch(self):
+        while self.waiting and self.running < self.concurrency:
+            wait = self.rate_wait()
+            if wait > 0:
+                if self.wakeup is None:
+                    self.wakeup = asyncio.get_running_loop().call_later(wait, self.wake)
+                return
+            job = heapq.heappop(self.waiting)
+            job.dispatched = True
+            self.changes += 1
+            if job.future.done():
+                continue
+            self.current_round = job.share_round
+            self.running += 1
+            self.starts.append(time.monotonic())
+            job.task = asyncio.create_task(self.run(job))
+
+    def wake(self):
+        self.wakeup = None
+        self.dispatch()
+
+    async def run(self, job):
+        """
+        Generate the image of a dispatched job. A cancelled job, e.g. the loser of
+        a hedged request, gives its slot back without waiting for the backend.
+        """
+        start_time = time.monotonic()
+        try:
+            image_data = await generate_image(self.model, job.prompt)
+            self.latencies.append(time.monotonic() - start_time)
+            self.outcomes.append(True)
+            if not job.future.done():
+                job.future.set_result(image_data)
+        except asyncio.CancelledError:
+            job.future.cancel()
+            raise
+        except Exception as e:
+            self.outcomes.append(False)
+            if not job.future.done():
+                job.future.set_exception(e)
+        finally:
+            self.running -= 1
+            self.dispatch()
+
+
+class ImageScheduler:
+    """
+    Schedules image generation across backends with per-backend concurrency and
+    rate limits, priority for interactive requests and fair sharing between users.
+    """
+
+    def __init__(self, concurrency=IMAGE_CONCURRENCY, rate_limit=IMAGE_RATE_LIMIT):
+        self.backends = {
+            model: BackendQueue(
+                model, concurrency.get(model.value, 1), rate_limit.get(model.value, 60)
+            )
+            for model in IMAGE_MODELS
+            if model != IMAGE_MODELS.AUTO
+        }
+
+    async def generate(
+        self,
+        model: IMAGE_MODELS,
+        prompt: str,
+        user_id=None,
+        priority: int = TOOL,
+        on_position=None,
+    ) -> bytes:
+        """
+        Queue an image generation job and wait for the image.
+
+        Args:
+            model: image generation backend
+            prompt: image prompt
+            user_id: user the image is generated for, used for fair scheduling
+            priority: INTERACTIVE or TOOL
+            on_position: coroutine function called with the job's queue position
+                         whenever it changes while the job is waiting
+
+        Returns:
+            image_data: bytes of the generated image
+        """
+        if model == IMAGE_MODELS.AUTO:
+            return await self.generate_auto(prompt, user_id, priority, on_position)
+
+        backend = self.backends[model]
+        job = backend.submit(prompt, user_id, priority)
+        try:
+            # Positions are O(n) to compute, only when asked for and the queue changed
+            position = None
+            changes = None
+            while on_position is not None and not job.future.done():
+                if backend.changes != changes:
+                    changes = backend.changes
+                    new_position = backend.position(job)
+                    if new_position != position:
+                        position = new_position
+                        if position:
+                            await on_position(position)
+                await asyncio.wait({job.future}, timeout=1)
+            return await job.future
+        except asyncio.CancelledError:
+            job.cancel()
+            raise
+
+    def ranked(self):
+        """
+        Backends in order of preference for the auto mode.
+
+        Backends with an open circuit or a client warming up, and backends failing
+        more than half of their recent requests go last. The rest are ordered by
+        median latency, falling back to IMAGE_AUTO_ORDER.
+        """
+
+        def score(model):
+            backend = self.backends[model]
+            median = percentile(backend.latencies, 0.5) if backend.latencies else 0
+            preference = (
+                IMAGE_AUTO_ORDER.index(model.value)
+                if model.value in IMAGE_AUTO_ORDER
+                else len(IMAGE_AUTO_ORDER)
+            )
+            unhealthy = backend.error_rate > 0.5
+            available = IMAGE_BACKENDS[model].available and backend_ready(model)
+            return (not available, unhealthy, median, preference)
+
+        return sorted(self.backends, key=score)
+
+    async def generate_auto(self, prompt, user_id, priority, on_position):
+        """
+        Generate on the preferred backend, hedging to the next backend when it is
+        slower than its usual latency and failing over when it errors.
+
+        Returns:
+            image_data: bytes of the first image generated
+        """
+        loop = asyncio.get_running_loop()
+        candidates = deque(self.ranked())
+        pending = set()
+        last_error = None
+
+        def launch():
+            model = candidates.popleft()
+            callback = on_position if not pending else None
+            pending.add(
+                asyncio.create_task(
+                    self.generate(model, prompt, user_id, priority, callback),
+                    name=model.value,
+                )
+            )
+            return loop.time() + self.backends[model].hedge_delay()
+
+        hedge_at = launch()
+        try:
+            while pending:
+                timeout = max(0, hedge_at - loop.time()) if candidates else None
+                done, _ = await asyncio.wait(
+                    pending, timeout=timeout, return_when=asyncio.FIRST_COMPLETED
+                )
+                for task in done:
+                    pending.discard(task)
+                    if task.exception() is None:
+                        return task.result()
+                    last_error = task.exception()
+                    logger.warning(
+                        f"Image backend {task.get_name()} failed {last_error}"
+                    )
+                if candidates and (not done or not pending):
+                    if not done:
+                        logger.info(f"Hedging image request to {candidates[0].value}")
+                    hedge_at = launch()
+        finally:
+            for task in pending:
+                task.cancel()
+        raise last_error
+
+    def stats(self):
+        """
+        Waiting and running jobs per backend.
+        """
+        return {
+            model.value: (len(backend.waiting), backend.running)
+            for model, backend in self.backends.items()
+        }
+
+
+IMAGE_SCHEDULER = ImageScheduler()
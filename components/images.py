@@ -0,0 +1,72 @@
+"""
+GeminiChad
+Copyright (c) 2024 @notV3NOM
+
+See the README.md file for licensing and disclaimer information.
+"""
+
+import time
+import uuid
+import threading
+
+from collections import OrderedDict
+
+from .config import IMAGE_HANDLE_TTL, IMAGE_HANDLE_LIMIT
+
+
+def image_extension(image_data: bytes) -> str:
+    """File extension for image bytes, detected from the file signature"""
+    if image_data.startswith(b"\xff\xd8"):
+        return ".jpg"
+    if image_data[:4] == b"RIFF" and image_data[8:12] == b"WEBP":
+        return ".webp"
+    return ".png"
+
+
+class ImageRegistry:
+    """
+    In-memory store of generated images, referenced by handle.
+
+    The image_generation tool returns a handle inside <IMAGE> tags instead of a
+    file path, and the response renderer resolves it back to the image bytes.
+    Handles expire after a TTL and the number of stored images is bounded.
+
+    Attributes:
+        images (OrderedDict): handle -> (image bytes, creation time), oldest first.
+    """
+
+    def __init__(self, ttl=IMAGE_HANDLE_TTL, limit=IMAGE_HANDLE_LIMIT):
+        self.ttl = ttl
+        self.limit = limit
+        self.images = OrderedDict()
+        self.lock = threading.Lock()
+
+    def register(self, image_data: bytes) -> str:
+        """
+        Store an image and return its handle, which doubles as its file name.
+        """
+        handle = f"image-{uuid.uuid4().hex}{image_extension(image_data)}"
+        with self.lock:
+            self.prune()
+            self.images[handle] = (image_data, time.monotonic())
+        return handle
+
+    def get(self, handle: str) -> bytes | None:
+        """
+        Image bytes for a handle, or None if it is unknown or expired.
+        """
+        with self.lock:
+            self.prune()
+            entry = self.images.get(handle)
+        return entry[0] if entry else None
+
+    def prune(self):
+        now = time.monotonic()
+        while self.images:
+            handle, (_, created) = next(iter(self.images.items()))
+            if len(self.images) <= self.limit and now - created <= self.ttl:
+                break
+            del self.images[handle]
+
+
+IMAGE_REGISTRY = ImageRegistry()
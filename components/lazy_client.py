@@ -0,0 +1,139 @@
+"""
+GeminiChad
+Copyright (c) 2024 @notV3NOM
+
+See the README.md file for licensing and disclaimer information.
+"""
+
+import time
+import asyncio
+import threading
+import concurrent.futures
+
+from .config import logger
+
+
+class WarmingUpError(Exception):
+    """Raised when a client is used while it is being initialized"""
+
+    def __init__(self, name):
+        super().__init__(f"{name} is warming up, try again shortly")
+        self.name = name
+
+
+class LazyClient:
+    """
+    A Gradio client connected on first use, or ahead of time by a background warm-up.
+
+    Connecting to a Space makes network calls, so clients are not created at import
+    time. Calls made while another thread is connecting raise WarmingUpError instead
+    of waiting; a failed connection is retried on the next call.
+
+    Attributes:
+        client (gradio_client.Client): The connected client, None until ready.
+        warming (bool): Whether a connection is in progress.
+        init_time (float): Seconds the last successful connection took.
+        error (str): Error of the last failed connection.
+    """
+
+    def __init__(self, space: str, **kwargs):
+        """
+        Args:
+            space (str): Hugging Face Space of the client.
+            **kwargs: Passed to gradio_client.Client.
+        """
+        self.space = space
+        self.kwargs = kwargs
+        self.client = None
+        self.warming = False
+        self.init_time = None
+        self.error = None
+        self.lock = threading.Lock()
+        LAZY_CLIENTS.append(self)
+
+    @property
+    def ready(self) -> bool:
+        return self.client is not None
+
+    def get(self):
+        """
+        The connected client, connecting if needed.
+
+        Raises:
+            WarmingUpError: another thread is connecting.
+        """
+        if self.client is not None:
+            return self.client
+        if not self.lock.acquire(blocking=False):
+            raise WarmingUpError(self.space)
+        try:
+            if self.client is None:
+                self.connect()
+            return self.client
+        finally:
+            self.lock.release()
+
+    def connect(self):
+        from gradio_client import Client
+
+        self.warming = True
+        start_time = time.perf_counter()
+        try:
+            self.client = Client(self.space, **self.kwargs)
+        except Exception as e:
+            self.error = f"{type(e).__name__}: {e}"
+            logger.warning(f"Connecting to {self.space} failed {self.error}")
+            raise
+        finally:
+            self.warming = False
+        self.init_time = time.perf_counter() - start_time
+        self.error = None
+        logger.info(f"Connected to {self.space} in {self.init_time:.2f}s")
+
+    def predict(self, *args, timeout: float | None = None, **kwargs):
+        """
+        Call an endpoint of the Space, cancelling the job after `timeout` seconds.
+        """
+        if timeout is None:
+            return self.get().predict(*args, **kwargs)
+        job = self.get().submit(*args, **kwargs)
+        try:
+            return job.result(timeout=timeout)
+        except concurrent.futures.TimeoutError:
+            job.cancel()
+            raise
+
+    def status(self) -> str:
+        if self.ready:
+            return f"ready ({self.init_time:.1f}s)"
+        if self.warming:
+            return "warming up"
+        if self.error:
+            return f"failed ({self.error})"
+        return "not connected"
+
+
+LAZY_CLIENTS = []
+
+
+async def warm_clients():
+    """
+    Connect every lazy client concurrently in worker threads.
+    """
+
+    async def warm(lazy_client):
+        try:
+            await asyncio.to_thread(lazy_client.get)
+        except Exception:
+            pass
+
+    await asyncio.gather(*[warm(lazy_client) for lazy_client in LAZY_CLIENTS])
+
+
+def clients_status() -> str:
+    """
+    One line per lazy client with its connection state.
+    """
+    return "\n".join(
+        f"{lazy_client.space}: {lazy_client.status()}" for lazy_client in LAZY_CLIENTS
+    )
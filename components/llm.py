@@ -5,20 +5,33 @@ Copyright (c) 2024 @notV3NOM
 See the README.md file for licensing and disclaimer information.
 """
 
+import os
 import csv
+import time
 import base64
-import requests
+import asyncio
+import contextvars
+import datetime as dt
 import google.generativeai as genai
 
 from enum import Enum
-from typing import List
+from weakref import WeakKeyDictionary, WeakSet
+from typing import List, Iterator
+from contextlib import contextmanager
 from collections.abc import Iterable
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
 
-from gradio_client import Client
-from better_profanity import profanity
+from google.api_core.exceptions import ServerError, TooManyRequests
+from google.generativeai import protos, caching
 from google.generativeai.types import HarmCategory, HarmBlockThreshold, content_types
 
 from .picker import RandomPicker
+from .tracing import TRACER
+from .model_cache import ModelCache
+from .router import ROUTER, CHAT_TASK, TIME_TASK
+from .resilience import dependency, CircuitOpenError
+from .lazy_client import LazyClient, WarmingUpError
+from .http_client import get_http_session, backend_timeout
 from .prompts import DEFAULT_NEGATIVE_PROMPT
 from .config import (
     SD_XL_BASE_URL,
@@ -28,6 +41,17 @@ from .config import (
     DEFAULT_SYSTEM_MESSAGE,
     ADDITIONAL_SYSTEM_MESSAGE,
     LLM,
+    CONTEXT_SUMMARY_MODEL,
+    SDXL_TIMEOUT,
+    SCHNELL_TIMEOUT,
+    SD3_TIMEOUT,
+    TOOL_CONCURRENCY,
+    TOOL_TIMEOUT,
+    TOOL_TIMEOUTS,
+    MODEL_CACHE_SIZE,
+    CONTEXT_CACHE,
+    CONTEXT_CACHE_MIN_TOKENS,
+    CONTEXT_CACHE_TTL,
     logger,
 )
 
@@ -42,16 +66,97 @@ SAFETY_SETTINGS = {
     HarmCategory.HARM_CATEGORY_DANGEROUS_CONTENT: HarmBlockThreshold.BLOCK_NONE,
 }
 
-calc_model = genai.GenerativeModel(
-    model_name=model_name, safety_settings=SAFETY_SETTINGS, tools="code_execution"
+ERROR_RESPONSE = "Sorry, I could not process your request."
+
+
+class StreamError(Exception):
+    """Raised by chat_stream when a response fails, after its turn is rolled back"""
+
+
+GEMINI = dependency("gemini", retries=2, retry_on=(ServerError, TooManyRequests))
+
+# Model turns with function calls allowed in a row before giving up on a response
+MAX_TOOL_ROUNDS = 8
+
+tool_executor = ThreadPoolExecutor(
+    max_workers=TOOL_CONCURRENCY, thread_name_prefix="tool"
 )
 
-json_model = genai.GenerativeModel(
-    model_name=model_name,
-    safety_settings=SAFETY_SETTINGS,
+# Monotonic deadline of the tool call running in this context, None outside tools
+tool_deadline = contextvars.ContextVar("tool_deadline", default=None)
+
+
+def time_left(default: float) -> float:
+    """
+    Seconds until the deadline of the current tool call, `default` outside of one.
+
+    Tools pass it as the timeout of their blocking calls, so a tool past its
+    deadline gives its worker thread back instead of hanging on.
+    """
+    deadline = tool_deadline.get()
+    if deadline is None:
+        return default
+    return max(0, deadline - time.monotonic())
+
+
+# Tools of models on a context cache, which requests cannot carry
+context_cache_tools = WeakKeyDictionary()
+
+
+def create_model(model_name, system_instruction, tools, generation_config):
+    return genai.GenerativeModel(
+        model_name=model_name,
+        safety_settings=SAFETY_SETTINGS,
+        generation_config=generation_config,
+        tools=tools,
+        system_instruction=system_instruction,
+    )
+
+
+def create_context_cached_model(
+    model_name, system_instruction, tools, generation_config, ttl
+):
+    cached_content = caching.CachedContent.create(
+        model=model_name,
+        system_instruction=system_instruction,
+        tools=tools,
+        ttl=dt.timedelta(seconds=ttl),
+    )
+    model = genai.GenerativeModel.from_cached_content(
+        cached_content,
+        generation_config=generation_config,
+        safety_settings=SAFETY_SETTINGS,
+    )
+    if tools is not None:
+        context_cache_tools[model] = content_types.to_function_library(tools)
+    return model
+
+
+MODEL_CACHE = ModelCache(
+    create_model,
+    MODEL_CACHE_SIZE,
+    context_cache_factory=create_context_cached_model if CONTEXT_CACHE else None,
+    min_tokens=CONTEXT_CACHE_MIN_TOKENS,
+    ttl=CONTEXT_CACHE_TTL,
+)
+
+
+def model_tools(model: genai.GenerativeModel):
+    """Function library of a model, None without tools"""
+    return model._tools or context_cache_tools.get(model)
+
+
+calc_model = MODEL_CACHE.get(model_name, tools="code_execution")
+
+json_model = MODEL_CACHE.get(
+    model_name,
     generation_config={"response_mime_type": "application/json", "temperature": 0},
 )
 
+summary_model = MODEL_CACHE.get(
+    "models/" + CONTEXT_SUMMARY_MODEL, generation_config={"temperature": 0}
+)
+
 
 def new_session(
     system_message: str = DEFAULT_SYSTEM_MESSAGE,
@@ -69,120 +174,362 @@ def new_session(
     Returns:
         chat_session: New chat session
     """
-    model = genai.GenerativeModel(
-        model_name=model_name,
-        safety_settings=SAFETY_SETTINGS,
-        system_instruction=system_message + ADDITIONAL_SYSTEM_MESSAGE,
-        tools=tools,
-    )
-    chat_session = model.start_chat(
-        enable_automatic_function_calling=True, history=history
+    model = MODEL_CACHE.get(
+        model_name, system_message + ADDITIONAL_SYSTEM_MESSAGE, tools or None
     )
+    chat_session = model.start_chat(history=history)
     return chat_session
 
 
 def temp_session():
-    model = genai.GenerativeModel(
-        model_name=model_name, safety_settings=SAFETY_SETTINGS
-    )
-    chat_session = model.start_chat()
+    chat_session = MODEL_CACHE.get(model_name).start_chat()
     return chat_session
 
 
+def tier_model(model: genai.GenerativeModel, tier: str) -> genai.GenerativeModel:
+    """
+    The shared model with the same configuration on the model of a routing tier
+    """
+    return MODEL_CACHE.variant(model, "models/" + ROUTER.model_name(tier))
+
+
+@contextmanager
+def routed(
+    chat_session: genai.ChatSession,
+    task: str,
+    prompt: str,
+    attachments: List[content_types.PartType],
+):
+    """
+    Serve one turn of a chat session with the tier the router picks for it
+
+    The session keeps its history and goes back to its own model afterwards.
+    Turns of a session run one at a time, so swapping the model is safe.
+    """
+    from .context import estimate_tokens  # context imports this module
+
+    model = chat_session.model
+    tools = model_tools(model) is not None
+    context_tokens = estimate_tokens(settled_history(chat_session))
+    tier = ROUTER.route(task, prompt, attachments, tools, context_tokens)
+    chat_session.model = tier_model(model, tier)
+    start_time = time.perf_counter()
+    try:
+        yield tier
+    finally:
+        chat_session.model = model
+        ROUTER.record(tier, time.perf_counter() - start_time)
+
+
+def generate_json(prompt: str, task: str = TIME_TASK):
+    """
+    Generate a JSON response with the tier routed for the task
+
+    Args:
+        prompt: input prompt
+        task: kind of request, for routing
+
+    Returns:
+        response: GenerateContentResponse with JSON text
+    """
+    tier = ROUTER.route(task, prompt)
+    start_time = time.perf_counter()
+    try:
+        with TRACER.span("gemini.generate_content", tier=tier):
+            return GEMINI.call(tier_model(json_model, tier).generate_content, prompt)
+    finally:
+        ROUTER.record(tier, time.perf_counter() - start_time)
+
+
+# Chat sessions with a turn in flight, whose `history` must not be read
+active_sessions = WeakSet()
+
+# Revision of each chat session's history, bumped whenever it is rewritten
+history_revisions = WeakKeyDictionary()
+
+
+def revise(chat_session: genai.ChatSession):
+    """Record that the history of a session changed"""
+    history_revisions[chat_session] = history_revisions.get(chat_session, 0) + 1
+
+
+def history_revision(chat_session: genai.ChatSession) -> int:
+    """
+    Revision of a session's history, which changes with every turn, rollback and
+    compaction, even when the history keeps its length.
+    """
+    return history_revisions.get(chat_session, 0)
+
+
+def settled_history(chat_session: genai.ChatSession) -> list:
+    """
+    History of a chat session, safe to read at any time
+
+    Reading `history` raises while a streamed response is in flight, so only the
+    turns before it are returned then. A turn left broken is dropped.
+    """
+    if chat_session in active_sessions:
+        return list(chat_session._history)
+    try:
+        return chat_session.history
+    except Exception as e:
+        logger.warning(f"Dropping a broken turn from a chat session {e}")
+        chat_session._last_sent = None
+        chat_session._last_received = None
+        return chat_session._history
+
+
+def begin_turn(chat_session: genai.ChatSession) -> int:
+    """Mark a turn as in flight, returning the history length to roll back to"""
+    length = len(settled_history(chat_session))
+    active_sessions.add(chat_session)
+    return length
+
+
+def rollback(chat_session: genai.ChatSession, length: int):
+    """
+    Restore the history of a session to the start of a failed turn
+
+    A broken stream leaves the session unable to build its history, and a turn
+    stopped between function calls leaves a call without its response.
+    """
+    chat_session._last_sent = None
+    chat_session._last_received = None
+    del chat_session._history[length:]
+    revise(chat_session)
+
+
+def function_calls(response) -> list:
+    return [part.function_call for part in response.parts if "function_call" in part]
+
+
+def error_part(name: str, error: str) -> protos.Part:
+    return protos.Part(
+        function_response=protos.FunctionResponse(name=name, response={"error": error})
+    )
+
+
+def run_function_calls(
+    chat_session: genai.ChatSession, calls: list
+) -> List[protos.Part]:
+    """
+    Execute the function calls of a model turn concurrently
+
+    Each call runs in the tool executor, with the caller's context variables, and has
+    its own deadline from TOOL_TIMEOUTS, which the tool reads with time_left. A call
+    that fails or misses its deadline gets an error response, so one slow tool
+    cannot stall the turn.
+
+    Args:
+        chat_session: Chat session whose tools are called
+        calls: function calls requested by the model
+
+    Returns:
+        parts: function responses, in the order of the calls
+    """
+    tools = model_tools(chat_session.model)
+
+    def call(fc, deadline):
+        tool_deadline.set(deadline)
+        with TRACER.span("tool." + fc.name):
+            return tools(fc)
+
+    start_time = time.monotonic()
+    deadlines = [start_time + TOOL_TIMEOUTS.get(fc.name, TOOL_TIMEOUT) for fc in calls]
+    futures = [
+        tool_executor.submit(contextvars.copy_context().run, call, fc, deadline)
+        for fc, deadline in zip(calls, deadlines)
+    ]
+    parts = []
+    for fc, future, deadline in zip(calls, futures, deadlines):
+        try:
+            part = future.result(timeout=max(0, deadline - time.monotonic()))
+            parts.append(part or error_part(fc.name, "Unknown function"))
+        except (TimeoutError, FutureTimeoutError):
+            future.cancel()
+            logger.warning(f"Tool {fc.name} timed out")
+            parts.append(error_part(fc.name, "Timed out"))
+        except Exception as e:
+            logger.exception(f"Tool {fc.name} failed {e}")
+            parts.append(error_part(fc.name, f"{type(e).__name__}: {e}"))
+    return parts
+
+
 def chat(
-    prompt: str, chat_session: genai.ChatSession, file_path_list: List[str] = []
+    prompt: str,
+    chat_session: genai.ChatSession,
+    attachments: List[content_types.PartType] = [],
+    task: str = CHAT_TASK,
 ) -> str:
     """
     Chat with the LLM
 
+    Function calls requested by the model are executed concurrently and their
+    responses sent back together, until the model answers with text.
+
     Args:
         prompt: input prompt
         chat_session: Chat session
-        file_path: path of the input file (Optional)
+        attachments: uploaded files or text parts to send with the prompt (Optional)
+        task: kind of request, for model routing (Optional)
 
     Returns:
-        image_path: path of the generated image
+        response: text of the LLM response
     """
-    inputs = [prompt]
+    inputs = [prompt, *attachments]
+    length = begin_turn(chat_session)
 
-    if len(file_path_list):
-        for file_path in file_path_list:
-            file = genai.upload_file(path=file_path)
-            inputs.append(file)
+    try:
+        with routed(chat_session, task, prompt, attachments) as tier:
+            for _ in range(MAX_TOOL_ROUNDS):
+                with TRACER.span("gemini.send_message", tier=tier):
+                    response = GEMINI.call(chat_session.send_message, inputs)
+                calls = function_calls(response)
+                if not calls:
+                    return response.text
+                inputs = run_function_calls(chat_session, calls)
+        logger.warning("Too many function call rounds")
+    except CircuitOpenError as e:
+        logger.warning(e)
+    except Exception as e:
+        logger.exception(e)
+    finally:
+        active_sessions.discard(chat_session)
+        revise(chat_session)
+    rollback(chat_session, length)
+    return ERROR_RESPONSE
+
+
+def chat_stream(
+    prompt: str,
+    chat_session: genai.ChatSession,
+    attachments: List[content_types.PartType] = [],
+    task: str = CHAT_TASK,
+) -> Iterator[str]:
+    """
+    Chat with the LLM and stream the response as it is generated
+
+    Function calls requested by the model are executed concurrently between
+    streamed turns.
+
+    Args:
+        prompt: input prompt
+        chat_session: Chat session
+        attachments: uploaded files or text parts to send with the prompt (Optional)
+        task: kind of request, for model routing (Optional)
+
+    Yields:
+        text: next piece of the response text
+
+    Raises:
+        StreamError: if the response failed, possibly after some text was yielded
+    """
+    inputs = [prompt, *attachments]
+    length = begin_turn(chat_session)
 
     try:
-        response = chat_session.send_message(inputs)
-        return response.text
+        with routed(chat_session, task, prompt, attachments) as tier:
+            for _ in range(MAX_TOOL_ROUNDS):
+                with TRACER.span("gemini.send_message", tier=tier), GEMINI.attempt():
+                    response = chat_session.send_message(inputs, stream=True)
+                    for chunk in response:
+                        parts = (
+                            chunk.candidates[0].content.parts
+                            if chunk.candidates
+                            else []
+                        )
+                        for part in parts:
+                            if part.text:
+                                yield part.text
+
+                calls = function_calls(response)
+                if not calls:
+                    return
+                inputs = run_function_calls(chat_session, calls)
+        logger.warning("Too many function call rounds")
+    except CircuitOpenError as e:
+        logger.warning(e)
+    except GeneratorExit:
+        rollback(chat_session, length)
+        raise
     except Exception as e:
         logger.exception(e)
-        return "Sorry, I could not process your request."
+    finally:
+        active_sessions.discard(chat_session)
+        revise(chat_session)
+    rollback(chat_session, length)
+    raise StreamError(ERROR_RESPONSE)
 
 
-def generate_image_sdxl(prompt: str) -> str:
+CLOUDFLARE_HEADERS = {
+    "Authorization": f"Bearer {CLOUDFLARE_API_TOKEN}",
+    "Content-Type": "application/json",
+}
+
+
+async def generate_image_sdxl(prompt: str) -> bytes:
     """Generates an Image using Stable Diffusion XL 1.0 (Cloudflare)
 
     Args:
         prompt: image prompt
 
     Returns:
-        image_path: path of the generated image
+        image_data: bytes of the generated image
 
     """
     data = {"prompt": prompt}
-    headers = {
-        "Authorization": f"Bearer {CLOUDFLARE_API_TOKEN}",
-        "Content-Type": "application/json",
-    }
-    response = requests.post(SD_XL_BASE_URL, headers=headers, json=data)
-
-    image_path = "data/image.png"
-    with open(image_path, "wb") as f:
-        f.write(response.content)
+    async with get_http_session().post(
+        SD_XL_BASE_URL,
+        headers=CLOUDFLARE_HEADERS,
+        json=data,
+        timeout=backend_timeout(SDXL_TIMEOUT),
+    ) as response:
+        response.raise_for_status()
+        image_data = await response.read()
 
-    return image_path
+    return image_data
 
 
-def generate_image_schnell(prompt: str) -> str:
+async def generate_image_schnell(prompt: str) -> bytes:
     """Generates an Image using FLUX.1 Schnell (Cloudflare)
 
     Args:
         prompt: image prompt
 
     Returns:
-        image_path: path of the generated image
+        image_data: bytes of the generated image
 
     """
     data = {"prompt": prompt}
-    headers = {
-        "Authorization": f"Bearer {CLOUDFLARE_API_TOKEN}",
-        "Content-Type": "application/json",
-    }
-    response = requests.post(SCHNELL_BASE_URL, headers=headers, json=data)
-    response_json = response.json()
+    async with get_http_session().post(
+        SCHNELL_BASE_URL,
+        headers=CLOUDFLARE_HEADERS,
+        json=data,
+        timeout=backend_timeout(SCHNELL_TIMEOUT),
+    ) as response:
+        response.raise_for_status()
+        response_json = await response.json()
     base64_image = response_json["result"]["image"]
     image_data = base64.b64decode(base64_image)
 
-    image_path = "data/image.png"
-    with open(image_path, "wb") as f:
-        f.write(image_data)
+    return image_data
 
-    return image_path
 
+sd3_client = LazyClient("stabilityai/stable-diffusion-3-medium", verbose=False)
 
-sd3_client = Client("stabilityai/stable-diffusion-3-medium", verbose=False)
 
-
-def generate_image_sd3(prompt: str) -> str:
+def generate_image_sd3(prompt: str) -> bytes:
     """Generates an Image using Stable Diffusion 3.0 Medium (Huggingface)
 
     Args:
         prompt: image prompt
 
     Returns:
-        image_path: path of the generated image
+        image_data: bytes of the generated image
 
     """
     path, _ = sd3_client.predict(
+        timeout=SD3_TIMEOUT,
         prompt=prompt,
         negative_prompt=DEFAULT_NEGATIVE_PROMPT,
         seed=0,
@@ -193,7 +540,10 @@ def generate_image_sd3(prompt: str) -> str:
         num_inference_steps=28,
         api_name="/infer",
     )
-    return path
+    with open(path, "rb") as f:
+        image_data = f.read()
+    os.remove(path)
+    return image_data
 
 
 # Fallback responses to be used when user input contains profanity
@@ -202,11 +552,11 @@ with open("static/fallback_responses.txt", "r") as file:
 
 fallback_picker = RandomPicker(fallback_responses)
 
-# Custom censor words to trigger fallback responses
-with open("static/censor_words.txt", "r") as file:
-    custom_censor_words = [line.strip() for line in file if line.strip()]
+# Responses to be used while Gemini is unavailable
+with open("static/unavailable_responses.txt", "r") as file:
+    unavailable_responses = [line.strip() for line in file if line.strip()]
 
-profanity.add_censor_words(custom_censor_words)
+unavailable_picker = RandomPicker(unavailable_responses)
 
 # Personas
 personas = {}
@@ -222,6 +572,7 @@ class IMAGE_MODELS(Enum):
     SDXL = "sdxl"
     SD3 = "sd3"
     SCHNELL = "schnell"
+    AUTO = "auto"
 
 
 IMAGE_GENERATORS = {
@@ -229,3 +580,40 @@ IMAGE_GENERATORS = {
     IMAGE_MODELS.SD3: generate_image_sd3,
     IMAGE_MODELS.SCHNELL: generate_image_schnell,
 }
+
+IMAGE_BACKENDS = {model: dependency(model.value) for model in IMAGE_GENERATORS}
+
+IMAGE_CLIENTS = {IMAGE_MODELS.SD3: sd3_client}
+
+
+def backend_ready(model: IMAGE_MODELS) -> bool:
+    """False while the backend's client is warming up"""
+    lazy_client = IMAGE_CLIENTS.get(model)
+    return lazy_client is None or not lazy_client.warming
+
+
+async def generate_image(model: IMAGE_MODELS, prompt: str) -> bytes:
+    """
+    Generate an image with the given backend
+
+    Cloudflare backends are awaited natively, the Huggingface client runs in a
+    worker thread bounded by its deadline. Calls go through the backend's
+    circuit breaker, except while the backend's client is warming up.
+
+    Args:
+        model: image generation backend
+        prompt: image prompt
+
+    Returns:
+        image_data: bytes of the generated image
+    """
+    if not backend_ready(model):
+        raise WarmingUpError(model.value)
+    generator = IMAGE_GENERATORS[model]
+    if asyncio.iscoroutinefunction(generator):
+        return await IMAGE_BACKENDS[model].acall(generator, prompt)
+    return await IMAGE_BACKENDS[model].acall(
+        lambda: asyncio.wait_for(
+            asyncio.to_thread(generator, prompt), timeout=SD3_TIMEOUT
+        )
+    )
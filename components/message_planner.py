@@ -0,0 +1,123 @@
+"""
+GeminiChad
+Copyright (c) 2024 @notV3NOM
+
+See the README.md file for licensing and disclaimer information.
+"""
+
+import threading
+
+from .render import MESSAGE_LIMIT
+
+# Discord limits per message
+MAX_FILES = 10
+MAX_EMBEDS = 10
+DEFAULT_UPLOAD_LIMIT = 10 * 1024 * 1024
+
+
+class PlannedMessage:
+    """
+    One message of a send plan.
+
+    Attributes:
+        content (str): Message text, or None.
+        files (list): discord.File attachments.
+        embeds (list): discord.Embed image embeds.
+        size (int): Total bytes of the files.
+    """
+
+    def __init__(self):
+        self.content = None
+        self.files = []
+        self.embeds = []
+        self.size = 0
+
+    def kwargs(self) -> dict:
+        """Keyword arguments for channel.send"""
+        return {
+            "content": self.content,
+            "files": self.files or None,
+            "embeds": self.embeds or None,
+        }
+
+
+def fits(planned: PlannedMessage, segment, upload_limit: int) -> bool:
+    """
+    Whether a segment can be added to a message without changing the reading order
+    or breaking a Discord limit.
+
+    Discord shows the text of a message first, then its attachments, then its
+    embeds. Text therefore only joins a message without files, and an artifact only
+    joins a message without embeds.
+    """
+    if segment.file is None:
+        if planned.files:
+            return False
+        if planned.content is None:
+            return True
+        return len(planned.content) + 1 + len(segment.text) <= MESSAGE_LIMIT
+
+    if len(planned.files) >= MAX_FILES or planned.size + segment.size > upload_limit:
+        return False
+    if segment.embed is None:
+        return not planned.embeds
+    return len(planned.embeds) < MAX_EMBEDS
+
+
+def plan_messages(segments: list, upload_limit: int = DEFAULT_UPLOAD_LIMIT) -> list:
+    """
+    Pack rendered segments into as few messages as Discord allows, in reading order.
+
+    Args:
+        segments: list of render.Segment in reading order
+        upload_limit: maximum total bytes of the files of one message
+
+    Returns:
+        plan: list of PlannedMessage
+    """
+    plan = []
+    for segment in segments:
+        if not plan or not fits(plan[-1], segment, upload_limit):
+            plan.append(PlannedMessage())
+        planned = plan[-1]
+        if segment.file is None:
+            if planned.content is None:
+                planned.content = segment.text
+            else:
+                planned.content += "\n" + segment.text
+        else:
+            planned.files.append(segment.file)
+            planned.size += segment.size
+            if segment.embed is not None:
+                planned.embeds.append(segment.embed)
+    return plan
+
+
+class SendStats:
+    """
+    Counts the messages sent for replies against one send per segment.
+
+    Attributes:
+        replies (int): Replies sent.
+        segments (int): Segments in those replies, the sends without planning.
+        messages (int): Messages actually sent.
+    """
+
+    def __init__(self):
+        self.replies = 0
+        self.segments = 0
+        self.messages = 0
+        self.lock = threading.Lock()
+
+    def record(self, segments: int, messages: int):
+        with self.lock:
+            self.replies += 1
+            self.segments += segments
+            self.messages += messages
+
+    def summary(self) -> str:
+        saved = self.segments - self.messages
+        return f"{self.messages} sends for {self.replies} replies, {saved} saved"
+
+
+SEND_STATS = SendStats()
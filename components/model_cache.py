@@ -0,0 +1,148 @@
+"""
+GeminiChad
+Copyright (c) 2024 @notV3NOM
+
+See the README.md file for licensing and disclaimer information.
+"""
+
+import json
+import time
+import hashlib
+import threading
+
+from weakref import WeakKeyDictionary
+from collections import OrderedDict
+
+from .config import logger
+
+# Seconds before a context cache expires at which its model is rebuilt
+REFRESH_MARGIN = 60
+
+
+def tool_names(tools) -> tuple:
+    if tools is None:
+        return ()
+    if isinstance(tools, str):
+        return (tools,)
+    return tuple(getattr(tool, "__name__", str(tool)) for tool in tools)
+
+
+def model_key(model_name, system_instruction, tools, generation_config) -> tuple:
+    """
+    Cache key of a model: its name, a hash of its system instruction, the names of
+    its tools and its generation config.
+    """
+    system_hash = hashlib.sha256((system_instruction or "").encode()).hexdigest()
+    config = json.dumps(generation_config or {}, sort_keys=True)
+    return (model_name, system_hash, tool_names(tools), config)
+
+
+class ModelCache:
+    """
+    A bounded LRU of model instances shared by chat sessions.
+
+    Sessions with the same model, system instruction, tools and generation config
+    share one model and are cheap `start_chat` calls on it. When a context cache
+    factory is given, system instructions of at least `min_tokens` are put in a
+    Gemini context cache so they are not processed and billed on every turn. Those
+    models are rebuilt shortly before the context cache expires.
+
+    Attributes:
+        entries (OrderedDict): key -> (model, expiry time or None), least recently used first.
+        specs (WeakKeyDictionary): model -> (system instruction, tools, generation config).
+        hits (int): Models served from the cache.
+        misses (int): Models created.
+        context_caches (int): Models created on a context cache.
+    """
+
+    def __init__(
+        self,
+        factory,
+        max_size: int,
+        context_cache_factory=None,
+        min_tokens: int = 32768,
+        ttl: float = 3600,
+    ):
+        """
+        Initialize the ModelCache.
+
+        Args:
+            factory (callable): (model_name, system_instruction, tools,
+                generation_config) -> model.
+            max_size (int): Maximum number of models kept.
+            context_cache_factory (callable, optional): Same arguments plus the TTL in
+                seconds -> model on a context cache. Disables context caching if None.
+            min_tokens (int): Smallest system instruction put in a context cache.
+            ttl (float): Seconds a context cache is kept.
+        """
+        self.factory = factory
+        self.max_size = max_size
+        self.context_cache_factory = context_cache_factory
+        self.min_tokens = min_tokens
+        self.ttl = ttl
+        self.entries = OrderedDict()
+        self.specs = WeakKeyDictionary()
+        self.hits = 0
+        self.misses = 0
+        self.context_caches = 0
+        self.lock = threading.Lock()
+
+    def get(
+        self, model_name, system_instruction=None, tools=None, generation_config=None
+    ):
+        """
+        The shared model for a configuration, created on a miss.
+        """
+        key = model_key(model_name, system_instruction, tools, generation_config)
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                model, expiry = entry
+                if expiry is None or expiry > time.monotonic():
+                    self.entries.move_to_end(key)
+                    self.hits += 1
+                    return model
+
+        # Built outside the lock, creating a context cache is a network call
+        spec = (system_instruction, tools, generation_config)
+        model, expiry = self.create(model_name, *spec)
+        with self.lock:
+            self.misses += 1
+            self.specs[model] = spec
+            self.entries[key] = (model, expiry)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+        return model
+
+    def create(self, model_name, system_instruction, tools, generation_config):
+        args = (model_name, system_instruction, tools, generation_config)
+        tokens = len((system_instruction or "").encode()) // 4
+        if self.context_cache_factory is None or tokens < self.min_tokens:
+            return self.factory(*args), None
+
+        expiry = time.monotonic() + self.ttl - REFRESH_MARGIN
+        try:
+            model = self.context_cache_factory(*args, self.ttl)
+        except Exception as e:
+            # Retried once the entry expires
+            logger.warning(f"Context caching failed for {model_name} {e}")
+            return self.factory(*args), expiry
+        self.context_caches += 1
+        return model, expiry
+
+    def variant(self, model, model_name):
+        """
+        The shared model with the configuration of `model` on another model name,
+        or `model` itself if it was not created by this cache.
+        """
+        spec = self.specs.get(model)
+        if spec is None:
+            return model
+        return self.get(model_name, *spec)
+
+    def summary(self) -> str:
+        return (
+            f"{len(self.entries)} models, {self.hits} hits, {self.misses} misses, "
+            f"{self.context_caches} context caches"
+        )
@@ -60,8 +60,20 @@ Avoid using the word "reminder".
 Acknowledge the current time and occasion appropriately.
 """
 
+REMINDER_FALLBACK_TEMPLATE = """It's time for: **{reminder}**"""
+
 FIND_TIME_TEMPLATE = """Find the relative time and a title for a reminder from the given reminder message.
 Strictly respond in JSON with format { "time" : _time , "title" : _title } 
 _time is a string having the relative time that can be parsed by python's dateparser.parse(value).
 _title is a 5-10 words title for the reminder. 
 Reminder : """
+
+HISTORY_SUMMARY_TEMPLATE = """Summarize the following conversation between a user and an assistant.
+Keep names, facts, decisions, preferences and open questions that may matter later in the conversation.
+Write a compact recap of at most 200 words, without any introductory remarks.
+
+{conversation}
+"""
+
+HISTORY_RECAP_TEMPLATE = """Recap of our earlier conversation:
+{summary}"""
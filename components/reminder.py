@@ -5,53 +5,96 @@ Copyright (c) 2024 @notV3NOM
 See the README.md file for licensing and disclaimer information.
 """
 
-import os
-import json
+import time
+import heapq
+import asyncio
 import discord
 import datetime as dt
 
-from .config import logger
-from .llm import chat, temp_session
-from .prompts import PING_TEMPLATE, REMINDER_TEMPLATE
+from .reminder_store import ReminderStore, SQLiteReminderStore, due_time
+from .llm import ERROR_RESPONSE, chat, temp_session
+from .router import REMINDER_TASK
+from .prompts import PING_TEMPLATE, REMINDER_TEMPLATE, REMINDER_FALLBACK_TEMPLATE
+from .config import (
+    REMINDER_DB,
+    REMINDER_WINDOW,
+    REMINDER_WINDOW_LIMIT,
+    REMINDER_LEAD_TIME,
+    REMINDER_CONCURRENCY,
+    logger,
+)
+
+# Upper bound on a single sleep, so wall clock adjustments are picked up
+MAX_SLEEP = 3600
 
 
 class ReminderManager:
     """
     Class to manage reminders, including adding, saving, loading, and checking reminders.
+
+    Reminders live in a ReminderStore. Only the reminders due within the next
+    window are loaded, into a min-heap keyed on their due time as a UTC epoch. The
+    scheduler sleeps until the next reminder is due and is woken early when an
+    earlier reminder is added.
+
+    Notification texts are generated in the background `lead_time` seconds before
+    a reminder is due, so due reminders are sent without waiting on the LLM. A
+    static text is sent if generation has not finished in time.
     """
 
-    def __init__(self, filename="data/reminders.json"):
+    def __init__(
+        self,
+        store: ReminderStore = None,
+        window=REMINDER_WINDOW,
+        window_limit=REMINDER_WINDOW_LIMIT,
+        lead_time=REMINDER_LEAD_TIME,
+        concurrency=REMINDER_CONCURRENCY,
+    ):
         """
-        Initialize the ReminderManager with a data file path.
+        Initialize the ReminderManager with a reminder store.
 
         Args:
-            filename (str): The path to the file where reminders are stored. Defaults to 'data/reminders.json'.
+            store (ReminderStore): Where reminders are stored. Defaults to SQLite at
+                REMINDER_DB, migrating 'data/reminders.json' if it exists.
+            window (float): Seconds ahead of now for which reminders are loaded.
+            window_limit (int): Maximum number of reminders loaded at once.
+            lead_time (float): Seconds before the due time to generate the text.
+            concurrency (int): Maximum concurrent text generations, and deliveries.
         """
-        self.filename = filename
-        self.load_reminders()
+        self.store = store or SQLiteReminderStore(
+            REMINDER_DB, legacy_path="data/reminders.json"
+        )
+        self.window = window
+        self.window_limit = window_limit
+        self.lead_time = lead_time
+        self.heap = []
+        self.upcoming = []
+        self.prepared = {}
+        self.window_end = 0.0
+        self.wakeup = asyncio.Event()
+        self.generation_semaphore = asyncio.Semaphore(concurrency)
+        self.delivery_semaphore = asyncio.Semaphore(concurrency)
 
     def load_reminders(self):
         """
-        Load reminders from the data file.
-
-        If the file does not exist, initialize an empty list of reminders.
+        Load the reminders due within the next window from the store.
         """
-        if os.path.exists(self.filename):
-            with open(self.filename, "r") as file:
-                self.reminders = json.load(file)
+        reminders = self.store.due_before(time.time() + self.window, self.window_limit)
+        self.heap = [
+            (due, reminder_id, reminder) for reminder_id, due, reminder in reminders
+        ]
+        heapq.heapify(self.heap)
+        self.upcoming = [entry for entry in self.heap if entry[1] not in self.prepared]
+        heapq.heapify(self.upcoming)
+        if len(reminders) < self.window_limit:
+            self.window_end = time.time() + self.window
         else:
-            self.reminders = []
-
-    def save_reminders(self):
-        """
-        Save the current list of reminders to the data file.
-        """
-        with open(self.filename, "w") as file:
-            json.dump(self.reminders, file, indent=4)
+            # Truncated window, reminders due at the last loaded time may be missing
+            self.window_end = max(due for _, due, _ in reminders)
 
     def add_reminder(self, user_id, message, time_str, channel_id):
         """
-        Add a new reminder to the list and save it to the data file.
+        Add a new reminder to the store.
 
         Args:
             user_id (str): The ID of the user to be reminded.
@@ -62,49 +105,122 @@ class ReminderManager:
         reminder_time = dt.datetime.strptime(
             time_str.split(".")[0], "%Y-%m-%dT%H:%M:%S"
         )
-        self.reminders.append(
-            {
-                "user_id": user_id,
-                "message": message,
-                "time": reminder_time.isoformat(),
-                "channel_id": channel_id,
-            }
-        )
-        self.save_reminders()
+        reminder = {
+            "user_id": user_id,
+            "message": message,
+            "time": reminder_time.isoformat(),
+            "channel_id": channel_id,
+        }
+        reminder_id = self.store.add(reminder)
+        due = due_time(reminder)
+        if due < self.window_end:
+            heapq.heappush(self.heap, (due, reminder_id, reminder))
+            heapq.heappush(self.upcoming, (due, reminder_id, reminder))
+            self.wakeup.set()
+
+    def prepare_upcoming(self):
+        """
+        Start generating the notification text of reminders due within the lead time.
+        """
+        now = time.time()
+        while self.upcoming and self.upcoming[0][0] - self.lead_time <= now:
+            _, reminder_id, reminder = heapq.heappop(self.upcoming)
+            self.prepared[reminder_id] = asyncio.create_task(
+                self.generate_text(reminder)
+            )
+
+    async def generate_text(self, reminder):
+        """
+        Notification text for a reminder, or None if generation failed.
+        """
+        async with self.generation_semaphore:
+            response = await asyncio.to_thread(
+                chat,
+                REMINDER_TEMPLATE.format(reminder=reminder["message"]),
+                temp_session(),
+                task=REMINDER_TASK,
+            )
+        if response == ERROR_RESPONSE:
+            return None
+        return response.strip()
+
+    def notification_text(self, reminder_id, reminder):
+        """
+        The pre-generated text of a reminder if it is ready, the static text otherwise.
+        """
+        task = self.prepared.pop(reminder_id, None)
+        if task is not None and task.done():
+            if not task.cancelled() and task.exception() is None and task.result():
+                return task.result()
+        elif task is not None:
+            task.cancel()
+            logger.info(f"Reminder {reminder_id} text not ready, sending static text")
+        return REMINDER_FALLBACK_TEMPLATE.format(reminder=reminder["message"])
+
+    def pop_due_reminders(self):
+        """
+        Remove and return the loaded reminders that are due, as (id, reminder).
+        """
+        now = time.time()
+        due_reminders = []
+        while self.heap and self.heap[0][0] <= now:
+            _, reminder_id, reminder = heapq.heappop(self.heap)
+            due_reminders.append((reminder_id, reminder))
+        return due_reminders
+
+    async def run(self, client):
+        """
+        Deliver reminders as they become due until the client is closed.
+
+        Args:
+            client (object): The client used to send reminders
+        """
+        while not client.is_closed():
+            await self.check_reminders(client)
+            if not self.heap or time.time() >= self.window_end:
+                self.load_reminders()
+            self.wakeup.clear()
+            next_time = self.window_end
+            if self.heap:
+                next_time = min(next_time, self.heap[0][0])
+            if self.upcoming:
+                next_time = min(next_time, self.upcoming[0][0] - self.lead_time)
+            timeout = min(MAX_SLEEP, max(0, next_time - time.time()))
+            try:
+                await asyncio.wait_for(self.wakeup.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
 
     async def check_reminders(self, client):
         """
         Check for due reminders and send them to the appropriate channel.
 
-        Updates the reminder list and saves it if required.
+        Starts text generation for upcoming reminders, then sends the due ones
+        concurrently. Each reminder is marked as delivered in the store once it has
+        been sent.
 
         Args:
             client (object): The client used to send reminder
         """
-        now_utc = dt.datetime.now(dt.timezone.utc)
-        due_reminders = [
-            reminder
-            for reminder in self.reminders
-            if dt.datetime.fromisoformat(reminder["time"]).astimezone(dt.timezone.utc)
-            <= now_utc
-        ]
-        self.reminders = [
-            reminder
-            for reminder in self.reminders
-            if dt.datetime.fromisoformat(reminder["time"]).astimezone(dt.timezone.utc)
-            > now_utc
-        ]
-        self.save_reminders()
+        self.prepare_upcoming()
+        await asyncio.gather(
+            *[
+                self.deliver(client, reminder_id, reminder)
+                for reminder_id, reminder in self.pop_due_reminders()
+            ]
+        )
 
-        for reminder in due_reminders:
+    async def deliver(self, client, reminder_id, reminder):
+        """
+        Send a due reminder to its channel.
+        """
+        async with self.delivery_semaphore:
             try:
                 channel = client.get_channel(reminder["channel_id"])
                 ping_msg = PING_TEMPLATE.format(id=reminder["user_id"])
-                response = chat(
-                    REMINDER_TEMPLATE.format(reminder=reminder["message"]),
-                    temp_session(),
-                )
-                embed = discord.Embed(title="Reminder !", description=response.strip())
+                response = self.notification_text(reminder_id, reminder)
+                embed = discord.Embed(title="Reminder !", description=response)
                 await channel.send(ping_msg, embed=embed)
             except Exception as e:
                 logger.exception(f"Reminder Failed {e}")
+            self.store.mark_delivered(reminder_id)
@@ -0,0 +1,192 @@
+"""
+GeminiChad
+Copyright (c) 2024 @notV3NOM
+
+See the README.md file for licensing and disclaimer information.
+"""
+
+import os
+import json
+import time
+import sqlite3
+import threading
+import datetime as dt
+
+from abc import ABC, abstractmethod
+
+from .config import logger
+
+# Delivered reminders are kept this long before they are purged
+DELIVERED_RETENTION = 7 * 24 * 3600
+
+
+def due_time(reminder) -> float:
+    """
+    Due time of a reminder as a UTC epoch. Naive times are local time.
+    """
+    return dt.datetime.fromisoformat(reminder["time"]).timestamp()
+
+
+class ReminderStore(ABC):
+    """
+    Storage backend for reminders.
+
+    Reminders are dicts with `user_id`, `message`, `time` and `channel_id`.
+    Stores return them as (id, due epoch, reminder) tuples.
+    """
+
+    @abstractmethod
+    def add(self, reminder) -> int:
+        """
+        Atomically store a new reminder.
+
+        Returns:
+            int: The reminder id.
+        """
+
+    @abstractmethod
+    def due_before(self, until: float, limit: int) -> list:
+        """
+        Undelivered reminders due before `until`, earliest first.
+        """
+
+    @abstractmethod
+    def mark_delivered(self, reminder_id: int):
+        """
+        Atomically mark a reminder as delivered.
+        """
+
+    @abstractmethod
+    def pending(self) -> int:
+        """
+        Number of undelivered reminders.
+        """
+
+
+class SQLiteReminderStore(ReminderStore):
+    """
+    Reminders in SQLite, indexed on due time.
+
+    Every add and delivery is its own transaction, so a crash never loses stored
+    reminders, and reads only touch the rows in the requested due window.
+    """
+
+    def __init__(self, path, legacy_path=None):
+        """
+        Initialize the store. The database is opened, and reminders are migrated
+        from the legacy JSON file, on first use.
+
+        Args:
+            path (str): Path of the SQLite database.
+            legacy_path (str): Path of the JSON file used by older versions.
+        """
+        self.path = path
+        self.legacy_path = legacy_path
+        self.connection = None
+        self.lock = threading.Lock()
+        self.connect_lock = threading.Lock()
+
+    @property
+    def db(self):
+        """The database connection, opened on first use"""
+        with self.connect_lock:
+            if self.connection is None:
+                self.connection = self.connect()
+        return self.connection
+
+    def connect(self):
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        db = sqlite3.connect(self.path, check_same_thread=False)
+        db.execute("PRAGMA journal_mode=WAL")
+        with db:
+            db.execute(
+                "CREATE TABLE IF NOT EXISTS reminders ("
+                "id INTEGER PRIMARY KEY AUTOINCREMENT, user_id INTEGER, "
+                "message TEXT, time TEXT, channel_id INTEGER, due REAL, "
+                "delivered_at REAL)"
+            )
+            db.execute(
+                "CREATE INDEX IF NOT EXISTS reminders_due ON reminders (due) "
+                "WHERE delivered_at IS NULL"
+            )
+            db.execute(
+                "DELETE FROM reminders WHERE delivered_at < ?",
+                (time.time() - DELIVERED_RETENTION,),
+            )
+        if self.legacy_path and os.path.exists(self.legacy_path):
+            self.migrate(db, self.legacy_path)
+        return db
+
+    def migrate(self, db, legacy_path):
+        """
+        Import reminders from the legacy JSON file in one transaction, then
+        rename the file so the import runs only once.
+        """
+        with open(legacy_path, "r") as file:
+            reminders = json.load(file)
+        with db:
+            db.executemany(
+                "INSERT INTO reminders (user_id, message, time, channel_id, due) "
+                "VALUES (?, ?, ?, ?, ?)",
+                [
+                    (
+                        reminder["user_id"],
+                        reminder["message"],
+                        reminder["time"],
+                        reminder["channel_id"],
+                        due_time(reminder),
+                    )
+                    for reminder in reminders
+                ],
+            )
+        os.replace(legacy_path, legacy_path + ".migrated")
+        logger.info(f"Migrated {len(reminders)} reminders from {legacy_path}")
+
+    def add(self, reminder) -> int:
+        with self.lock, self.db:
+            cursor = self.db.execute(
+                "INSERT INTO reminders (user_id, message, time, channel_id, due) "
+                "VALUES (?, ?, ?, ?, ?)",
+                (
+                    reminder["user_id"],
+                    reminder["message"],
+                    reminder["time"],
+                    reminder["channel_id"],
+                    due_time(reminder),
+                ),
+            )
+        return cursor.lastrowid
+
+    def due_before(self, until: float, limit: int) -> list:
+        with self.lock:
+            rows = self.db.execute(
+                "SELECT id, due, user_id, message, time, channel_id FROM reminders "
+                "WHERE delivered_at IS NULL AND due < ? ORDER BY due LIMIT ?",
+                (until, limit),
+            ).fetchall()
+        return [
+            (
+                reminder_id,
+                due,
+                {
+                    "user_id": user_id,
+                    "message": message,
+                    "time": time_str,
+                    "channel_id": channel_id,
+                },
+            )
+            for reminder_id, due, user_id, message, time_str, channel_id in rows
+        ]
+
+    def mark_delivered(self, reminder_id: int):
+        with self.lock, self.db:
+            self.db.execute(
+                "UPDATE reminders SET delivered_at = ? WHERE id = ?",
+                (time.time(), reminder_id),
+            )
+
+    def pending(self) -> int:
+        with self.lock:
+            return self.db.execute(
+                "SELECT COUNT(*) FROM reminders WHERE delivered_at IS NULL"
+            ).fetchone()[0]
@@ -0,0 +1,209 @@
+"""
+GeminiChad
+Copyright (c) 2024 @notV3NOM
+
+See the README.md file for licensing and disclaimer information.
+"""
+
+import io
+import re
+import discord
+
+from .images import IMAGE_REGISTRY
+from .config import EXTENSION_MAPPING, logger
+
+MESSAGE_LIMIT = 2000
+
+# Code blocks with a language become file artifacts, <IMAGE> tags become images
+TOKEN_PATTERN = re.compile(
+    r"```(?P<language>\S+)\n(?P<code>.*?)\n```|<IMAGE>(?P<image>.*?)</IMAGE>",
+    re.DOTALL,
+)
+FENCE_PATTERN = re.compile(r"\s*```")
+LIST_ITEM_PATTERN = re.compile(r"\s*(?:[-*+]|\d+[.)])\s")
+BLANK_LINES_PATTERN = re.compile(r"\n\s*\n")
+SPACES_PATTERN = re.compile(r" +")
+FENCED_PATTERN = re.compile(r"(```.*?(?:```|$))", re.DOTALL)
+
+
+class Segment:
+    """
+    A piece of a rendered response, in reading order.
+
+    Attributes:
+        text (str): Message text of at most MESSAGE_LIMIT characters, or None.
+        file (discord.File): Code artifact or image, or None.
+        embed (discord.Embed): Embed showing an image, or None.
+        size (int): Bytes of the file.
+    """
+
+    def __init__(self, text=None, file=None, embed=None, size=0):
+        self.text = text
+        self.file = file
+        self.embed = embed
+        self.size = size
+
+
+def has_attachments(llm_response: str) -> bool:
+    """Whether the response contains code artifacts or images"""
+    return TOKEN_PATTERN.search(llm_response) is not None
+
+
+def clean_text(text: str) -> str:
+    """Collapse blank lines, and runs of spaces outside code blocks"""
+    parts = FENCED_PATTERN.split(BLANK_LINES_PATTERN.sub("\n\n", text))
+    return "".join(
+        part if index % 2 else SPACES_PATTERN.sub(" ", part)
+        for index, part in enumerate(parts)
+    )
+
+
+def markdown_blocks(text: str) -> list:
+    """
+    Split text into blocks that must stay in one message: code blocks, list items
+    with their indented continuation lines, and single lines.
+    """
+    blocks = []
+    fence = None
+    in_list_item = False
+    for line in text.split("\n"):
+        if fence is not None:
+            fence.append(line)
+            if FENCE_PATTERN.match(line):
+                blocks.append("\n".join(fence))
+                fence = None
+            continue
+        if FENCE_PATTERN.match(line):
+            fence = [line]
+            in_list_item = False
+        elif LIST_ITEM_PATTERN.match(line):
+            blocks.append(line)
+            in_list_item = True
+        elif in_list_item and line.startswith((" ", "\t")) and line.strip():
+            blocks[-1] += "\n" + line
+        else:
+            blocks.append(line)
+            in_list_item = False
+    if fence is not None:
+        blocks.append("\n".join(fence))
+    return blocks
+
+
+def split_line(line: str, limit: int) -> list:
+    """Split an oversized line at whitespace where possible"""
+    pieces = []
+    while len(line) > limit:
+        index = line.rfind(" ", 0, limit)
+        index = limit if index <= 0 else index
+        pieces.append(line[:index])
+        line = line[index:].lstrip(" ")
+    pieces.append(line)
+    return pieces
+
+
+def split_block(block: str, limit: int) -> list:
+    """
+    Split a block longer than the limit. Code blocks are split between lines, each
+    piece closed and reopened with the original fence.
+    """
+    if len(block) <= limit:
+        return [block]
+    if not FENCE_PATTERN.match(block):
+        return [
+            piece for line in block.split("\n") for piece in split_line(line, limit)
+        ]
+
+    lines = block.split("\n")
+    opening = lines[0].strip()
+    inner = (
+        lines[1:-1] if FENCE_PATTERN.match(lines[-1]) and len(lines) > 1 else lines[1:]
+    )
+    room = limit - len(opening) - len("\n\n```")
+    pieces = []
+    current = []
+    size = 0
+    for line in inner:
+        for part in split_line(line, room):
+            if current and size + len(part) + 1 > room:
+                pieces.append(opening + "\n" + "\n".join(current) + "\n```")
+                current, size = [], 0
+            current.append(part)
+            size += len(part) + 1
+    pieces.append(opening + "\n" + "\n".join(current) + "\n```")
+    return pieces
+
+
+def chunk_text(text: str, limit: int = MESSAGE_LIMIT) -> list:
+    """
+    Split text into messages of at most `limit` characters, only between markdown
+    blocks, so code blocks and list items are never cut.
+    """
+    chunks = []
+    current = ""
+    for block in markdown_blocks(text):
+        for piece in split_block(block, limit):
+            candidate = current + "\n" + piece if current else piece
+            if len(candidate) <= limit:
+                current = candidate
+            else:
+                chunks.append(current)
+                current = piece
+    chunks.append(current)
+    return [chunk for chunk in chunks if chunk.strip()]
+
+
+def artifact_segment(language: str, code: str, number: int) -> Segment:
+    extension = EXTENSION_MAPPING.get(language.lower(), "txt")
+    data = code.strip().encode()
+    file = discord.File(io.BytesIO(data), filename=f"artifact-{number}.{extension}")
+    return Segment(file=file, size=len(data))
+
+
+def image_segment(tag: str) -> Segment | None:
+    handle, _, image_prompt = tag.partition("||")
+    image_data = IMAGE_REGISTRY.get(handle)
+    if image_data is None:
+        logger.warning(f"Unknown image handle {handle}")
+        return None
+    file = discord.File(io.BytesIO(image_data), filename=handle)
+    embed = discord.Embed(title=image_prompt[:256])
+    embed.set_image(url="attachment://" + handle)
+    return Segment(file=file, embed=embed, size=len(image_data))
+
+
+def render_response(llm_response: str) -> list:
+    """
+    Turn an LLM response into message segments in a single pass.
+
+    Code blocks with a language become file artifacts, <IMAGE> tags become image
+    embeds, and the text between them is split into messages at markdown-safe
+    boundaries. Files are built in memory.
+
+    Args:
+        llm_response: text of the LLM response
+
+    Returns:
+        segments: list of Segment in reading order
+    """
+    segments = []
+    artifacts = 0
+
+    def add_text(text):
+        for chunk in chunk_text(clean_text(text).strip()):
+            segments.append(Segment(text=chunk))
+
+    position = 0
+    for match in TOKEN_PATTERN.finditer(llm_response):
+        add_text(llm_response[position : match.start()])
+        position = match.end()
+        if match["image"] is not None:
+            segment = image_segment(match["image"])
+            if segment is not None:
+                segments.append(segment)
+        else:
+            artifacts += 1
+            segments.append(
+                artifact_segment(match["language"], match["code"], artifacts)
+            )
+    add_text(llm_response[position:])
+    return segments
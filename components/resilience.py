@@ -0,0 +1,315 @@
+"""
+GeminiChad
+Copyright (c) 2024 @notV3NOM
+
+See the README.md file for licensing and disclaimer information.
+"""
+
+import time
+import random
+import asyncio
+import aiohttp
+import threading
+import concurrent.futures
+
+from contextlib import contextmanager
+from google.api_core.exceptions import ServerError, TooManyRequests
+
+from .config import (
+    CIRCUIT_FAILURE_THRESHOLD,
+    CIRCUIT_RESET_TIMEOUT,
+    RETRY_BUDGET_RATIO,
+    logger,
+)
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half-open"
+
+RETRY_BASE_DELAY = 0.5
+RETRY_MAX_DELAY = 4
+
+# Errors that mean the dependency is down or overloaded, not that the request was bad
+TRANSIENT_ERRORS = (
+    ServerError,
+    TooManyRequests,
+    TimeoutError,
+    concurrent.futures.TimeoutError,
+    ConnectionError,
+    aiohttp.ClientConnectionError,
+    aiohttp.ServerTimeoutError,
+)
+try:
+    from httpx import TransportError
+
+    TRANSIENT_ERRORS += (TransportError,)
+except ImportError:  # installed with gradio-client
+    pass
+
+
+def error_status(error) -> int | None:
+    """
+    HTTP status of an error, from the Google API, aiohttp and httpx exceptions.
+    """
+    for source in (error, getattr(error, "response", None)):
+        for attribute in ("code", "status", "status_code"):
+            status = getattr(source, attribute, None)
+            if isinstance(status, int):
+                return status
+    return None
+
+
+def is_outage(error) -> bool:
+    """
+    Whether an error counts against a circuit: server errors, rate limiting,
+    timeouts and connection errors. Other errors, like a rejected prompt, are the
+    request's fault and leave the circuit alone.
+    """
+    if isinstance(error, TRANSIENT_ERRORS):
+        return True
+    status = error_status(error)
+    return status is not None and (status >= 500 or status == 429)
+
+
+class CircuitOpenError(Exception):
+    """Raised instead of calling a dependency whose circuit is open"""
+
+    def __init__(self, name, retry_in):
+        super().__init__(f"{name} is unavailable, retrying in {retry_in:.0f}s")
+        self.name = name
+        self.retry_in = retry_in
+
+
+class RetryBudget:
+    """
+    Limits retries to a fraction of recent calls, so retries cannot multiply load
+    during an outage.
+
+    Every call deposits `ratio` tokens, every retry withdraws one.
+    """
+
+    def __init__(self, ratio=RETRY_BUDGET_RATIO, max_tokens=10):
+        self.ratio = ratio
+        self.max_tokens = max_tokens
+        self.tokens = max_tokens
+
+    def deposit(self):
+        self.tokens = min(self.max_tokens, self.tokens + self.ratio)
+
+    def withdraw(self) -> bool:
+        if self.tokens < 1:
+            return False
+        self.tokens -= 1
+        return True
+
+
+class Dependency:
+    """
+    A circuit breaker with budgeted, jittered retries around an outbound dependency.
+
+    The circuit opens after `failure_threshold` consecutive outage failures
+    (errors for which `is_failure` is true); while open, calls fail fast with
+    CircuitOpenError. After `reset_timeout` seconds a single probe call is let
+    through (half-open); its outcome closes or re-opens the circuit.
+
+    Attributes:
+        state (str): closed, open or half-open.
+        failures (int): Consecutive failures.
+        calls (int): Total calls attempted.
+        errors (int): Total failed calls.
+        rejected (int): Calls rejected while the circuit was open.
+        last_error (str): Most recent error.
+    """
+
+    def __init__(
+        self,
+        name,
+        retries=0,
+        retry_on=(Exception,),
+        failure_threshold=CIRCUIT_FAILURE_THRESHOLD,
+        reset_timeout=CIRCUIT_RESET_TIMEOUT,
+        is_failure=is_outage,
+    ):
+        self.name = name
+        self.is_failure = is_failure
+        self.retries = retries
+        self.retry_on = retry_on
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.budget = RetryBudget()
+        self.state = CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self.probing = False
+        self.calls = 0
+        self.errors = 0
+        self.rejected = 0
+        self.last_error = None
+        self.lock = threading.Lock()
+
+    @property
+    def available(self) -> bool:
+        """False while calls would be rejected"""
+        with self.lock:
+            if self.state == OPEN:
+                return time.monotonic() - self.opened_at >= self.reset_timeout
+            return not (self.state == HALF_OPEN and self.probing)
+
+    def acquire(self):
+        """
+        Admit a call or raise CircuitOpenError.
+        """
+        with self.lock:
+            if self.state == OPEN:
+                elapsed = time.monotonic() - self.opened_at
+                if elapsed < self.reset_timeout:
+                    self.rejected += 1
+                    raise CircuitOpenError(self.name, self.reset_timeout - elapsed)
+                self.state = HALF_OPEN
+            if self.state == HALF_OPEN:
+                if self.probing:
+                    self.rejected += 1
+                    raise CircuitOpenError(self.name, 0)
+                self.probing = True
+            self.calls += 1
+            self.budget.deposit()
+
+    def release(self):
+        """Forget an admitted call that was abandoned without an outcome"""
+        with self.lock:
+            self.probing = False
+
+    def record_success(self):
+        with self.lock:
+            self.state = CLOSED
+            self.failures = 0
+            self.probing = False
+
+    def record_error(self, error):
+        """
+        Record a failed call. Errors that are not failures show the dependency
+        answered, and count as a success for the circuit.
+        """
+        if self.is_failure(error):
+            self.record_failure(error)
+        else:
+            self.record_success()
+
+    def record_failure(self, error):
+        with self.lock:
+            self.errors += 1
+            self.failures += 1
+            self.last_error = f"{type(error).__name__}: {error}"
+            self.probing = False
+            if self.state == HALF_OPEN or self.failures >= self.failure_threshold:
+                if self.state != OPEN:
+                    logger.warning(
+                        f"Circuit for {self.name} opened ({self.last_error})"
+                    )
+                self.state = OPEN
+                self.opened_at = time.monotonic()
+
+    def should_retry(self, error, attempt) -> bool:
+        if attempt >= self.retries or not isinstance(error, self.retry_on):
+            return False
+        if not self.is_failure(error):
+            return False
+        with self.lock:
+            return self.state == CLOSED and self.budget.withdraw()
+
+    @staticmethod
+    def backoff(attempt) -> float:
+        """Full jitter exponential backoff"""
+        return random.uniform(0, min(RETRY_MAX_DELAY, RETRY_BASE_DELAY * 2**attempt))
+
+    @contextmanager
+    def attempt(self):
+        """
+        Guard a single call without retries, e.g. a streamed response.
+        """
+        self.acquire()
+        try:
+            yield
+        except Exception as e:
+            self.record_error(e)
+            raise
+        except BaseException:
+            self.release()
+            raise
+        self.record_success()
+
+    def call(self, fn, *args, **kwargs):
+        """
+        Call a blocking function through the breaker, retrying transient errors.
+        """
+        attempt = 0
+        while True:
+            self.acquire()
+            try:
+                result = fn(*args, **kwargs)
+            except Exception as e:
+                self.record_error(e)
+                if not self.should_retry(e, attempt):
+                    raise
+                time.sleep(self.backoff(attempt))
+                attempt += 1
+                continue
+            self.record_success()
+            return result
+
+    async def acall(self, fn, *args, **kwargs):
+        """
+        Await a coroutine function through the breaker, retrying transient errors.
+        """
+        attempt = 0
+        while True:
+            self.acquire()
+            try:
+                result = await fn(*args, **kwargs)
+            except asyncio.CancelledError:
+                self.release()
+                raise
+            except Exception as e:
+                self.record_error(e)
+                if not self.should_retry(e, attempt):
+                    raise
+                await asyncio.sleep(self.backoff(attempt))
+                attempt += 1
+                continue
+            self.record_success()
+            return result
+
+    def health(self) -> str:
+        with self.lock:
+            if self.state == OPEN:
+                retry_in = max(
+                    0, self.reset_timeout - (time.monotonic() - self.opened_at)
+                )
+                return f"down (retry in {retry_in:.0f}s)"
+            if self.state == HALF_OPEN:
+                return "recovering"
+            if self.failures:
+                return f"degraded ({self.failures} failure(s))"
+            return "ok"
+
+
+DEPENDENCIES = {}
+
+
+def dependency(name, **kwargs) -> Dependency:
+    """
+    Get or create the shared Dependency for a name.
+    """
+    if name not in DEPENDENCIES:
+        DEPENDENCIES[name] = Dependency(name, **kwargs)
+    return DEPENDENCIES[name]
+
+
+def health_snapshot() -> str:
+    """
+    One line per dependency with its circuit state and error counts.
+    """
+    return "\n".join(
+        f"{name}: {dep.health()} · {dep.errors}/{dep.calls} errors"
+        for name, dep in DEPENDENCIES.items()
+    )
@@ -0,0 +1,173 @@
+"""
+GeminiChad
+Copyright (c) 2024 @notV3NOM
+
+See the README.md file for licensing and disclaimer information.
+"""
+
+import threading
+
+from .config import (
+    LLM,
+    FAST_LLM,
+    ROUTE_TASKS,
+    ROUTE_FAST_MAX_CHARS,
+    ROUTE_FAST_MAX_CONTEXT,
+    ROUTE_FAST_TOOLS,
+)
+
+FAST = "fast"
+STRONG = "strong"
+AUTO = "auto"
+
+# Tasks routed to a tier
+CHAT_TASK = "chat"
+REMINDER_TASK = "reminder"
+EXPAND_TASK = "expand"
+TIME_TASK = "time"
+WEB_TASK = "web"
+
+
+class ModelRouter:
+    """
+    Picks the model tier of each LLM request and keeps per-tier stats.
+
+    Tasks are routed by ROUTE_TASKS. Tasks routed 'auto' go to the fast tier for
+    short prompts without attachments or code in a short conversation, the strong
+    tier otherwise.
+
+    Attributes:
+        models (dict): tier -> model name.
+        counts (dict): tier -> requests served.
+        latency (dict): tier -> total seconds of the requests served.
+        decisions (dict): (task, tier, reason) -> requests routed.
+    """
+
+    def __init__(
+        self,
+        models: dict,
+        routes: dict,
+        fast_max_chars: int = ROUTE_FAST_MAX_CHARS,
+        fast_max_context: int = ROUTE_FAST_MAX_CONTEXT,
+        fast_tools: bool = ROUTE_FAST_TOOLS,
+    ):
+        """
+        Initialize the ModelRouter.
+
+        Args:
+            models (dict): tier -> model name.
+            routes (dict): task -> tier, or 'auto'.
+            fast_max_chars (int): Longest 'auto' prompt served by the fast tier.
+            fast_max_context (int): Largest 'auto' history, in estimated tokens,
+                served by the fast tier.
+            fast_tools (bool): Whether 'auto' requests with tools may use the fast tier.
+        """
+        self.models = models
+        self.routes = routes
+        self.fast_max_chars = fast_max_chars
+        self.fast_max_context = fast_max_context
+        self.fast_tools = fast_tools
+        self.decisions = {}
+        self.counts = {tier: 0 for tier in models}
+        self.latency = {tier: 0.0 for tier in models}
+        self.lock = threading.Lock()
+
+    def route(
+        self,
+        task: str,
+        prompt: str = "",
+        attachments=(),
+        tools=False,
+        context_tokens: int = 0,
+    ) -> str:
+        """
+        The tier serving a request.
+
+        Args:
+            task: kind of request, one of the *_TASK constants
+            prompt: text of the prompt
+            attachments: files or parts sent with the prompt
+            tools: whether the model can call tools
+            context_tokens: estimated tokens of the conversation history
+
+        Returns:
+            tier: FAST or STRONG
+        """
+        tier, reason = self.decide(task, prompt, attachments, tools, context_tokens)
+        key = (task, tier, reason)
+        with self.lock:
+            self.decisions[key] = self.decisions.get(key, 0) + 1
+        return tier
+
+    def decide(self, task, prompt, attachments, tools, context_tokens) -> tuple:
+        """
+        (tier, reason) of a request
+        """
+        tier = self.routes.get(task, AUTO)
+        if tier in self.models:
+            return tier, "task"
+        if len(prompt) > self.fast_max_chars:
+            return STRONG, "long prompt"
+        if attachments:
+            return STRONG, "attachments"
+        if "```" in prompt:
+            return STRONG, "code"
+        if tools and not self.fast_tools:
+            return STRONG, "tools"
+        if context_tokens > self.fast_max_context:
+            return STRONG, "long context"
+        return FAST, "short"
+
+    def model_name(self, tier: str) -> str:
+        return self.models[tier]
+
+    def record(self, tier: str, seconds: float):
+        with self.lock:
+            self.counts[tier] += 1
+            self.latency[tier] += seconds
+
+    def summary(self) -> str:
+        """
+        Requests and average latency per tier.
+        """
+        lines = []
+        with self.lock:
+            for tier, count in self.counts.items():
+                average = 1000 * self.latency[tier] / count if count else 0
+                lines.append(
+                    f"{tier} ({self.models[tier]}): {count} · {average:.0f} ms avg"
+                )
+        return "\n".join(lines)
+
+    def decision_summary(self) -> str:
+        """
+        Requests per task, tier and reason, most frequent first.
+        """
+        with self.lock:
+            decisions = sorted(self.decisions.items(), key=lambda item: -item[1])
+        if not decisions:
+            return "No requests routed"
+        return "\n".join(
+            f"{task} -> {tier} ({reason}): {count}"
+            for (task, tier, reason), count in decisions
+        )
+
+    def prometheus(self) -> str:
+        """
+        The routing decisions in the Prometheus text exposition format.
+        """
+        metric = "geminichad_routes_total"
+        lines = [
+            f"# HELP {metric} LLM requests per task, tier and routing reason",
+            f"# TYPE {metric} counter",
+        ]
+        with self.lock:
+            decisions = sorted(self.decisions.items())
+        for (task, tier, reason), count in decisions:
+            lines.append(
+                f'{metric}{{task="{task}",tier="{tier}",reason="{reason}"}} {count}'
+            )
+        return "\n".join(lines) + "\n"
+
+
+ROUTER = ModelRouter({FAST: FAST_LLM, STRONG: LLM}, ROUTE_TASKS)
@@ -5,11 +5,28 @@ Copyright (c) 2024 @notV3NOM
 See the README.md file for licensing and disclaimer information.
 """
 
-from collections import defaultdict
+import os
+import json
+import time
+import asyncio
+import sqlite3
+import threading
 
-from .llm import new_session
-from .config import DEFAULT_SYSTEM_MESSAGE
+from collections import OrderedDict
+from google.generativeai import protos
+
+from .llm import new_session, settled_history, history_revision
+from .context import strip_files
+from .channel_queue import CHANNEL_QUEUES
 from .tools import web_search, code_execution, calculator, image_generation, clock
+from .config import (
+    DEFAULT_SYSTEM_MESSAGE,
+    SESSION_DB,
+    SESSION_MAX,
+    SESSION_TTL,
+    SESSION_MEMORY_BUDGET,
+    logger,
+)
 
 TOOLS = "TOOLS"
 CHAT_SESSION = "CHAT_SESSION"
@@ -25,6 +42,8 @@ TOOL_OPTIONS = {
 
 default_tools = [TOOL_OPTIONS[tool] for tool in TOOL_OPTIONS]
 
+TOOLS_BY_NAME = {fn.__name__: fn for fn in TOOL_OPTIONS.values()}
+
 
 def session_default_factory():
     return {
@@ -34,4 +53,356 @@ def session_default_factory():
     }
 
 
-SESSIONS = defaultdict(session_default_factory)
+def content_size(content) -> int:
+    """Approximate in-memory size of a history entry in bytes"""
+    return type(content).pb(content).ByteSize()
+
+
+def serialize_history(history) -> str:
+    """
+    Serialize a chat history to JSON.
+
+    Uploaded file references expire on the Gemini side, so they are dropped.
+    """
+    return json.dumps(
+        [
+            json.loads(protos.Content.to_json(strip_files(content)))
+            for content in history
+        ]
+    )
+
+
+def deserialize_history(history_json: str):
+    return [
+        protos.Content.from_json(json.dumps(data)) for data in json.loads(history_json)
+    ]
+
+
+class SessionStore:
+    """
+    A bounded store of channel sessions with LRU/TTL eviction and a memory budget.
+
+    Sessions are persisted to SQLite when they are evicted or periodically swept,
+    and rehydrated on demand, so memory stays flat no matter how many channels
+    the bot is in and conversations survive a restart. Evicted sessions are
+    queued and written by the sweep in a worker thread, so accessing a session
+    never writes to the database on the event loop.
+
+    Supports the mapping operations used by the rest of the bot:
+    `SESSIONS[channel_id][KEY]` and `channel_id in SESSIONS`.
+
+    Attributes:
+        sessions (OrderedDict): In-memory sessions, least recently used first.
+        last_used (dict): Monotonic time each in-memory session was last accessed.
+        sizes (dict): Estimated size of each in-memory session in bytes.
+        sized (dict): (chat session id, history revision) each size was estimated at.
+        saved (dict): Signature of each session as of its last save.
+        evicted (dict): Evicted sessions waiting to be written by the next sweep.
+        writing (dict): Evicted sessions the sweep is writing.
+        persisted (set): Channels with a row in the database.
+    """
+
+    def __init__(
+        self,
+        path=SESSION_DB,
+        max_sessions=SESSION_MAX,
+        ttl=SESSION_TTL,
+        memory_budget=SESSION_MEMORY_BUDGET,
+    ):
+        """
+        Initialize the SessionStore.
+
+        Args:
+            path (str): Path of the SQLite database for persisted sessions.
+            max_sessions (int): Maximum number of sessions kept in memory.
+            ttl (float): Seconds of inactivity after which a session is evicted.
+            memory_budget (int): Approximate memory budget in bytes.
+        """
+        self.max_sessions = max_sessions
+        self.ttl = ttl
+        self.memory_budget = memory_budget
+        self.sessions = OrderedDict()
+        self.last_used = {}
+        self.sizes = {}
+        self.sized = {}
+        self.saved = {}
+        self.evicted = {}
+        self.writing = {}
+        self.persisted = set()
+        self.lock = threading.Lock()
+        self.path = path
+        self.connection = None
+        self.connect_lock = threading.Lock()
+
+    @property
+    def db(self):
+        """The database connection, opened on first use"""
+        with self.connect_lock:
+            if self.connection is None:
+                os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+                connection = sqlite3.connect(self.path, check_same_thread=False)
+                with connection:
+                    connection.execute(
+                        "CREATE TABLE IF NOT EXISTS sessions ("
+                        "channel_id INTEGER PRIMARY KEY, system_message TEXT, "
+                        "tools TEXT, history TEXT, updated_at REAL)"
+                    )
+                self.persisted = {
+                    row[0]
+                    for row in connection.execute("SELECT channel_id FROM sessions")
+                }
+                self.connection = connection
+        return self.connection
+
+    def __getitem__(self, channel_id):
+        session = self.sessions.get(channel_id)
+        if session is None:
+            session = (
+                self.revive(channel_id)
+                or self.load(channel_id)
+                or session_default_factory()
+            )
+            self.sessions[channel_id] = session
+        else:
+            self.sessions.move_to_end(channel_id)
+        self.last_used[channel_id] = time.monotonic()
+        self.update_size(channel_id, session)
+        # The caller may be about to change the session, it must stay in the store
+        self.evict(keep=channel_id)
+        return session
+
+    def __contains__(self, channel_id):
+        return (
+            channel_id in self.sessions
+            or channel_id in self.evicted
+            or channel_id in self.writing
+            or channel_id in self.db_channels()
+        )
+
+    def __len__(self):
+        return len(self.sessions)
+
+    @staticmethod
+    def estimate_size(session):
+        history = settled_history(session[CHAT_SESSION])
+        return len(session[SYSTEM_MESSAGE]) + sum(map(content_size, history))
+
+    def db_channels(self):
+        """Channels with a persisted session, read from the database once"""
+        self.db  # Opening the database reads the persisted channels
+        return self.persisted
+
+    def update_size(self, channel_id, session):
+        """
+        Re-estimate the size of a session if its history changed since last time.
+        """
+        chat_session = session[CHAT_SESSION]
+        key = (id(chat_session), history_revision(chat_session))
+        if self.sized.get(channel_id) == key:
+            return
+        try:
+            self.sizes[channel_id] = self.estimate_size(session)
+        except Exception as e:
+            logger.exception(f"Sizing session {channel_id} failed {e}")
+            self.sizes.setdefault(channel_id, 0)
+        self.sized[channel_id] = key
+
+    @staticmethod
+    def signature(session):
+        chat_session = session[CHAT_SESSION]
+        return (
+            id(chat_session),
+            history_revision(chat_session),
+            session[SYSTEM_MESSAGE],
+            tuple(fn.__name__ for fn in session[TOOLS]),
+        )
+
+    def revive(self, channel_id):
+        """
+        Take back an evicted session that has not been written yet, or is being
+        written, so it is never read back stale from the database.
+
+        Returns:
+            dict: The session, or None if the channel has no evicted session.
+        """
+        session = self.evicted.pop(channel_id, None)
+        if session is None:
+            session = self.writing.get(channel_id)
+        return session
+
+    def load(self, channel_id):
+        """
+        Rehydrate a persisted session.
+
+        Returns:
+            dict: The session, or None if the channel has no persisted session.
+        """
+        with self.lock:
+            row = self.db.execute(
+                "SELECT system_message, tools, history FROM sessions "
+                "WHERE channel_id = ?",
+                (channel_id,),
+            ).fetchone()
+        if row is None:
+            return None
+
+        system, tool_names, history_json = row
+        try:
+            tools = [
+                TOOLS_BY_NAME[name]
+                for name in json.loads(tool_names)
+                if name in TOOLS_BY_NAME
+            ]
+            history = deserialize_history(history_json)
+        except Exception as e:
+            logger.exception(f"Failed to rehydrate session {channel_id} {e}")
+            return None
+
+        session = {
+            SYSTEM_MESSAGE: system,
+            CHAT_SESSION: new_session(system, history, tools),
+            TOOLS: tools,
+        }
+        self.saved[channel_id] = self.signature(session)
+        return session
+
+    def persist(self, snapshots):
+        """
+        Write session snapshots to the database. Safe to call from a worker thread.
+
+        A snapshot that cannot be serialized is logged and skipped.
+        """
+        rows = []
+        for channel_id, system, tool_names, history in snapshots:
+            try:
+                history_json = serialize_history(history)
+            except Exception as e:
+                logger.exception(f"Serializing session {channel_id} failed {e}")
+                continue
+            rows.append(
+                (channel_id, system, json.dumps(tool_names), history_json, time.time())
+            )
+        with self.lock, self.db:
+            self.db.executemany(
+                "INSERT OR REPLACE INTO sessions "
+                "(channel_id, system_message, tools, history, updated_at) "
+                "VALUES (?, ?, ?, ?, ?)",
+                rows,
+            )
+        self.persisted.update(row[0] for row in rows)
+
+    def is_busy(self, channel_id):
+        depth, _ = CHANNEL_QUEUES.stats(channel_id)
+        return depth > 0
+
+    def remove(self, channel_id):
+        """
+        Drop a session from memory, queueing it to be written by the next sweep if
+        it changed since its last save.
+        """
+        session = self.sessions.pop(channel_id)
+        try:
+            changed = self.saved.get(channel_id) != self.signature(session)
+        except Exception as e:
+            logger.exception(f"Evicting session {channel_id} failed {e}")
+            changed = False
+        if changed:
+            self.evicted[channel_id] = session
+        else:
+            self.saved.pop(channel_id, None)
+        self.last_used.pop(channel_id, None)
+        self.sizes.pop(channel_id, None)
+        self.sized.pop(channel_id, None)
+
+    @staticmethod
+    def snapshot_of(channel_id, session):
+        return (
+            channel_id,
+            session[SYSTEM_MESSAGE],
+            [fn.__name__ for fn in session[TOOLS]],
+            list(settled_history(session[CHAT_SESSION])),
+        )
+
+    def evict(self, keep=None):
+        """
+        Evict least recently used sessions until the store is within its limits.
+
+        Args:
+            keep: Channel whose session is never evicted, e.g. the one being accessed.
+        """
+        total_size = sum(self.sizes.values())
+        for channel_id in list(self.sessions):
+            if (
+                len(self.sessions) <= self.max_sessions
+                and total_size <= self.memory_budget
+            ):
+                break
+            if channel_id == keep or self.is_busy(channel_id):
+                continue
+            total_size -= self.sizes.get(channel_id, 0)
+            self.remove(channel_id)
+
+    async def sweep(self):
+        """
+        Persist changed and evicted sessions, and evict sessions idle for longer
+        than the TTL. The database is written in a worker thread.
+        """
+        now = time.monotonic()
+        snapshots = []
+        for channel_id, session in list(self.sessions.items()):
+            if self.is_busy(channel_id):
+                continue
+            try:
+                if now - self.last_used[channel_id] > self.ttl:
+                    self.remove(channel_id)
+                    continue
+                signature = self.signature(session)
+                if self.saved.get(channel_id) != signature:
+                    snapshots.append(self.snapshot_of(channel_id, session))
+                    self.saved[channel_id] = signature
+                self.update_size(channel_id, session)
+            except Exception as e:
+                logger.exception(f"Sweeping session {channel_id} failed {e}")
+        self.evict()
+
+        self.writing, self.evicted = self.evicted, {}
+        for channel_id, session in self.writing.items():
+            try:
+                snapshots.append(self.snapshot_of(channel_id, session))
+                # A session revived while it is written is clean once written
+                self.saved[channel_id] = self.signature(session)
+            except Exception as e:
+                logger.exception(f"Sweeping session {channel_id} failed {e}")
+
+        try:
+            if snapshots:
+                await asyncio.to_thread(self.persist, snapshots)
+                logger.info(f"Persisted {len(snapshots)} session(s)")
+        finally:
+            for channel_id in self.writing:
+                if channel_id not in self.sessions:
+                    self.saved.pop(channel_id, None)
+            self.writing = {}
+
+    def flush(self):
+        """
+        Persist every changed and evicted session, e.g. before shutdown.
+        """
+        snapshots = []
+        signatures = {}
+        pending = {**self.writing, **self.evicted, **self.sessions}
+        for channel_id, session in pending.items():
+            try:
+                signature = self.signature(session)
+                if self.saved.get(channel_id) != signature:
+                    snapshots.append(self.snapshot_of(channel_id, session))
+                    signatures[channel_id] = signature
+            except Exception as e:
+                logger.exception(f"Flushing session {channel_id} failed {e}")
+        if snapshots:
+            self.persist(snapshots)
+        self.saved.update(signatures)
+        self.evicted.clear()
+
+
+SESSIONS = SessionStore()
@@ -0,0 +1,123 @@
+"""
+GeminiChad
+Copyright (c) 2024 @notV3NOM
+
+See the README.md file for licensing and disclaimer information.
+"""
+
+import os
+import sys
+import time
+import asyncio
+import logging
+import builtins
+import importlib
+import importlib.util
+
+# Read here rather than in config.py, which imports discord: profiling has to
+# start before the first heavy import. Set it in the environment, not in .env
+STARTUP_PROFILE = os.getenv("STARTUP_PROFILE", "false").lower() == "true"
+
+# Imports deferred until first use, loaded in the background once the bot is online
+PREWARM_MODULES = ("dateparser.search", "sympy")
+
+# Number of modules listed in the startup report
+REPORT_SIZE = 20
+
+logger = logging.getLogger("discord")
+
+
+class StartupProfiler:
+    """
+    Measures the import time of each module and the time until the bot is ready.
+
+    Import times are inclusive of the modules imported by a module, as with
+    `python -X importtime`.
+
+    Attributes:
+        start_time (float): perf_counter when the profiler was created.
+        import_times (dict): module -> seconds its first import took.
+        direct (set): Modules imported by bot.py and the components package.
+        ready_time (float): Seconds from start until the bot was ready.
+    """
+
+    def __init__(self):
+        self.start_time = time.perf_counter()
+        self.import_times = {}
+        self.direct = set()
+        self.ready_time = None
+        self.original_import = None
+
+    def install(self):
+        self.original_import = builtins.__import__
+        builtins.__import__ = self.timed_import
+
+    def uninstall(self):
+        if self.original_import is not None:
+            builtins.__import__ = self.original_import
+            self.original_import = None
+
+    def timed_import(self, name, globals=None, locals=None, fromlist=(), level=0):
+        module_name = name
+        if level:
+            package = (globals or {}).get("__package__") or ""
+            module_name = importlib.util.resolve_name("." * level + name, package)
+        if module_name in sys.modules:
+            return self.original_import(name, globals, locals, fromlist, level)
+
+        importer = (globals or {}).get("__name__", "")
+        if importer == "__main__" or importer.startswith("components"):
+            self.direct.add(module_name)
+
+        start_time = time.perf_counter()
+        try:
+            return self.original_import(name, globals, locals, fromlist, level)
+        finally:
+            self.import_times.setdefault(module_name, time.perf_counter() - start_time)
+
+    def mark_ready(self):
+        """
+        Record the time to ready and log the report when profiling.
+        """
+        if self.ready_time is not None:
+            return
+        self.ready_time = time.perf_counter() - self.start_time
+        if self.original_import is not None:
+            self.uninstall()
+            logger.info(self.report())
+
+    def report(self) -> str:
+        """
+        The slowest modules imported by the bot's own code, and the time to ready.
+        """
+        modules = sorted(
+            (
+                (seconds, name)
+                for name, seconds in self.import_times.items()
+                if name in self.direct
+            ),
+            reverse=True,
+        )[:REPORT_SIZE]
+        lines = ["Startup profile (inclusive import times)"]
+        lines += [f"{seconds * 1000:8.1f} ms  {name}" for seconds, name in modules]
+        lines.append(f"Ready after {self.ready_time:.2f}s")
+        return "\n".join(lines)
+
+
+STARTUP = StartupProfiler()
+if STARTUP_PROFILE:
+    STARTUP.install()
+
+
+async def prewarm(modules=PREWARM_MODULES):
+    """
+    Import deferred modules in a worker thread so their first use is fast.
+    """
+    for module in modules:
+        start_time = time.perf_counter()
+        try:
+            await asyncio.to_thread(importlib.import_module, module)
+        except ImportError as e:
+            logger.warning(f"Pre-warming {module} failed {e}")
+            continue
+        logger.info(f"Pre-warmed {module} in {time.perf_counter() - start_time:.2f}s")
@@ -0,0 +1,482 @@
+"""
+GeminiChad
+Copyright (c) 2024 @notV3NOM
+
+See the README.md file for licensing and disclaimer information.
+"""
+
+import re
+import threading
+import datetime as dt
+
+# Paths that can serve a /reminder time lookup, fastest first
+GRAMMAR = "grammar"
+DATEPARSER = "dateparser"
+LLM_PATH = "llm"
+
+NUMBER_WORDS = {
+    "a": 1,
+    "an": 1,
+    "one": 1,
+    "two": 2,
+    "three": 3,
+    "four": 4,
+    "five": 5,
+    "six": 6,
+    "seven": 7,
+    "eight": 8,
+    "nine": 9,
+    "ten": 10,
+    "fifteen": 15,
+    "twenty": 20,
+    "thirty": 30,
+    "forty five": 45,
+}
+
+UNIT_SECONDS = {"s": 1, "m": 60, "h": 3600, "d": 86400, "w": 604800}
+
+WEEKDAYS = (
+    "monday",
+    "tuesday",
+    "wednesday",
+    "thursday",
+    "friday",
+    "saturday",
+    "sunday",
+)
+
+MONTHS = {
+    "january": 1,
+    "february": 2,
+    "march": 3,
+    "april": 4,
+    "may": 5,
+    "june": 6,
+    "july": 7,
+    "august": 8,
+    "september": 9,
+    "october": 10,
+    "november": 11,
+    "december": 12,
+    "jan": 1,
+    "feb": 2,
+    "mar": 3,
+    "apr": 4,
+    "jun": 6,
+    "jul": 7,
+    "aug": 8,
+    "sept": 9,
+    "sep": 9,
+    "oct": 10,
+    "nov": 11,
+    "dec": 12,
+}
+
+# Reminders are set at this hour when only a day is given
+DEFAULT_HOUR = 9
+# dateparser results further ahead than this are not trusted
+DATEPARSER_HORIZON = dt.timedelta(days=366)
+
+UNIT = r"(?:seconds?|secs?|minutes?|mins?|hours?|hrs?|days?|weeks?|s|m|h|d|w)"
+# Digits may be attached to the unit ("2h30m"), words may not ("and" is not "an d")
+# "and a half" may come before or after the unit, "2 and a half hours"
+DURATION = (
+    r"(?:(?P<number>\d+(?:\.\d+)?)\s*|\b(?P<word>half(?:\s+an?)?|"
+    + "|".join(NUMBER_WORDS)
+    + r")\s+)(?P<half>and\s+a\s+half\s+)?"
+    + rf"(?P<unit>{UNIT})(?![a-z])(?P<and_half>\s+and\s+a\s+half\b)?"
+)
+
+DURATION_PATTERN = re.compile(DURATION, re.I)
+RELATIVE_PATTERN = re.compile(
+    r"\b(?:in|after)\s+"
+    + DURATION
+    + r"(?:(?:\s*,\s*|\s+and\s+|\s*)"
+    + re.sub(r"\?P<\w+>", "", DURATION)
+    + ")*",
+    re.I,
+)
+DAY_PATTERN = re.compile(
+    r"\b(?:on\s+)?(?P<day>today|tonight|tomorrow|tmrw|(?:next\s+)?(?:"
+    + "|".join(WEEKDAYS)
+    + r"))\b",
+    re.I,
+)
+CLOCK_PATTERN = re.compile(
+    r"(?P<at>\bat\s+)?\b(?:(?P<named>noon|midnight)|(?P<hour>\d{1,2})"
+    r"(?::(?P<minute>\d{2}))?\s*(?P<meridiem>[ap]\.?m\.?)?)(?!\w)",
+    re.I,
+)
+
+MONTH = r"(?P<month>" + "|".join(MONTHS) + r")\b\.?"
+MONTH_PATTERN = re.compile(rf"\b{MONTH}", re.I)
+ORDINAL = r"(?:st|nd|rd|th)"
+# Calendar dates the grammar reads, in the order they are tried
+DATE_PATTERNS = (
+    re.compile(r"(?:\bon\s+)?\b(?P<year>\d{4})-(?P<month>\d{1,2})-(?P<day>\d{1,2})\b"),
+    re.compile(
+        rf"(?:\bon\s+)?\b{MONTH}\s+(?:the\s+)?(?P<day>\d{{1,2}}){ORDINAL}?\b"
+        r"(?:,?\s+(?P<year>\d{4})\b)?",
+        re.I,
+    ),
+    re.compile(
+        rf"(?:\bon\s+)?\b(?:the\s+)?(?P<day>\d{{1,2}}){ORDINAL}?\s+(?:of\s+)?{MONTH}"
+        r"(?:,?\s+(?P<year>\d{4})\b)?",
+        re.I,
+    ),
+    re.compile(
+        r"(?:\bon\s+)?\b(?P<a>\d{1,2})/(?P<b>\d{1,2})(?:/(?P<year>\d{4}|\d{2}))?\b"
+    ),
+    re.compile(
+        r"(?:\bon\s+)?\b(?P<a>\d{1,2})\.(?P<b>\d{1,2})\.(?P<year>\d{4}|\d{2})\b"
+    ),
+    re.compile(rf"(?:\bon\s+)?\bthe\s+(?P<day>\d{{1,2}}){ORDINAL}\b", re.I),
+)
+# Anything that looks like a date. The grammar leaves messages with a date it did
+# not read to dateparser. "may" only counts when followed by a number.
+DATE_TOKEN_PATTERN = re.compile(
+    r"\b(?:"
+    + "|".join(month for month in MONTHS if month != "may")
+    + r")\b|\bmay\s+\d|\b\d{1,4}[/-]\d{1,2}\b|\b\d{1,2}\.\d{1,2}\.\d{2,4}\b|"
+    + rf"\b\d{{1,2}}{ORDINAL}\b",
+    re.I,
+)
+
+# A dateparser match must contain one of these to be trusted
+TIME_WORDS = re.compile(
+    r"(?:\d+|\b(?:"
+    + "|".join(NUMBER_WORDS)
+    + rf"))\s*{UNIT}\b|\b\d{{1,2}}(?::\d{{2}}|\s*[ap]\.?m\b)|"
+    + r"\b(?:today|tonight|tomorrow|noon|midnight|morning|evening|"
+    + "|".join(WEEKDAYS + tuple(MONTHS))
+    + r")\b|\b\d{1,4}[/.-]\d{1,2}\b",
+    re.I,
+)
+FILLER_PATTERN = re.compile(
+    r"^\s*(?:please\s+)?(?:remind\s+(?:me\s+)?)?(?:to|about|that|of|for)?\s+", re.I
+)
+DEFAULT_TITLE = "Reminder"
+MAX_TITLE_WORDS = 10
+
+
+def parse_duration(text: str) -> dt.timedelta:
+    seconds = 0.0
+    for match in DURATION_PATTERN.finditer(text):
+        word = (match["word"] or "").lower()
+        if word.startswith("half"):
+            value = 0.5
+        elif word:
+            value = NUMBER_WORDS[word]
+        else:
+            value = float(match["number"])
+        if match["half"] or match["and_half"]:
+            value += 0.5
+        seconds += value * UNIT_SECONDS[match["unit"][0].lower()]
+    return dt.timedelta(seconds=seconds)
+
+
+def find_clock(text: str):
+    """
+    First time of day in the text as (match, hour, minute, explicit), or None.
+
+    A bare number only counts as a time when preceded by "at". The time is explicit
+    when it cannot be morning or afternoon: it has am/pm, or is a 24-hour time with
+    a zero-padded hour or an hour over 12.
+    """
+    for match in CLOCK_PATTERN.finditer(text):
+        if match["named"]:
+            hour = 12 if match["named"].lower() == "noon" else 0
+            return match, hour, 0, True
+        if not (match["at"] or match["minute"] or match["meridiem"]):
+            continue
+        hour, minute = int(match["hour"]), int(match["minute"] or 0)
+        if hour > 23 or minute > 59:
+            continue
+        meridiem = (match["meridiem"] or "").lower()
+        if meridiem:
+            if hour > 12:
+                continue
+            hour = hour % 12 + (12 if meridiem.startswith("p") else 0)
+        padded = len(match["hour"]) == 2 and match["hour"].startswith("0")
+        return match, hour, minute, bool(meridiem) or padded or hour > 12
+    return None
+
+
+def resolve_date(match, now: dt.datetime) -> dt.date | None:
+    """
+    The date of a DATE_PATTERNS match, or None if it is not a valid date.
+
+    Dates without a year are the next such date. Numeric dates are month/day
+    ("12/25") unless the first number is over 12 ("25/12"), and ambiguous when both
+    are 12 or less.
+    """
+    groups = match.groupdict()
+    if "a" in groups:
+        a, b = int(groups["a"]), int(groups["b"])
+        if a > 12 >= b:
+            month, day = b, a
+        elif b > 12 >= a:
+            month, day = a, b
+        else:
+            return None
+    else:
+        day = int(groups["day"])
+        month = groups.get("month")
+        if month is None:
+            month = 0
+        elif month.isdigit():
+            month = int(month)
+        else:
+            month = MONTHS[month.lower().rstrip(".")]
+
+    year = groups.get("year")
+    try:
+        if year:
+            year = int(year) + (2000 if len(year) == 2 else 0)
+            return dt.date(year, month, day)
+        if month:
+            date = dt.date(now.year, month, day)
+            if date < now.date():
+                date = date.replace(year=now.year + 1)
+            return date
+    except ValueError:
+        return None
+
+    # "the 1st" is the next 1st of a month
+    year, month = now.year, now.month
+    if day < now.day:
+        month += 1
+    for _ in range(12):
+        year, month = year + (month - 1) // 12, (month - 1) % 12 + 1
+        try:
+            return dt.date(year, month, day)
+        except ValueError:
+            month += 1
+    return None
+
+
+def find_date(text: str, now: dt.datetime):
+    """
+    First calendar date in the text as (match, date), or None.
+    """
+    for pattern in DATE_PATTERNS:
+        for match in pattern.finditer(text):
+            date = resolve_date(match, now)
+            if date is not None:
+                return match, date
+    return None
+
+
+def mask(text: str, spans) -> str:
+    """
+    The text with the spans blanked out, keeping the offsets of the rest.
+    """
+    for start, end in spans:
+        text = text[:start] + " " * (end - start) + text[end:]
+    return text
+
+
+def resolve_day(day: str, now: dt.datetime) -> dt.date:
+    day = day.lower().replace("next ", "")
+    if day in ("today", "tonight"):
+        return now.date()
+    if day in ("tomorrow", "tmrw"):
+        return now.date() + dt.timedelta(days=1)
+    days_ahead = (WEEKDAYS.index(day) - now.weekday()) % 7 or 7
+    return now.date() + dt.timedelta(days=days_ahead)
+
+
+def parse_with_grammar(message: str, now: dt.datetime):
+    """
+    Match the common time expressions: "in 20 minutes", "tomorrow at 9am",
+    "at 17:30", "next friday", "on March 3 at 10am", "in 2 weeks at 9am".
+
+    Messages with a date the grammar cannot read are left to dateparser.
+
+    Returns:
+        (time, spans): the reminder time and the matched spans, or None.
+    """
+    date = find_date(message, now)
+    text = mask(message, [date[0].span()]) if date else message
+    if DATE_TOKEN_PATTERN.search(text):
+        return None
+
+    relative = RELATIVE_PATTERN.search(text)
+    day = DAY_PATTERN.search(text)
+    clock = find_clock(text)
+
+    if relative:
+        if day or date:
+            return None
+        offset = parse_duration(relative.group())
+        if clock is None:
+            return now + offset, [relative.span()]
+        # "in 2 weeks at 9am" is that time of day, whole days from now
+        match, hour, minute, _ = clock
+        if offset.seconds or offset.microseconds or not offset.days:
+            return None
+        reminder_time = dt.datetime.combine(
+            (now + offset).date(), dt.time(hour, minute)
+        )
+        return reminder_time, [relative.span(), match.span()]
+
+    if day and date:
+        return None
+    if day is None and date is None and clock is None:
+        return None
+
+    spans = []
+    if clock:
+        match, hour, minute, explicit = clock
+        spans.append(match.span())
+    else:
+        tonight = day is not None and day["day"].lower() == "tonight"
+        hour, minute, explicit = (20 if tonight else DEFAULT_HOUR), 0, True
+
+    if day:
+        spans.append(day.span())
+        on = resolve_day(day["day"], now)
+        if day["day"].lower() == "tonight" and hour < 12:
+            hour += 12
+        reminder_time = dt.datetime.combine(on, dt.time(hour, minute))
+    elif date:
+        match, on = date
+        spans.append(match.span())
+        reminder_time = dt.datetime.combine(on, dt.time(hour, minute))
+    else:
+        reminder_time = now.replace(hour=hour, minute=minute, second=0, microsecond=0)
+        # "at 5" is the next 5 o'clock, morning or afternoon
+        step = dt.timedelta(hours=12 if not explicit and hour < 12 else 24)
+        while reminder_time <= now:
+            reminder_time += step
+
+    if reminder_time <= now:
+        return None
+    return reminder_time, spans
+
+
+def parse_with_dateparser(message: str, now: dt.datetime):
+    """
+    Find a single unambiguous future date in the message with dateparser.
+
+    Returns:
+        (time, spans): the reminder time and the matched span, or None.
+    """
+    from dateparser.search import search_dates
+
+    matches = search_dates(
+        message,
+        languages=["en"],
+        settings={"PREFER_DATES_FROM": "future", "RELATIVE_BASE": now},
+    )
+    if not matches or len(matches) != 1:
+        return None
+    text, reminder_time = matches[0]
+    if not TIME_WORDS.search(text) or reminder_time.tzinfo:
+        return None
+    # "in March" gets an arbitrary day
+    if MONTH_PATTERN.search(text) and not re.search(r"\d", text):
+        return None
+    start = message.find(text)
+    end = start + len(text)
+    # The match must cover every date in the message
+    for token in DATE_TOKEN_PATTERN.finditer(message):
+        if token.start() < start or token.end() > end:
+            return None
+
+    # and agree with the time of day it states
+    clock = find_clock(text)
+    if clock is None:
+        if reminder_time.time() == dt.time(0):
+            reminder_time = reminder_time.replace(hour=DEFAULT_HOUR)
+    else:
+        _, hour, minute, explicit = clock
+        stated = (reminder_time.hour if explicit else reminder_time.hour % 12, minute)
+        if stated != (hour if explicit else hour % 12, reminder_time.minute):
+            return None
+
+    if not now < reminder_time <= now + DATEPARSER_HORIZON:
+        return None
+    return reminder_time, [(start, end)]
+
+
+def make_title(message: str, spans) -> str:
+    """
+    The message without its time expressions and leading filler words.
+    """
+    for start, end in sorted(spans, reverse=True):
+        message = message[:start] + " " + message[end:]
+    title = FILLER_PATTERN.sub("", " " + message)
+    words = title.strip(" ,.;:!-").split()[:MAX_TITLE_WORDS]
+    if not words:
+        return DEFAULT_TITLE
+    title = " ".join(words)
+    return title[0].upper() + title[1:]
+
+
+def parse_time(text: str) -> dt.datetime | None:
+    """
+    Parse a time expression with dateparser, e.g. the LLM's answer.
+    """
+    import dateparser
+
+    return dateparser.parse(text)
+
+
+def parse_reminder(message: str, now: dt.datetime | None = None):
+    """
+    Extract the time and a title of a reminder locally, without the LLM.
+
+    Args:
+        message: reminder message with a time, e.g. "in 20 minutes check the oven"
+        now: reference time, defaults to the current local time
+
+    Returns:
+        (time, title, path): naive local reminder time, title, and GRAMMAR or
+        DATEPARSER, or None when the time could not be found with confidence.
+    """
+    now = now or dt.datetime.now()
+    for path, parser in (
+        (GRAMMAR, parse_with_grammar),
+        (DATEPARSER, parse_with_dateparser),
+    ):
+        result = parser(message, now)
+        if result is not None:
+            reminder_time, spans = result
+            return reminder_time, make_title(message, spans), path
+    return None
+
+
+class ParserStats:
+    """
+    Requests served and total latency per time parsing path.
+    """
+
+    def __init__(self):
+        self.counts = {GRAMMAR: 0, DATEPARSER: 0, LLM_PATH: 0}
+        self.latency = {GRAMMAR: 0.0, DATEPARSER: 0.0, LLM_PATH: 0.0}
+        self.lock = threading.Lock()
+
+    def record(self, path: str, seconds: float):
+        with self.lock:
+            self.counts[path] += 1
+            self.latency[path] += seconds
+
+    def summary(self) -> str:
+        """
+        Local hit rate and average latency per path.
+        """
+        with self.lock:
+            total = sum(self.counts.values())
+            if not total:
+                return "No requests"
+            local = total - self.counts[LLM_PATH]
+            lines = [f"local {local}/{total} ({100 * local / total:.0f}%)"]
+            for path, count in self.counts.items():
+                if count:
+                    average = 1000 * self.latency[path] / count
+                    lines.append(f"{path}: {count} · {average:.0f} ms avg")
+        return "\n".join(lines)
+
+
+TIME_PARSER_STATS = ParserStats()
@@ -5,17 +5,57 @@ Copyright (c) 2024 @notV3NOM
 See the README.md file for licensing and disclaimer information.
 """
 
-import sympy as sp
+import re
 
 from typing import List
 from datetime import datetime
-from gradio_client import Client
 
-from .config import logger
+from .cache import TTLCache
+from .config import WEB_CACHE_TTL, WEB_CACHE_SIZE, TOOL_TIMEOUT, TOOL_TIMEOUTS, logger
 from .prompts import CALC_TEMPLATE
-from .llm import calc_model, IMAGE_MODELS, IMAGE_GENERATORS
+from .images import IMAGE_REGISTRY
+from .http_client import run_sync
+from .llm import calc_model, time_left, IMAGE_MODELS, GEMINI
+from .resilience import dependency, CircuitOpenError
+from .lazy_client import LazyClient, WarmingUpError
+from .image_scheduler import IMAGE_SCHEDULER, current_user
+
+websearch_client = LazyClient("victor/websearch")
+
+WEBSEARCH = dependency("websearch", retries=1)
+WEBSEARCH_UNAVAILABLE = (
+    "Web search is temporarily unavailable. Answer from your own knowledge and say so."
+)
+WEBSEARCH_WARMING_UP = (
+    "Web search is warming up and will be available shortly. "
+    "Answer from your own knowledge and say so."
+)
+
+
+def normalize_query(query: str) -> str:
+    """Case, whitespace and trailing punctuation do not change search results"""
+    return re.sub(r"\s+", " ", query).strip(" ?!.").lower()
+
+
+WEB_CACHE = TTLCache(WEB_CACHE_TTL, WEB_CACHE_SIZE, normalize=normalize_query)
+
+
+def search(query: str):
+    if websearch_client.warming:
+        raise WarmingUpError(websearch_client.space)
+
+    def predict():
+        # Each attempt gets what is left of the tool's deadline
+        return websearch_client.predict(
+            query=query,
+            search_type="search",
+            num_results=4,
+            api_name="/search_web",
+            timeout=time_left(TOOL_TIMEOUTS.get("web_search", TOOL_TIMEOUT)),
+        )
+
+    return WEBSEARCH.call(predict)
 
-websearch_client = Client("victor/websearch")
 
 def web_search(query: str) -> List[str]:
     """
@@ -33,12 +73,16 @@ def web_search(query: str) -> List[str]:
         A List containing the search results.
     """
     logger.info(f"SEARCH {query}")
-    search_results = websearch_client.predict(
-        query=query,
-        search_type="search",
-        num_results=4,
-        api_name="/search_web"
-    )
+    try:
+        search_results = WEB_CACHE.get_or_compute(query, lambda: search(query))
+    except WarmingUpError:
+        return WEBSEARCH_WARMING_UP
+    except CircuitOpenError as e:
+        logger.warning(e)
+        stale_results = WEB_CACHE.stale(query)
+        if stale_results is None:
+            return WEBSEARCH_UNAVAILABLE
+        return stale_results
     return search_results
 
 
@@ -56,7 +100,9 @@ def code_execution(code: str) -> str:
         result (str): Result of the python code
     """
     logger.info(f"CODE EXECUTION {code}")
-    result = calc_model.generate_content(CALC_TEMPLATE.format(problem=code))
+    result = GEMINI.call(
+        calc_model.generate_content, CALC_TEMPLATE.format(problem=code)
+    )
     return result.text
 
 
@@ -73,6 +119,8 @@ def calculator(expression: str) -> str:
 
     """
     logger.info(f"CALCULATION {expression}")
+    import sympy as sp
+
     try:
         expr = sp.sympify(expression)
         result = expr.evalf()
@@ -84,7 +132,7 @@ def calculator(expression: str) -> str:
 
 def image_generation(prompt: str) -> str:
     """
-    Generate an Image and return the path of the generated image.
+    Generate an Image and return a handle to the generated image.
     Use this tool to draw any kind of image like poster, album art or book covers etc.
     With this tool, you have the capability to generate and display images to the user.
     When you use this tool, it is mandatory to respond by displaying the exact result directly to the user.
@@ -94,13 +142,20 @@ def image_generation(prompt: str) -> str:
         prompt: image prompt
 
     Returns:
-        image_path: path of the generated image enclosed in image tags
+        image_handle: handle of the generated image enclosed in image tags
 
     """
     logger.info(f"IMAGE GENERATION {prompt}")
     return (
         "<IMAGE>"
-        + IMAGE_GENERATORS[IMAGE_MODELS.SCHNELL](prompt)
+        + IMAGE_REGISTRY.register(
+            run_sync(
+                IMAGE_SCHEDULER.generate(
+                    IMAGE_MODELS.AUTO, prompt, user_id=current_user.get()
+                ),
+                timeout=time_left(TOOL_TIMEOUTS.get("image_generation", TOOL_TIMEOUT)),
+            )
+        )
         + "||"
         + prompt
         + "</IMAGE>"
@@ -0,0 +1,171 @@
+"""
+GeminiChad
+Copyright (c) 2024 @notV3NOM
+
+See the README.md file for licensing and disclaimer information.
+"""
+
+import json
+import time
+import asyncio
+import threading
+import contextvars
+
+from collections import deque
+from contextlib import contextmanager
+
+from .config import TRACE_WINDOW, TRACE_BUFFER
+
+QUANTILES = (0.5, 0.95, 0.99)
+
+# Id of the Discord message whose reply is being produced, shared by its spans
+current_trace = contextvars.ContextVar("current_trace", default=None)
+
+
+def percentile(values, q):
+    """Nearest-rank percentile of a non-empty collection, q in [0, 1]"""
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+class Histogram:
+    """
+    Rolling latency samples of one span name.
+
+    Attributes:
+        samples (deque): Most recent durations in seconds.
+        count (int): Spans recorded since startup.
+        total (float): Seconds of all spans recorded since startup.
+    """
+
+    def __init__(self, window: int):
+        self.samples = deque(maxlen=window)
+        self.count = 0
+        self.total = 0.0
+
+    def observe(self, seconds: float):
+        self.samples.append(seconds)
+        self.count += 1
+        self.total += seconds
+
+    def quantiles(self) -> list:
+        return [percentile(self.samples, q) for q in QUANTILES]
+
+
+class Tracer:
+    """
+    Times the stages of a reply with spans and keeps latency percentiles per stage.
+
+    Spans are cheap context managers, usable in coroutines and worker threads.
+    Each span feeds the rolling histogram of its name and is kept in a bounded
+    buffer of recent spans for export.
+
+    Attributes:
+        histograms (dict): span name -> Histogram.
+        spans (deque): Recent finished spans as dicts, oldest first.
+    """
+
+    def __init__(self, window: int = TRACE_WINDOW, buffer: int = TRACE_BUFFER):
+        """
+        Initialize the Tracer.
+
+        Args:
+            window (int): Samples kept per span name for percentiles.
+            buffer (int): Finished spans kept for the JSONL export.
+        """
+        self.window = window
+        self.histograms = {}
+        self.spans = deque(maxlen=buffer)
+        self.lock = threading.Lock()
+
+    @contextmanager
+    def span(self, name: str, **attributes):
+        """
+        Time the enclosed block as a span.
+
+        Args:
+            name: stage name, like 'gemini.send_message' or 'tool.web_search'
+            **attributes: extra fields of the exported span
+        """
+        start = time.perf_counter()
+        status = "ok"
+        try:
+            yield
+        except asyncio.CancelledError:
+            status = "cancelled"
+            raise
+        except BaseException:
+            status = "error"
+            raise
+        finally:
+            self.observe(name, time.perf_counter() - start, status, **attributes)
+
+    def observe(self, name: str, seconds: float, status: str = "ok", **attributes):
+        """
+        Record a span that ended now and took `seconds`.
+        """
+        span = {
+            "trace": current_trace.get(),
+            "span": name,
+            "start": round(time.time() - seconds, 3),
+            "duration_ms": round(seconds * 1000, 2),
+            "status": status,
+            **attributes,
+        }
+        with self.lock:
+            histogram = self.histograms.get(name)
+            if histogram is None:
+                histogram = self.histograms[name] = Histogram(self.window)
+            histogram.observe(seconds)
+            self.spans.append(span)
+
+    def snapshot(self) -> list:
+        """
+        (name, count, total seconds, quantiles) per span name, sorted by name.
+        """
+        with self.lock:
+            return [
+                (name, histogram.count, histogram.total, histogram.quantiles())
+                for name, histogram in sorted(self.histograms.items())
+            ]
+
+    def summary(self) -> str:
+        """
+        A table of the p50/p95/p99 latency of each stage in milliseconds.
+        """
+        rows = self.snapshot()
+        if not rows:
+            return "No spans recorded"
+        width = max(len(name) for name, *_ in rows)
+        lines = [f"{'stage':<{width}} {'count':>6} {'p50':>8} {'p95':>8} {'p99':>8}"]
+        for name, count, _, quantiles in rows:
+            values = " ".join(f"{1000 * value:>8.0f}" for value in quantiles)
+            lines.append(f"{name:<{width}} {count:>6} {values}")
+        return "\n".join(lines)
+
+    def prometheus(self) -> str:
+        """
+        The histograms in the Prometheus text exposition format, as summaries.
+        """
+        metric = "geminichad_span_seconds"
+        lines = [
+            f"# HELP {metric} Latency of the stages of a reply",
+            f"# TYPE {metric} summary",
+        ]
+        for name, count, total, quantiles in self.snapshot():
+            for q, value in zip(QUANTILES, quantiles):
+                lines.append(f'{metric}{{span="{name}",quantile="{q}"}} {value:.6f}')
+            lines.append(f'{metric}_sum{{span="{name}"}} {total:.6f}')
+            lines.append(f'{metric}_count{{span="{name}"}} {count}')
+        return "\n".join(lines) + "\n"
+
+    def jsonl(self) -> str:
+        """
+        Recent spans, one JSON object per line.
+        """
+        with self.lock:
+            spans = list(self.spans)
+        return "".join(json.dumps(span) + "\n" for span in spans)
+
+
+TRACER = Tracer()
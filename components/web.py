@@ -0,0 +1,196 @@
+"""
+GeminiChad
+Copyright (c) 2024 @notV3NOM
+
+See the README.md file for licensing and disclaimer information.
+"""
+
+import re
+import socket
+import asyncio
+import ipaddress
+
+from urllib.parse import urljoin, urlsplit
+from html.parser import HTMLParser
+
+from .tools import web_search
+from .llm import ERROR_RESPONSE, chat, temp_session
+from .router import WEB_TASK
+from .http_client import get_http_session, backend_timeout
+from .prompts import PROMPT_TEMPLATE, SUMMARIZE_TEMPLATE
+from .config import (
+    WEB_FETCH_PAGES,
+    WEB_PAGE_TIMEOUT,
+    WEB_PIPELINE_TIMEOUT,
+    WEB_PAGE_MAX_BYTES,
+    WEB_PAGE_MAX_CHARS,
+    logger,
+)
+
+URL_PATTERN = re.compile(r"https?://[^\s<>\"'()\[\]]+")
+
+REDIRECT_STATUSES = {301, 302, 303, 307, 308}
+MAX_REDIRECTS = 5
+READ_CHUNK = 64 * 1024
+
+# Elements whose text is not page content
+SKIPPED_TAGS = {"script", "style", "noscript", "svg", "nav", "header", "footer", "form"}
+
+
+class TextExtractor(HTMLParser):
+    """Collects the visible text of an HTML page"""
+
+    def __init__(self):
+        super().__init__()
+        self.parts = []
+        self.skipping = 0
+
+    def handle_starttag(self, tag, attrs):
+        if tag in SKIPPED_TAGS:
+            self.skipping += 1
+
+    def handle_endtag(self, tag):
+        if tag in SKIPPED_TAGS and self.skipping:
+            self.skipping -= 1
+
+    def handle_data(self, data):
+        if not self.skipping and data.strip():
+            self.parts.append(data.strip())
+
+
+def extract_text(html: str) -> str:
+    extractor = TextExtractor()
+    extractor.feed(html)
+    return " ".join(extractor.parts)[:WEB_PAGE_MAX_CHARS]
+
+
+def result_urls(search_results, limit: int) -> list:
+    """First distinct URLs in the search results"""
+    urls = []
+    for url in URL_PATTERN.findall(str(search_results)):
+        url = url.rstrip(".,;")
+        if url not in urls:
+            urls.append(url)
+    return urls[:limit]
+
+
+async def check_url(url: str):
+    """
+    Raise ValueError unless the URL is http(s) on a public address, so search
+    results cannot point the bot at its own host or network.
+    """
+    parts = urlsplit(url)
+    if parts.scheme not in ("http", "https") or not parts.hostname:
+        raise ValueError(f"Unsupported URL {url}")
+    try:
+        addresses = [ipaddress.ip_address(parts.hostname)]
+    except ValueError:
+        infos = await asyncio.get_running_loop().getaddrinfo(
+            parts.hostname, parts.port or parts.scheme, type=socket.SOCK_STREAM
+        )
+        addresses = [ipaddress.ip_address(info[4][0]) for info in infos]
+    for address in addresses:
+        if not address.is_global:
+            raise ValueError(f"Non-public address {address} for {url}")
+
+
+async def read_body(content, limit: int) -> bytes:
+    """
+    Read a response body up to `limit` bytes, or to its end.
+    """
+    body = bytearray()
+    async for chunk in content.iter_chunked(READ_CHUNK):
+        body += chunk
+        if len(body) >= limit:
+            break
+    return bytes(body[:limit])
+
+
+async def fetch_page(url: str) -> str:
+    """
+    Download a page within WEB_PAGE_TIMEOUT and return its text.
+
+    Redirects are followed by hand, so every hop is checked with check_url.
+    """
+    for _ in range(MAX_REDIRECTS + 1):
+        await check_url(url)
+        async with get_http_session().get(
+            url, timeout=backend_timeout(WEB_PAGE_TIMEOUT), allow_redirects=False
+        ) as response:
+            location = response.headers.get("Location")
+            if response.status in REDIRECT_STATUSES and location:
+                url = urljoin(str(response.url), location)
+                continue
+            response.raise_for_status()
+            if "html" not in response.headers.get("Content-Type", "html"):
+                raise ValueError(f"Unsupported content {response.content_type}")
+            body = await read_body(response.content, WEB_PAGE_MAX_BYTES)
+            charset = response.charset
+        html = body.decode(charset or "utf-8", errors="replace")
+        return await asyncio.to_thread(extract_text, html)
+    raise ValueError(f"Too many redirects for {url}")
+
+
+async def summarize_page(question: str, url: str) -> str | None:
+    """
+    Fetch a page and summarize it with respect to the question.
+
+    Returns:
+        summary: the page summary, or None if the page could not be used
+    """
+    try:
+        text = await fetch_page(url)
+    except Exception as e:
+        logger.info(f"Skipping page {url} {type(e).__name__}: {e}")
+        return None
+    if not text:
+        return None
+    summary = await asyncio.to_thread(
+        chat,
+        SUMMARIZE_TEMPLATE.format(context=text, question=question),
+        temp_session(),
+        task=WEB_TASK,
+    )
+    if summary == ERROR_RESPONSE:
+        return None
+    return f"Source: {url}\n{summary.strip()}"
+
+
+async def answer_question(question: str) -> str:
+    """
+    Answer a question from the web without blocking the event loop.
+
+    Searches, fetches the top result pages concurrently, summarizes each page in
+    parallel and answers over the summaries. Pages not summarized within
+    WEB_PIPELINE_TIMEOUT are dropped; without any summary, the answer is based on
+    the raw search results.
+
+    Args:
+        question: the question to be answered
+
+    Returns:
+        answer: text of the answer
+    """
+    search_results = await asyncio.to_thread(web_search, question)
+
+    tasks = [
+        asyncio.create_task(summarize_page(question, url))
+        for url in result_urls(search_results, WEB_FETCH_PAGES)
+    ]
+    summaries = []
+    if tasks:
+        done, pending = await asyncio.wait(tasks, timeout=WEB_PIPELINE_TIMEOUT)
+        for task in pending:
+            task.cancel()
+        if pending:
+            logger.info(f"Dropped {len(pending)} slow page(s) for /web")
+        # Keep the search ranking order
+        summaries = [task.result() for task in tasks if task in done and task.result()]
+
+    context = "\n\n".join(summaries) if summaries else search_results
+    return await asyncio.to_thread(
+        chat,
+        PROMPT_TEMPLATE.format(context=context, question=question),
+        temp_session(),
+        task=WEB_TASK,
+    )
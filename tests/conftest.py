@@ -0,0 +1,22 @@
+"""
+GeminiChad
+Copyright (c) 2024 @notV3NOM
+
+See the README.md file for licensing and disclaimer information.
+"""
+
+import os
+import sys
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+# The bot reads static/ and data/ relative to the repository root
+os.chdir(ROOT)
+
+# config.py reads these at import time
+os.environ.setdefault("SERVER_ID", "0")
+os.environ.setdefault("LLM", "gemini-1.5-flash")
+os.environ.setdefault("GOOGLE_API_KEY", "test")
+os.environ.setdefault("SESSION_DB", os.path.join(tempfile.mkdtemp(), "sessions.db"))
+os.environ.setdefault("REMINDER_DB", os.path.join(tempfile.mkdtemp(), "reminders.db"))
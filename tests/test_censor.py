@@ -0,0 +1,44 @@
+"""
+GeminiChad
+Copyright (c) 2024 @notV3NOM
+
+See the README.md file for licensing and disclaimer information.
+"""
+
+import pytest
+
+from components.censor import CensorMatcher
+
+MATCHER = CensorMatcher(["darn", "heck off", "blast"])
+
+
+@pytest.mark.parametrize(
+    "text",
+    [
+        "darn",
+        "well DARN it",
+        "darn, that hurts",
+        "oh heck off",
+        "heck   --  off now",
+        "d@rn",
+        "bl4$7 it",
+    ],
+)
+def test_censored_words_are_found(text):
+    assert MATCHER.contains(text)
+
+
+@pytest.mark.parametrize(
+    "text",
+    [
+        "",
+        "hello there",
+        # Whole words only
+        "darned socks",
+        "blaster",
+        "heck",
+        "off the heck",
+    ],
+)
+def test_other_text_passes(text):
+    assert not MATCHER.contains(text)
@@ -0,0 +1,55 @@
+"""
+GeminiChad
+Copyright (c) 2024 @notV3NOM
+
+See the README.md file for licensing and disclaimer information.
+"""
+
+import datetime as dt
+import google.generativeai as genai
+
+from types import SimpleNamespace
+from google.generativeai import protos
+
+from components import context
+from components.attachments import UploadCache
+from components.context import compact_history
+
+
+def file_message(uri):
+    return protos.Content(
+        role="user",
+        parts=[
+            protos.Part(text="look"),
+            protos.Part(file_data=protos.FileData(mime_type="image/png", file_uri=uri)),
+        ],
+    )
+
+
+def reply(text):
+    return protos.Content(role="model", parts=[protos.Part(text=text)])
+
+
+def test_expired_files_are_stripped_within_budget(monkeypatch):
+    cache = UploadCache()
+    now = dt.datetime.now(dt.timezone.utc)
+    cache.put("old", SimpleNamespace(uri="files/old", expiration_time=now))
+    cache.put(
+        "new",
+        SimpleNamespace(uri="files/new", expiration_time=now + dt.timedelta(hours=48)),
+    )
+    monkeypatch.setattr(context, "UPLOAD_CACHE", cache)
+
+    chat_session = genai.ChatSession(genai.GenerativeModel("models/fake"))
+    chat_session.history = [
+        file_message("files/old"),
+        reply("a cat"),
+        file_message("files/new"),
+        reply("a dog"),
+    ]
+
+    assert compact_history(chat_session, budget=10**6)
+    history = chat_session.history
+    assert [len(content.parts) for content in history] == [1, 1, 2, 1]
+    assert history[2].parts[1].file_data.file_uri == "files/new"
+    assert not compact_history(chat_session, budget=10**6)
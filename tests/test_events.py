@@ -0,0 +1,112 @@
+"""
+GeminiChad
+Copyright (c) 2024 @notV3NOM
+
+See the README.md file for licensing and disclaimer information.
+"""
+
+import time
+import asyncio
+
+import pytest
+
+from components import events
+from components.render import MESSAGE_LIMIT
+
+
+class FakeMessage:
+    def __init__(self, channel, content):
+        self.channel = channel
+        self.content = content
+        self.deleted = False
+
+    async def edit(self, content):
+        self.content = content
+
+    async def delete(self):
+        self.deleted = True
+
+
+class FakeChannel:
+    def __init__(self, fail_after=None):
+        self.messages = []
+        self.fail_after = fail_after
+
+    async def send(self, content=None, **kwargs):
+        if self.fail_after is not None and len(self.messages) >= self.fail_after:
+            raise ConnectionError("discord is down")
+        message = FakeMessage(self, content)
+        self.messages.append(message)
+        return message
+
+
+class FakeRequest:
+    def __init__(self, fail_after=None):
+        self.channel = FakeChannel(fail_after)
+        self.guild = None
+
+
+def test_streamed_code_blocks_are_not_cut(monkeypatch):
+    code = "```\n" + "\n".join(f"line {i}" for i in range(400)) + "\n```"
+    response = "Here you go:\n" + code + "\nDone."
+    # Plain code blocks stay in the message instead of becoming artifacts
+    deltas = [response[i : i + 97] for i in range(0, len(response), 97)]
+    monkeypatch.setattr(events, "chat_stream", lambda *args: (d for d in deltas))
+    monkeypatch.setattr(events, "STREAM_EDIT_TOKENS", 10)
+
+    request = FakeRequest()
+    asyncio.run(events.stream_message(request, "prompt", None, []))
+
+    shown = [m.content for m in request.channel.messages if not m.deleted]
+    assert len(shown) > 1
+    for content in shown:
+        assert len(content) <= MESSAGE_LIMIT
+        # Every message opens and closes its code fences
+        assert content.count("```") % 2 == 0
+    assert shown[-1].endswith("Done.")
+
+
+def test_failed_stream_keeps_the_partial_text_with_a_note(monkeypatch):
+    def failing_stream(*args):
+        yield "Partial answer"
+        raise events.StreamError(events.ERROR_RESPONSE)
+
+    monkeypatch.setattr(events, "chat_stream", failing_stream)
+    request = FakeRequest()
+    asyncio.run(events.stream_message(request, "prompt", None, []))
+
+    [shown] = [m.content for m in request.channel.messages if not m.deleted]
+    assert shown == "Partial answer\n\n" + events.INTERRUPTED_NOTE
+
+
+def test_failed_stream_without_text_shows_the_error(monkeypatch):
+    def failing_stream(*args):
+        raise events.StreamError(events.ERROR_RESPONSE)
+        yield
+
+    monkeypatch.setattr(events, "chat_stream", failing_stream)
+    request = FakeRequest()
+    asyncio.run(events.stream_message(request, "prompt", None, []))
+
+    assert [m.content for m in request.channel.messages] == [events.ERROR_RESPONSE]
+
+
+def test_discord_errors_stop_and_await_the_producer(monkeypatch):
+    closed = []
+
+    def endless_stream(*args):
+        try:
+            while True:
+                time.sleep(0.001)
+                yield "x" * 50
+        finally:
+            closed.append(True)
+
+    monkeypatch.setattr(events, "chat_stream", endless_stream)
+    monkeypatch.setattr(events, "STREAM_EDIT_TOKENS", 10)
+    request = FakeRequest(fail_after=1)
+
+    with pytest.raises(ConnectionError):
+        asyncio.run(events.stream_message(request, "prompt", None, []))
+    # The stream was closed, rolling back the turn, before stream_message returned
+    assert closed == [True]
@@ -0,0 +1,100 @@
+"""
+GeminiChad
+Copyright (c) 2024 @notV3NOM
+
+See the README.md file for licensing and disclaimer information.
+"""
+
+import asyncio
+
+from components import image_scheduler
+from components.image_scheduler import BackendQueue, ImageScheduler, TOOL
+from components.llm import IMAGE_MODELS
+
+MODEL = IMAGE_MODELS.SDXL
+
+
+def test_positions_follow_the_queue(monkeypatch):
+    release = None
+
+    async def generate_image(model, prompt):
+        await release.wait()
+        return prompt.encode()
+
+    monkeypatch.setattr(image_scheduler, "generate_image", generate_image)
+
+    async def scenario():
+        nonlocal release
+        release = asyncio.Event()
+        backend = BackendQueue(MODEL, concurrency=1, rate_per_minute=60)
+        running = backend.submit("a", 1, TOOL)
+        first = backend.submit("b", 1, TOOL)
+        second = backend.submit("c", 2, TOOL)
+        # User 2's first job goes ahead of user 1's second job
+        assert [backend.position(job) for job in (running, first, second)] == [0, 2, 1]
+
+        changes = backend.changes
+        release.set()
+        assert await running.future == b"a"
+        release.clear()
+        assert backend.changes > changes
+        assert backend.position(second) == 0
+        assert backend.position(first) == 1
+
+    asyncio.run(scenario())
+
+
+def test_position_callback(monkeypatch):
+    async def generate_image(model, prompt):
+        await asyncio.sleep(0.01)
+        return prompt.encode()
+
+    monkeypatch.setattr(image_scheduler, "generate_image", generate_image)
+
+    async def scenario():
+        scheduler = ImageScheduler(
+            concurrency={MODEL.value: 1}, rate_limit={MODEL.value: 60}
+        )
+        positions = []
+
+        async def on_position(position):
+            positions.append(position)
+
+        results = await asyncio.gather(
+            scheduler.generate(MODEL, "a"),
+            scheduler.generate(MODEL, "b", on_position=on_position),
+        )
+        assert results == [b"a", b"b"]
+        assert positions == [1]
+
+    asyncio.run(scenario())
+
+
+def test_cancelled_job_releases_its_slot(monkeypatch):
+    stopped = []
+
+    async def generate_image(model, prompt):
+        try:
+            await asyncio.sleep(5 if prompt == "slow" else 0)
+        except asyncio.CancelledError:
+            stopped.append(prompt)
+            raise
+        return prompt.encode()
+
+    monkeypatch.setattr(image_scheduler, "generate_image", generate_image)
+
+    async def scenario():
+        scheduler = ImageScheduler(
+            concurrency={MODEL.value: 1}, rate_limit={MODEL.value: 60}
+        )
+        backend = scheduler.backends[MODEL]
+        slow = asyncio.create_task(scheduler.generate(MODEL, "slow"))
+        await asyncio.sleep(0)
+        assert backend.running == 1
+
+        slow.cancel()
+        assert await asyncio.wait_for(scheduler.generate(MODEL, "fast"), 1) == b"fast"
+        assert stopped == ["slow"]
+        assert backend.running == 0
+
+    asyncio.run(scenario())
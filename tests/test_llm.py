@@ -0,0 +1,157 @@
+"""
+GeminiChad
+Copyright (c) 2024 @notV3NOM
+
+See the README.md file for licensing and disclaimer information.
+"""
+
+import asyncio
+import pytest
+import threading
+import concurrent.futures
+import google.generativeai as genai
+
+from google.generativeai import protos
+from google.generativeai.types import generation_types
+
+from components import llm
+from components.http_client import bind_loop, run_sync
+from components.llm import (
+    StreamError,
+    chat,
+    chat_stream,
+    run_function_calls,
+    settled_history,
+    time_left,
+)
+
+STOP = protos.Candidate.FinishReason.STOP
+
+
+def chunk(text, finish_reason=0):
+    content = protos.Content(role="model", parts=[protos.Part(text=text)])
+    candidate = protos.Candidate(content=content, finish_reason=finish_reason)
+    return protos.GenerateContentResponse(candidates=[candidate])
+
+
+class FakeModel:
+    """A model whose streamed responses break after the first chunk when broken"""
+
+    _tools = None
+    model_name = "models/fake"
+
+    def __init__(self, broken):
+        self.broken = broken
+        self.session = None
+        self.midstream_history = None
+
+    def _get_tools_lib(self, tools):
+        return None
+
+    def generate_content(self, contents, stream=False, **kwargs):
+        if self.broken:
+
+            def chunks():
+                yield chunk("partial ")
+                if self.session is not None:
+                    # Another coroutine reading the history mid-stream
+                    self.midstream_history = settled_history(self.session)
+                raise ConnectionError("connection reset")
+
+            return generation_types.GenerateContentResponse.from_iterator(chunks())
+        if stream:
+            chunks = iter([chunk("hello "), chunk("world", STOP)])
+            return generation_types.GenerateContentResponse.from_iterator(chunks)
+        return generation_types.GenerateContentResponse.from_response(
+            chunk("hello world", STOP)
+        )
+
+
+def session(model):
+    model.session = genai.ChatSession(model)
+    return model.session
+
+
+def test_broken_stream_rolls_back_the_turn():
+    model = FakeModel(broken=True)
+    chat_session = session(model)
+
+    deltas = []
+    with pytest.raises(StreamError):
+        for delta in chat_stream("hi", chat_session):
+            deltas.append(delta)
+    assert deltas == ["partial "]
+    assert model.midstream_history == []
+    assert chat_session.history == []
+
+    model.broken = False
+    assert list(chat_stream("hi", chat_session)) == ["hello ", "world"]
+    assert len(chat_session.history) == 2
+    assert chat("again", chat_session) == "hello world"
+    assert len(chat_session.history) == 4
+
+
+def test_settled_history_drops_a_broken_turn():
+    model = FakeModel(broken=True)
+    chat_session = genai.ChatSession(model)
+    response = chat_session.send_message("hi", stream=True)
+    try:
+        for _ in response:
+            pass
+    except ConnectionError:
+        pass
+
+    assert settled_history(chat_session) == []
+    assert chat_session.history == []
+
+
+def test_tools_see_their_own_deadline(monkeypatch):
+    monkeypatch.setattr(llm, "TOOL_TIMEOUTS", {"fast": 5, "slow": 0.1})
+    release = threading.Event()
+    seen = {}
+
+    def tools(fc):
+        seen[fc.name] = time_left(None)
+        if fc.name == "slow":
+            release.wait(5)
+        return protos.Part(
+            function_response=protos.FunctionResponse(name=fc.name, response={})
+        )
+
+    model = FakeModel(broken=False)
+    model._tools = tools
+    calls = [protos.FunctionCall(name="fast"), protos.FunctionCall(name="slow")]
+    try:
+        parts = run_function_calls(genai.ChatSession(model), calls)
+    finally:
+        release.set()
+
+    assert 4 < seen["fast"] <= 5
+    assert 0 < seen["slow"] <= 0.1
+    assert parts[1].function_response.response["error"] == "Timed out"
+    assert time_left(7) == 7
+
+
+def test_run_sync_cancels_the_coroutine_on_timeout():
+    loop = asyncio.new_event_loop()
+    thread = threading.Thread(target=loop.run_forever, daemon=True)
+    thread.start()
+    bind_loop(loop)
+    cancelled = threading.Event()
+
+    async def slow():
+        try:
+            await asyncio.sleep(5)
+        except asyncio.CancelledError:
+            cancelled.set()
+            raise
+
+    try:
+        with pytest.raises(concurrent.futures.TimeoutError):
+            run_sync(slow(), timeout=0.05)
+        assert cancelled.wait(1)
+    finally:
+        bind_loop(None)
+        loop.call_soon_threadsafe(loop.stop)
+        thread.join()
+        loop.close()
@@ -0,0 +1,53 @@
+"""
+GeminiChad
+Copyright (c) 2024 @notV3NOM
+
+See the README.md file for licensing and disclaimer information.
+"""
+
+from components.render import Segment, MESSAGE_LIMIT
+from components.message_planner import MAX_FILES, plan_messages
+
+
+def text(value):
+    return Segment(text=value)
+
+
+def artifact(size=10):
+    return Segment(file=object(), size=size)
+
+
+def image(size=10):
+    return Segment(file=object(), embed=object(), size=size)
+
+
+def test_text_and_following_attachments_share_a_message():
+    plan = plan_messages([text("intro"), artifact(), image(), image()])
+    assert len(plan) == 1
+    assert plan[0].content == "intro"
+    assert len(plan[0].files) == 3
+    assert len(plan[0].embeds) == 2
+
+
+def test_reading_order_is_kept():
+    # Text after a file, and an artifact after an image, start new messages
+    plan = plan_messages([artifact(), text("between"), image(), artifact()])
+    assert [(p.content, len(p.files), len(p.embeds)) for p in plan] == [
+        (None, 1, 0),
+        ("between", 1, 1),
+        (None, 1, 0),
+    ]
+
+
+def test_text_is_joined_up_to_the_message_limit():
+    half = "x" * (MESSAGE_LIMIT // 2)
+    plan = plan_messages([text("a"), text("b"), text(half), text(half)])
+    assert [p.content for p in plan] == ["a\nb\n" + half, half]
+
+
+def test_file_count_and_upload_limits():
+    plan = plan_messages([artifact() for _ in range(MAX_FILES + 1)])
+    assert [len(p.files) for p in plan] == [MAX_FILES, 1]
+
+    plan = plan_messages([artifact(6), artifact(6)], upload_limit=10)
+    assert [p.size for p in plan] == [6, 6]
@@ -0,0 +1,129 @@
+"""
+GeminiChad
+Copyright (c) 2024 @notV3NOM
+
+See the README.md file for licensing and disclaimer information.
+"""
+
+import pytest
+
+from components import llm
+from components.model_cache import REFRESH_MARGIN, ModelCache
+
+LONG_SYSTEM = "x" * 400
+
+
+class StubModel:
+    """Stands in for genai.GenerativeModel, recording how it was built"""
+
+    def __init__(self, model_name, system_instruction=None, tools=None, **kwargs):
+        self.model_name = model_name
+        self.system_instruction = system_instruction
+        self.tools = tools
+        self.context_cached = False
+
+
+class ContextCacheFactory:
+    """A context cache factory that can be made to fail"""
+
+    def __init__(self, fail=False):
+        self.fail = fail
+        self.calls = 0
+
+    def __call__(self, model_name, system_instruction, tools, generation_config, ttl):
+        self.calls += 1
+        if self.fail:
+            raise ConnectionError("cache creation failed")
+        model = StubModel(model_name, system_instruction, tools)
+        model.context_cached = True
+        return model
+
+
+@pytest.fixture(autouse=True)
+def stub_generative_model(monkeypatch):
+    monkeypatch.setattr(llm.genai, "GenerativeModel", StubModel)
+
+
+def clock():
+    return "12:00"
+
+
+def calculator():
+    return "42"
+
+
+def test_equal_configurations_share_a_model():
+    cache = ModelCache(llm.create_model, 8)
+    config = {"temperature": 0}
+    model = cache.get("models/a", "be nice", [clock, calculator], config)
+
+    assert isinstance(model, StubModel)
+    assert cache.get("models/a", "be " + "nice", [clock, calculator], config) is model
+    assert cache.get("models/a", "be nice", [calculator, clock], config) is not model
+    assert cache.get("models/a", "be kind", [clock, calculator], config) is not model
+    assert cache.get("models/b", "be nice", [clock, calculator], config) is not model
+    assert (cache.hits, cache.misses) == (1, 4)
+
+
+def test_least_recently_used_model_is_evicted():
+    cache = ModelCache(llm.create_model, 2)
+    first = cache.get("models/a", "first")
+    second = cache.get("models/a", "second")
+    assert cache.get("models/a", "first") is first
+
+    cache.get("models/a", "third")
+    assert len(cache.entries) == 2
+    assert cache.get("models/a", "first") is first
+    assert cache.get("models/a", "second") is not second
+
+
+def test_variant_keeps_the_configuration_on_another_model():
+    cache = ModelCache(llm.create_model, 8)
+    model = cache.get("models/a", "be nice", [clock])
+
+    variant = cache.variant(model, "models/b")
+    assert variant.model_name == "models/b"
+    assert variant.system_instruction == "be nice"
+    assert variant.tools == [clock]
+    assert cache.variant(variant, "models/a") is model
+
+    foreign = StubModel("models/c")
+    assert cache.variant(foreign, "models/a") is foreign
+
+
+def test_only_long_system_instructions_are_context_cached():
+    factory = ContextCacheFactory()
+    cache = ModelCache(llm.create_model, 8, factory, min_tokens=100)
+
+    assert not cache.get("models/a", "x" * 396).context_cached
+    assert cache.get("models/a", LONG_SYSTEM).context_cached
+    assert (factory.calls, cache.context_caches) == (1, 1)
+
+
+def test_failed_context_cache_falls_back_and_is_retried():
+    factory = ContextCacheFactory(fail=True)
+    cache = ModelCache(llm.create_model, 8, factory, min_tokens=100, ttl=REFRESH_MARGIN)
+
+    model = cache.get("models/a", LONG_SYSTEM)
+    assert not model.context_cached
+    assert cache.context_caches == 0
+
+    factory.fail = False
+    retried = cache.get("models/a", LONG_SYSTEM)
+    assert retried.context_cached
+    assert factory.calls == 2
+
+
+def test_expired_context_cache_is_rebuilt():
+    factory = ContextCacheFactory()
+    cache = ModelCache(llm.create_model, 8, factory, min_tokens=100, ttl=REFRESH_MARGIN)
+
+    model = cache.get("models/a", LONG_SYSTEM)
+    rebuilt = cache.get("models/a", LONG_SYSTEM)
+    assert rebuilt.context_cached
+    assert rebuilt is not model
+    assert (factory.calls, cache.hits) == (2, 0)
+
+    cache.ttl = 3600
+    fresh = cache.get("models/a", LONG_SYSTEM)
+    assert cache.get("models/a", LONG_SYSTEM) is fresh
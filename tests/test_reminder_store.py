@@ -0,0 +1,50 @@
+"""
+GeminiChad
+Copyright (c) 2024 @notV3NOM
+
+See the README.md file for licensing and disclaimer information.
+"""
+
+import json
+
+import pytest
+
+from components.reminder_store import ReminderStore, SQLiteReminderStore
+
+REMINDER = {
+    "user_id": 1,
+    "message": "water the plants",
+    "time": "2026-10-18T15:00:00",
+    "channel_id": 2,
+}
+
+
+def test_reminder_store_is_abstract():
+    with pytest.raises(TypeError):
+        ReminderStore()
+
+
+def test_database_is_opened_and_migrated_on_first_use(tmp_path):
+    path = tmp_path / "reminders.db"
+    legacy_path = tmp_path / "reminders.json"
+    legacy_path.write_text(json.dumps([REMINDER]))
+
+    store = SQLiteReminderStore(str(path), legacy_path=str(legacy_path))
+    assert not path.exists()
+    assert legacy_path.exists()
+
+    assert store.pending() == 1
+    assert path.exists()
+    assert not legacy_path.exists()
+
+
+def test_delivered_reminders_are_not_due(tmp_path):
+    store = SQLiteReminderStore(str(tmp_path / "reminders.db"))
+    reminder_id = store.add(REMINDER)
+    [(due_id, _, reminder)] = store.due_before(float("inf"), 10)
+    assert due_id == reminder_id
+    assert reminder == REMINDER
+
+    store.mark_delivered(reminder_id)
+    assert store.due_before(float("inf"), 10) == []
+    assert store.pending() == 0
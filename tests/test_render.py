@@ -0,0 +1,54 @@
+"""
+GeminiChad
+Copyright (c) 2024 @notV3NOM
+
+See the README.md file for licensing and disclaimer information.
+"""
+
+from components.render import chunk_text, clean_text, has_attachments
+
+CODE = "```python\n" + "\n".join(f"print({i})" for i in range(40)) + "\n```"
+
+
+def test_short_text_is_one_chunk():
+    assert chunk_text("hello\nworld") == ["hello\nworld"]
+    assert chunk_text("") == []
+
+
+def test_chunks_respect_the_limit():
+    text = "\n".join("word " * 20 for _ in range(50))
+    chunks = chunk_text(text, limit=300)
+    assert all(len(chunk) <= 300 for chunk in chunks)
+    assert " ".join(" ".join(chunks).split()) == " ".join(text.split())
+
+
+def test_code_blocks_are_not_cut():
+    text = "intro\n" + CODE + "\noutro"
+    chunks = chunk_text(text, limit=len(CODE) + 5)
+    assert CODE in chunks
+
+
+def test_oversized_code_blocks_are_refenced():
+    chunks = chunk_text(CODE, limit=100)
+    assert len(chunks) > 1
+    for chunk in chunks:
+        assert len(chunk) <= 100
+        assert chunk.startswith("```python\n")
+        assert chunk.endswith("\n```")
+
+
+def test_list_items_stay_with_their_continuation():
+    item = "- item\n  continued " + "x" * 40
+    chunks = chunk_text("a" * 50 + "\n" + item, limit=70)
+    assert item in chunks
+
+
+def test_attachments_are_detected():
+    assert has_attachments("see\n```python\nprint(1)\n```")
+    assert has_attachments("<IMAGE>image-1.png||a cat</IMAGE>")
+    assert not has_attachments("plain `code` text")
+
+
+def test_clean_text_keeps_code_spacing():
+    assert clean_text("a  b\n\n\n\nc") == "a b\n\nc"
+    assert clean_text("```\nx  =  1\n```") == "```\nx  =  1\n```"
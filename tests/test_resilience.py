@@ -0,0 +1,97 @@
+"""
+GeminiChad
+Copyright (c) 2024 @notV3NOM
+
+See the README.md file for licensing and disclaimer information.
+"""
+
+import pytest
+
+from google.api_core.exceptions import InvalidArgument, ServiceUnavailable
+
+from components.cache import TTLCache
+from components.resilience import (
+    CLOSED,
+    OPEN,
+    HALF_OPEN,
+    CircuitOpenError,
+    Dependency,
+    is_outage,
+)
+
+
+def failing(error):
+    def fn():
+        raise error
+
+    return fn
+
+
+def test_outages_are_failures():
+    assert is_outage(ServiceUnavailable("down"))
+    assert is_outage(TimeoutError())
+    assert is_outage(ConnectionResetError())
+    assert not is_outage(InvalidArgument("bad prompt"))
+    assert not is_outage(ValueError("bad input"))
+
+
+def test_circuit_opens_after_consecutive_outages():
+    breaker = Dependency("test", failure_threshold=2, reset_timeout=60)
+    for _ in range(2):
+        with pytest.raises(ServiceUnavailable):
+            breaker.call(failing(ServiceUnavailable("down")))
+    assert breaker.state == OPEN
+    assert not breaker.available
+    with pytest.raises(CircuitOpenError):
+        breaker.call(lambda: "never called")
+    assert breaker.rejected == 1
+
+
+def test_request_errors_do_not_open_the_circuit():
+    breaker = Dependency("test", retries=2, failure_threshold=2)
+    calls = []
+
+    def bad_request():
+        calls.append(1)
+        raise InvalidArgument("bad prompt")
+
+    for _ in range(3):
+        with pytest.raises(InvalidArgument):
+            breaker.call(bad_request)
+    assert breaker.state == CLOSED
+    assert breaker.failures == 0
+    # and are not retried
+    assert len(calls) == 3
+
+
+def test_probe_closes_or_reopens_the_circuit():
+    breaker = Dependency("test", failure_threshold=1, reset_timeout=0)
+    with pytest.raises(TimeoutError):
+        breaker.call(failing(TimeoutError()))
+    assert breaker.state == OPEN and breaker.available
+
+    with pytest.raises(TimeoutError):
+        breaker.call(failing(TimeoutError()))
+    assert breaker.state == OPEN
+
+    assert breaker.call(lambda: "ok") == "ok"
+    assert breaker.state == CLOSED
+
+
+def test_half_open_admits_a_single_probe():
+    breaker = Dependency("test", failure_threshold=1, reset_timeout=0)
+    with pytest.raises(TimeoutError):
+        breaker.call(failing(TimeoutError()))
+    breaker.acquire()
+    assert breaker.state == HALF_OPEN
+    with pytest.raises(CircuitOpenError):
+        breaker.acquire()
+    breaker.record_success()
+    assert breaker.state == CLOSED
+
+
+def test_stale_cache_entries_serve_as_fallback():
+    cache = TTLCache(ttl=-1, max_size=4)
+    assert cache.get_or_compute("query", lambda: "results") == "results"
+    assert cache.stale("query") == "results"
+    assert cache.stale("other") is None
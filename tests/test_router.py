@@ -0,0 +1,43 @@
+"""
+GeminiChad
+Copyright (c) 2024 @notV3NOM
+
+See the README.md file for licensing and disclaimer information.
+"""
+
+from components.router import ModelRouter, FAST, STRONG, CHAT_TASK, WEB_TASK
+
+
+def router(**kwargs):
+    routes = {CHAT_TASK: "auto", WEB_TASK: STRONG}
+    settings = dict(fast_max_chars=100, fast_max_context=1000, fast_tools=False)
+    settings.update(kwargs)
+    return ModelRouter({FAST: "fast-model", STRONG: "strong-model"}, routes, **settings)
+
+
+def test_short_requests_use_the_fast_tier():
+    assert router().route(CHAT_TASK, "hi") == FAST
+
+
+def test_tools_and_large_context_keep_the_strong_tier():
+    model_router = router()
+    assert model_router.route(CHAT_TASK, "hi", tools=True) == STRONG
+    assert model_router.route(CHAT_TASK, "hi", context_tokens=5000) == STRONG
+    assert model_router.route(CHAT_TASK, "x" * 101) == STRONG
+    assert model_router.route(CHAT_TASK, "```code```") == STRONG
+    assert router(fast_tools=True).route(CHAT_TASK, "hi", tools=True) == FAST
+
+
+def test_decisions_are_counted_with_their_reason():
+    model_router = router()
+    model_router.route(CHAT_TASK, "hi", tools=True)
+    model_router.route(CHAT_TASK, "hi", tools=True)
+    model_router.route(WEB_TASK, "hi")
+    assert model_router.decisions == {
+        (CHAT_TASK, STRONG, "tools"): 2,
+        (WEB_TASK, STRONG, "task"): 1,
+    }
+    assert (
+        model_router.decision_summary().splitlines()[0] == "chat -> strong (tools): 2"
+    )
+    assert 'reason="tools"} 2' in model_router.prometheus()
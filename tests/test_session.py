@@ -0,0 +1,106 @@
+"""
+GeminiChad
+Copyright (c) 2024 @notV3NOM
+
+See the README.md file for licensing and disclaimer information.
+"""
+
+import asyncio
+
+from google.generativeai import protos
+
+from components.llm import revise
+from components.session import SessionStore, CHAT_SESSION, SYSTEM_MESSAGE
+
+
+def message(role, text):
+    return protos.Content(role=role, parts=[protos.Part(text=text)])
+
+
+class BrokenChatSession:
+    """A chat session whose history can neither be read nor serialized"""
+
+    def __init__(self):
+        self._history = [object()]
+
+    @property
+    def history(self):
+        raise RuntimeError("broken")
+
+
+def persisted_channels(store):
+    return {row[0] for row in store.db.execute("SELECT channel_id FROM sessions")}
+
+
+def test_database_is_opened_on_first_use(tmp_path):
+    path = tmp_path / "sessions.db"
+    store = SessionStore(path=str(path))
+    assert not path.exists()
+    assert 1 not in store
+    assert path.exists()
+
+
+def test_broken_session_does_not_break_access_or_sweep(tmp_path):
+    store = SessionStore(path=str(tmp_path / "sessions.db"))
+    store[1]
+    store[2][CHAT_SESSION] = BrokenChatSession()
+
+    assert store[2][CHAT_SESSION]._history
+    asyncio.run(store.sweep())
+    assert persisted_channels(store) == {1}
+
+
+def test_flush_skips_a_broken_session(tmp_path):
+    store = SessionStore(path=str(tmp_path / "sessions.db"))
+    store[1]
+    store[2][CHAT_SESSION] = BrokenChatSession()
+
+    store.flush()
+    assert persisted_channels(store) == {1}
+
+
+def test_evicted_sessions_are_written_by_the_sweep(tmp_path):
+    store = SessionStore(path=str(tmp_path / "sessions.db"), max_sessions=1)
+    store[1][SYSTEM_MESSAGE] = "first"
+    store[2]
+
+    assert 1 not in store.sessions
+    assert persisted_channels(store) == set()
+    assert 1 in store
+    asyncio.run(store.sweep())
+    assert persisted_channels(store) == {1, 2}
+    assert store[1][SYSTEM_MESSAGE] == "first"
+
+
+def test_evicted_session_is_revived_before_it_is_written(tmp_path):
+    store = SessionStore(path=str(tmp_path / "sessions.db"), max_sessions=1)
+    session = store[1]
+    session[SYSTEM_MESSAGE] = "first"
+    store[2]
+
+    assert store[1] is session
+    assert persisted_channels(store) == set()
+
+
+def test_accessed_session_is_never_evicted(tmp_path):
+    store = SessionStore(path=str(tmp_path / "sessions.db"), memory_budget=0)
+    store[1]
+    store[2][SYSTEM_MESSAGE] = "kept"
+
+    assert 2 in store.sessions
+    assert store[2][SYSTEM_MESSAGE] == "kept"
+
+
+def test_compaction_of_the_same_length_is_saved(tmp_path):
+    store = SessionStore(path=str(tmp_path / "sessions.db"))
+    chat_session = store[1][CHAT_SESSION]
+    chat_session.history = [message("user", "hi"), message("model", "hello")]
+    revise(chat_session)
+    asyncio.run(store.sweep())
+
+    chat_session.history = [message("user", "recap"), message("model", "noted")]
+    revise(chat_session)
+    asyncio.run(store.sweep())
+
+    history = SessionStore(path=store.path).load(1)[CHAT_SESSION].history
+    assert [content.parts[0].text for content in history] == ["recap", "noted"]
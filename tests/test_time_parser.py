@@ -0,0 +1,78 @@
+"""
+GeminiChad
+Copyright (c) 2024 @notV3NOM
+
+See the README.md file for licensing and disclaimer information.
+"""
+
+import datetime as dt
+
+import pytest
+
+from components.time_parser import (
+    GRAMMAR,
+    DATEPARSER,
+    parse_reminder,
+    parse_with_dateparser,
+)
+
+NOW = dt.datetime(2026, 10, 18, 14, 0)
+
+
+@pytest.mark.parametrize(
+    "message, time, title",
+    [
+        (
+            "in 20 minutes check the oven",
+            dt.datetime(2026, 10, 18, 14, 20),
+            "Check the oven",
+        ),
+        ("tomorrow at 9am standup", dt.datetime(2026, 10, 19, 9, 0), "Standup"),
+        ("at 17:30 call mom", dt.datetime(2026, 10, 18, 17, 30), "Call mom"),
+        ("at 5 tea", dt.datetime(2026, 10, 18, 17, 0), "Tea"),
+        ("next friday groceries", dt.datetime(2026, 10, 23, 9, 0), "Groceries"),
+        ("dentist on March 3 at 10am", dt.datetime(2027, 3, 3, 10, 0), "Dentist"),
+        ("flight on 2026-11-02 at 07:15", dt.datetime(2026, 11, 2, 7, 15), "Flight"),
+        ("party on 12/25 at 5pm", dt.datetime(2026, 12, 25, 17, 0), "Party"),
+        ("submit on 25.12.2026 at 17:00", dt.datetime(2026, 12, 25, 17, 0), "Submit"),
+        ("call mom on 3 March", dt.datetime(2027, 3, 3, 9, 0), "Call mom"),
+        ("exam in 2 weeks at 9am", dt.datetime(2026, 11, 1, 9, 0), "Exam"),
+        ("in a minute and a half", dt.datetime(2026, 10, 18, 14, 1, 30), "Reminder"),
+        ("in 2 and a half hours stretch", dt.datetime(2026, 10, 18, 16, 30), "Stretch"),
+        ("pay rent on the 1st", dt.datetime(2026, 11, 1, 9, 0), "Pay rent"),
+    ],
+)
+def test_grammar(message, time, title):
+    assert parse_reminder(message, NOW) == (time, title, GRAMMAR)
+
+
+@pytest.mark.parametrize(
+    "message",
+    [
+        # Relative offsets under a day do not combine with a time of day
+        "in 2 hours at 9am",
+        # Both numbers could be the month
+        "on 3/4 at 5pm",
+        "tomorrow on March 3",
+    ],
+)
+def test_grammar_leaves_ambiguous_messages(message):
+    result = parse_reminder(message, NOW)
+    assert result is None or result[2] == DATEPARSER
+
+
+@pytest.mark.parametrize(
+    "message",
+    [
+        # dateparser reads "10" as the year 2110 and drops the time
+        "dentist on March 3 at 10am",
+        # and "the 1st" as a date in 2027
+        "pay rent on the 1st",
+        # and only part of the date
+        "submit on 25.12.2026 at 17:00",
+        # and picks an arbitrary day
+        "remind me in March to file taxes",
+    ],
+)
+def test_dateparser_rejects_untrusted_matches(message):
+    assert parse_with_dateparser(message, NOW) is None
@@ -0,0 +1,51 @@
+"""
+GeminiChad
+Copyright (c) 2024 @notV3NOM
+
+See the README.md file for licensing and disclaimer information.
+"""
+
+import asyncio
+
+import pytest
+
+from components.web import check_url, read_body
+
+
+class ChunkedContent:
+    """A response body delivered in chunks, like aiohttp's StreamReader"""
+
+    def __init__(self, chunks):
+        self.chunks = chunks
+
+    async def iter_chunked(self, size):
+        for chunk in self.chunks:
+            yield chunk
+
+
+@pytest.mark.parametrize(
+    "url",
+    [
+        "file:///etc/passwd",
+        "ftp://example.com/",
+        "http://127.0.0.1:8080/admin",
+        "http://localhost/",
+        "http://10.0.0.1/",
+        "http://169.254.169.254/latest/meta-data/",
+        "http://[::1]/",
+        "http://[::ffff:192.168.0.1]/",
+    ],
+)
+def test_check_url_rejects_local_and_unsupported_urls(url):
+    with pytest.raises(ValueError):
+        asyncio.run(check_url(url))
+
+
+def test_check_url_accepts_public_addresses():
+    asyncio.run(check_url("https://93.184.215.14/page"))
+
+
+def test_read_body_reads_past_the_first_chunk():
+    content = ChunkedContent([b"a" * 10, b"b" * 10, b"c" * 10])
+    assert asyncio.run(read_body(content, 100)) == b"a" * 10 + b"b" * 10 + b"c" * 10
+    assert asyncio.run(read_body(content, 15)) == b"a" * 10 + b"b" * 5